@@ -0,0 +1,75 @@
+"""Compare two benchmark reports case by case.
+
+Usage (from backend/):
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+
+Exits with 1 when any case's p50 or p95 latency regressed by more than the threshold (percent).
+"""
+import argparse
+import json
+import sys
+
+
+def load_cases(path: str) -> dict:
+    with open(path) as f:
+        report = json.load(f)
+    return {
+        (case["task_type"], case.get("variant", "fp32"), case.get("input_format", "png"), case["width"], case["height"]): case
+        for case in report["cases"]
+    }
+
+
+def change(old: float, new: float) -> float:
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Diff two benchmark JSON reports")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    baseline = load_cases(args.baseline)
+    candidate = load_cases(args.candidate)
+
+    regressions = 0
+    print(f"{'case':<34} {'p50 (s)':>18} {'p95 (s)':>18} {'rss (MB)':>16}")
+    for key in sorted(set(baseline) | set(candidate)):
+        task_type, variant, input_format, width, height = key
+        name = f"{task_type} {width}x{height}" + (f" {input_format}" if input_format != "png" else "")
+        name += f" {variant}" if variant != "fp32" else ""
+        old, new = baseline.get(key), candidate.get(key)
+        if old is None or new is None or old["status"] != "ok" or new["status"] != "ok":
+            states = [case["status"] if case else "missing" for case in (old, new)]
+            print(f"{name:<34} {' -> '.join(states)}")
+            continue
+
+        p50 = change(old["latency_s"]["p50"], new["latency_s"]["p50"])
+        p95 = change(old["latency_s"]["p95"], new["latency_s"]["p95"])
+        rss = change(old["peak_rss_mb"], new["peak_rss_mb"])
+        flag = "  REGRESSION" if max(p50, p95) > args.threshold else ""
+        regressions += bool(flag)
+        print(
+            f"{name:<34} {new['latency_s']['p50']:>9.3f} ({p50:+6.1f}%)"
+            f" {new['latency_s']['p95']:>9.3f} ({p95:+6.1f}%)"
+            f" {new['peak_rss_mb']:>7.0f} ({rss:+6.1f}%){flag}"
+        )
+
+        for stage in sorted(set(old["stages_p50_s"]) | set(new["stages_p50_s"])):
+            before = old["stages_p50_s"].get(stage, 0.0)
+            after = new["stages_p50_s"].get(stage, 0.0)
+            print(f"    {stage:<30} {after:>9.3f} ({change(before, after):+6.1f}%)")
+
+        quality = new.get("quality_vs_fp32")
+        if quality:
+            print(
+                f"    {'vs fp32':<30} x{new['speedup_vs_fp32']:.2f} p50,"
+                f" alpha MAE {quality['alpha_mae']:.2f}, mask IoU {quality['mask_iou']:.4f}"
+            )
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""CPU benchmark for every task type, run in-process without a broker or Redis.
+
+Usage (from backend/):
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --tasks remove_background --sizes 640x480,1920x1080 --repeat 10
+    python -m benchmarks.run --tasks remove_background --rembg-int8
+
+Each case runs the Celery task itself (Task.apply) against the in-memory blob store, so the
+timings include what the workers really do: blob io, reduced JPEG decode, encode and
+precompression. PNG inputs come from --sizes; remove_background also gets large JPEG
+inputs (--jpeg-sizes), the only ones that take the reduced-decode path.
+
+With --rembg-int8 each remove_background case also runs with the int8 model (REMBG_INT8) and
+reports how far its alpha channel drifts from the fp32 one.
+
+Each (task type, size) case runs in a fresh process so peak RSS belongs to that case alone.
+"""
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+TASK_TYPES = ("remove_background", "enhance", "vectorize", "vectorize_enhance")
+DEFAULT_SIZES = "256x256,640x480,1280x720,720x1280,1920x1080"
+# Por encima de REDUCED_DECODE_MIN_FACTOR veces la entrada del modelo: usa la decodificación reducida.
+DEFAULT_JPEG_SIZES = "4000x3000"
+JPEG_TASK_TYPES = ("remove_background",)
+SCHEMA_VERSION = 3
+VARIANTS = ("fp32", "int8")
+
+# Sin broker: resultados de Celery en memoria y el store de blobs del proceso.
+BENCH_ENVIRONMENT = {
+    "STORAGE_BACKEND": "memory",
+    "CELERY_RESULT_BACKEND": "cache+memory://",
+    "RESULT_CACHE_ENABLED": "false",
+    "ADMISSION_ENABLED": "false",
+}
+# Sin Redis las llamadas que quedan (eventos, cancelación) fallan y no cortan la tarea, pero
+# suman sus reintentos a la latencia total; con REDIS_URL en el entorno se usa ese Redis.
+BENCH_REDIS_URL = "redis://127.0.0.1:1/0"
+
+
+def parse_sizes(value: str) -> List[Tuple[int, int]]:
+    sizes = []
+    for item in value.split(","):
+        width, height = item.lower().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Deterministic RGB test image: gradient background, a few solid shapes and sensor-like noise."""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    img = np.empty((height, width, 3), dtype=np.float32)
+    img[:, :, 0] = 40 + 120 * x
+    img[:, :, 1] = 60 + 100 * y
+    img[:, :, 2] = 160 - 80 * x * y
+
+    for _ in range(6):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(width // 12 + 1, width // 4 + 2)), int(rng.integers(height // 12 + 1, height // 4 + 2)))
+        cv2.ellipse(img, center, axes, float(rng.integers(0, 180)), 0, 360, color, -1)
+
+    img += rng.normal(0, 4, img.shape).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def encode_input(img: np.ndarray, input_format: str) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    if input_format == "jpeg":
+        Image.fromarray(img).save(buffer, format="JPEG", quality=90)
+    else:
+        Image.fromarray(img).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def apply_task(task_type: str, input_key: str, output_key: str, options: dict) -> None:
+    """Run the task a worker would get for task_type, in this process."""
+    from src.tasks import enhance_image, process_image, vectorize_image
+
+    scale = options.get("scale", 4)
+    if task_type == "remove_background":
+        task, kwargs = process_image, {"matting": options.get("matting")}
+    elif task_type == "enhance":
+        task, kwargs = enhance_image, {"scale": scale}
+    else:
+        task, kwargs = vectorize_image, {"enhance_before": task_type == "vectorize_enhance", "enhance_scale": scale}
+    task.apply(args=(input_key, output_key), kwargs=kwargs, throw=True)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss está en KB en Linux y en bytes en macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def alpha_quality(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    """How far an alpha channel drifts from the reference: mean absolute error (0-255) and mask IoU."""
+    diff = np.abs(reference.astype(np.int16) - candidate.astype(np.int16))
+    ref_mask = reference > 127
+    cand_mask = candidate > 127
+    union = np.logical_or(ref_mask, cand_mask).sum()
+    return {
+        "alpha_mae": float(diff.mean()),
+        "alpha_max_error": int(diff.max()),
+        "mask_iou": float(np.logical_and(ref_mask, cand_mask).sum() / union) if union else 1.0,
+    }
+
+
+def run_case(
+    task_type: str,
+    width: int,
+    height: int,
+    repeat: int,
+    options: dict,
+    results,
+    variant: str = "fp32",
+    alpha_path: str = None,
+    input_format: str = "png",
+) -> None:
+    """Child process body: warm up once, then time `repeat` runs of the task from upload to stored result."""
+    # Settings se lee al importar src: el proceso es nuevo (spawn), así que basta con el entorno.
+    # Es un benchmark de CPU: el perfil cpu es además el único donde aplica REMBG_INT8.
+    os.environ.setdefault("DEVICE_PROFILE", "cpu")
+    os.environ.update(BENCH_ENVIRONMENT)
+    os.environ.setdefault("REDIS_URL", BENCH_REDIS_URL)
+    os.environ.setdefault("CELERY_BROKER_URL", os.environ["REDIS_URL"])
+    os.environ["REMBG_INT8"] = "true" if variant == "int8" else "false"
+    try:
+        from src.blobstore import blob_store
+        from src.profiling import collect_timings
+        from src.stages import TASK_TYPE_STAGES, output_extension
+        from src.storage import result_key, upload_key
+
+        logging.getLogger("src").setLevel(logging.ERROR)
+
+        stages = TASK_TYPE_STAGES[task_type]
+        input_key = upload_key(f"bench-input.{input_format}")
+        output_key = result_key(f"bench-output{output_extension(stages)}")
+        blob_store.write(input_key, encode_input(synthetic_image(width, height), input_format))
+
+        warmup_start = time.perf_counter()
+        apply_task(task_type, input_key, output_key, options)
+        warmup = time.perf_counter() - warmup_start
+
+        latencies = []
+        stage_samples: Dict[str, List[float]] = {}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with collect_timings() as timings:
+                apply_task(task_type, input_key, output_key, options)
+            latencies.append(time.perf_counter() - start)
+            for stage, seconds in timings.items():
+                stage_samples.setdefault(stage, []).append(seconds)
+
+        output = blob_store.read(output_key)
+        if alpha_path:
+            from PIL import Image
+
+            np.save(alpha_path, np.asarray(Image.open(io.BytesIO(output)).convert("RGBA"))[:, :, 3])
+
+        results.put({
+            "task_type": task_type,
+            "variant": variant,
+            "input_format": input_format,
+            "stages": stages,
+            "width": width,
+            "height": height,
+            "repeat": repeat,
+            "status": "ok",
+            "warmup_s": warmup,
+            "latency_s": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "mean": float(np.mean(latencies)),
+                "min": float(np.min(latencies)),
+                "max": float(np.max(latencies)),
+            },
+            "stages_p50_s": {stage: percentile(samples, 50) for stage, samples in stage_samples.items()},
+            "stages_p95_s": {stage: percentile(samples, 95) for stage, samples in stage_samples.items()},
+            "output_bytes": len(output),
+            "peak_rss_mb": peak_rss_mb(),
+        })
+    except Exception as e:
+        results.put({
+            "task_type": task_type,
+            "variant": variant,
+            "input_format": input_format,
+            "width": width,
+            "height": height,
+            "status": "error",
+            "error": f"{type(e).__name__}: {e}",
+            "peak_rss_mb": peak_rss_mb(),
+        })
+
+
+def environment() -> dict:
+    from src.config import settings
+
+    versions = {}
+    for package in ("numpy", "onnxruntime", "rembg", "torch", "vtracer", "cv2", "pymatting"):
+        try:
+            module = __import__(package)
+            versions[package] = getattr(module, "__version__", "unknown")
+        except ImportError:
+            versions[package] = None
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+        "settings": {
+            "REMBG_MODEL": settings.REMBG_MODEL,
+            "REALESRGAN_MODEL": settings.REALESRGAN_MODEL,
+            "REALESRGAN_MEMORY_BUDGET_MB": settings.REALESRGAN_MEMORY_BUDGET_MB,
+            "ALPHA_MATTING_MODE": settings.ALPHA_MATTING_MODE,
+            "REMBG_INT8_OP_TYPES": settings.REMBG_INT8_OP_TYPES,
+            "ORT_INTRA_OP_THREADS": settings.ORT_INTRA_OP_THREADS,
+            "ORT_INTER_OP_THREADS": settings.ORT_INTER_OP_THREADS,
+            "ORT_GRAPH_OPTIMIZATION": settings.ORT_GRAPH_OPTIMIZATION,
+            "ORT_MODEL_CACHE": settings.ORT_MODEL_CACHE,
+        },
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="CPU benchmark for the image processing task types")
+    parser.add_argument("--tasks", default=",".join(TASK_TYPES), help="comma separated task types")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated WIDTHxHEIGHT list (PNG inputs)")
+    parser.add_argument(
+        "--jpeg-sizes", default=DEFAULT_JPEG_SIZES,
+        help="WIDTHxHEIGHT list of JPEG inputs for remove_background ('' to skip)",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case after one warm-up")
+    parser.add_argument("--scale", type=int, default=4, choices=[2, 4, 8])
+    parser.add_argument("--matting", default=None, choices=["none", "fast", "full"])
+    parser.add_argument("--rembg-int8", action="store_true", help="also run remove_background with the int8 model")
+    parser.add_argument("--output", default="-", help="JSON output path, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    # El benchmark mide CPU aunque la máquina tenga GPU.
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+    task_types = [task for task in args.tasks.split(",") if task]
+    for task_type in task_types:
+        if task_type not in TASK_TYPES:
+            parser.error(f"unknown task type: {task_type}")
+
+    options = {"scale": args.scale}
+    if args.matting:
+        options["matting"] = args.matting
+
+    context = multiprocessing.get_context("spawn")
+    cases = []
+    with tempfile.TemporaryDirectory() as alpha_dir:
+        for task_type in task_types:
+            inputs = [(size, "png") for size in parse_sizes(args.sizes)]
+            if task_type in JPEG_TASK_TYPES and args.jpeg_sizes:
+                inputs += [(size, "jpeg") for size in parse_sizes(args.jpeg_sizes)]
+            for (width, height), input_format in inputs:
+                compare_int8 = args.rembg_int8 and task_type == "remove_background"
+                size_cases = {}
+                for variant in VARIANTS if compare_int8 else VARIANTS[:1]:
+                    print(f"{task_type} {width}x{height} {input_format} {variant}...", file=sys.stderr, flush=True)
+                    alpha_path = (
+                        os.path.join(alpha_dir, f"{width}x{height}-{input_format}-{variant}.npy") if compare_int8 else None
+                    )
+                    results = context.Queue()
+                    process = context.Process(
+                        target=run_case,
+                        args=(task_type, width, height, args.repeat, options, results, variant, alpha_path, input_format),
+                    )
+                    process.start()
+                    process.join()
+                    if results.empty():
+                        case = {
+                            "task_type": task_type,
+                            "variant": variant,
+                            "input_format": input_format,
+                            "width": width,
+                            "height": height,
+                            "status": "error",
+                            "error": f"worker exited with code {process.exitcode}",
+                        }
+                    else:
+                        case = results.get()
+                    size_cases[variant] = (case, alpha_path)
+                    cases.append(case)
+
+                if compare_int8 and all(case["status"] == "ok" for case, _ in size_cases.values()):
+                    reference = np.load(size_cases["fp32"][1])
+                    int8_case, int8_alpha = size_cases["int8"]
+                    int8_case["quality_vs_fp32"] = alpha_quality(reference, np.load(int8_alpha))
+                    int8_case["speedup_vs_fp32"] = (
+                        size_cases["fp32"][0]["latency_s"]["p50"] / int8_case["latency_s"]["p50"]
+                    )
+
+    report = {
+        "schema_version": SCHEMA_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": environment(),
+        "options": options,
+        "cases": cases,
+    }
+
+    payload = json.dumps(report, indent=2, sort_keys=True)
+    if args.output == "-":
+        print(payload)
+    else:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+
+    return 1 if any(case["status"] != "ok" for case in cases) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,15 @@
 #!/bin/bash
 set -e
 
-echo "=============================================="
-echo "Verificando disponibilidad de GPU..."
-echo "=============================================="
-python src/check_gpu.py || true
+# gpu: un proceso de inferencia con CUDA; cpu: varios procesos fp32 con hilos acotados.
+DEVICE_PROFILE="${DEVICE_PROFILE:-gpu}"
+
+if [ "$DEVICE_PROFILE" != "cpu" ]; then
+    echo "=============================================="
+    echo "Verificando disponibilidad de GPU..."
+    echo "=============================================="
+    python src/check_gpu.py || true
+fi
 
 if [ "$TEST_GPU" = "true" ]; then
     echo ""
@@ -15,12 +20,6 @@ if [ "$TEST_GPU" = "true" ]; then
     exit 0
 fi
 
-echo ""
-echo "=============================================="
-echo "Pre-cargando modelos para evitar descargas..."
-echo "=============================================="
-python src/preload_models.py
-
 echo ""
 echo "=============================================="
 echo "Iniciando Celery worker..."
@@ -31,4 +30,73 @@ echo "LD_LIBRARY_PATH: $LD_LIBRARY_PATH"
 echo "=============================================="
 echo ""
 
-exec celery -A src.celery_app worker --loglevel=info --concurrency=1
+# Colas a consumir en este contenedor: "gpu", "cpu" o "gpu,cpu" (ambos pools).
+WORKER_QUEUES="${WORKER_QUEUES:-gpu,cpu}"
+CPU_WORKER_CONCURRENCY="${CPU_WORKER_CONCURRENCY:-$(nproc)}"
+
+# Perfil CPU: la cola de inferencia se reparte en procesos de CPU_INFERENCE_THREADS hilos,
+# tantos como entren en los cores del contenedor (cada uno se fija a su porción de cores).
+inference_env=()
+if [ "$DEVICE_PROFILE" = "cpu" ]; then
+    export CPU_INFERENCE_THREADS="${CPU_INFERENCE_THREADS:-4}"
+    default_concurrency=$(( $(nproc) / CPU_INFERENCE_THREADS ))
+    INFERENCE_CONCURRENCY="${INFERENCE_CONCURRENCY:-$(( default_concurrency > 0 ? default_concurrency : 1 ))}"
+    inference_env=(OMP_NUM_THREADS="$CPU_INFERENCE_THREADS" MKL_NUM_THREADS="$CPU_INFERENCE_THREADS" CUDA_VISIBLE_DEVICES="")
+    # Cada perfil tiene su cola de inferencia: un resultado cacheado siempre sale del mismo modelo.
+    INFERENCE_QUEUE="${CPU_INFERENCE_QUEUE:-inference-cpu}"
+else
+    INFERENCE_CONCURRENCY="${INFERENCE_CONCURRENCY:-1}"
+    INFERENCE_QUEUE="${GPU_QUEUE:-gpu}"
+fi
+
+pids=()
+trap 'kill -TERM "${pids[@]}" 2>/dev/null' TERM INT
+
+# Métricas Prometheus: cada proceso del prefork escribe en este directorio y un
+# exportador único las agrega en :WORKER_METRICS_PORT/metrics.
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Cada proceso del worker carga y precalienta sus modelos al arrancar y marca su
+# pool como listo en WORKER_READY_DIR (ver worker_ready.sh).
+export WORKER_READY_DIR="${WORKER_READY_DIR:-/tmp/worker-ready}"
+rm -rf "$WORKER_READY_DIR"
+
+# celery-batches solo junta lo que el worker ya reservó: con micro-batching el pool de
+# inferencia reserva REMBG_BATCH_SIZE mensajes por proceso (a costa de que una tarea de
+# más prioridad no pueda adelantarse a esas). Sin batching reserva solo la que ejecuta.
+REMBG_BATCH_SIZE="${REMBG_BATCH_SIZE:-1}"
+GPU_PREFETCH=$(( REMBG_BATCH_SIZE > 1 ? REMBG_BATCH_SIZE : 1 ))
+
+if [[ ",$WORKER_QUEUES," == *",gpu,"* ]]; then
+    echo "Iniciando pool de inferencia (cola: $INFERENCE_QUEUE, perfil: $DEVICE_PROFILE, concurrency: $INFERENCE_CONCURRENCY, prefetch: $GPU_PREFETCH)"
+    env "${inference_env[@]}" celery -A src.celery_app worker --loglevel=info \
+        -Q "$INFERENCE_QUEUE" --concurrency="$INFERENCE_CONCURRENCY" --prefetch-multiplier="$GPU_PREFETCH" -n "gpu@%h" &
+    pids+=($!)
+fi
+
+if [[ ",$WORKER_QUEUES," == *",cpu,"* ]]; then
+    echo "Iniciando pool CPU (cola: ${CPU_QUEUE:-cpu}, concurrency: $CPU_WORKER_CONCURRENCY)"
+    # vtracer es single-thread; evitar que torch/ONNX sobresuscriban los cores.
+    OMP_NUM_THREADS=1 celery -A src.celery_app worker --loglevel=info \
+        -Q "${CPU_QUEUE:-cpu}" --concurrency="$CPU_WORKER_CONCURRENCY" -n "cpu@%h" &
+    pids+=($!)
+fi
+
+if [ ${#pids[@]} -eq 0 ]; then
+    echo "WORKER_QUEUES no contiene ninguna cola conocida: $WORKER_QUEUES"
+    exit 1
+fi
+
+echo "Exportando métricas del worker en el puerto ${WORKER_METRICS_PORT:-9100}"
+python -m src.metrics &
+pids+=($!)
+
+# Si un pool muere, detener el resto para que el contenedor se reinicie.
+set +e
+wait -n
+status=$?
+kill -TERM "${pids[@]}" 2>/dev/null
+wait
+exit $status
@@ -0,0 +1,234 @@
+import hashlib
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import redis
+from celery.signals import task_postrun, task_prerun, task_revoked
+from fastapi import HTTPException, Request
+
+from .celery_app import PRIORITY_SEPARATOR, PRIORITY_STEPS
+from .config import settings
+from .cpu_profile import inference_queue
+from .inflight import inflight_jobs
+from .metrics import ADMISSION_REJECTIONS
+from .signatures import PROCESS_IMAGE_BATCH
+from .stages import split_stages, uses_gpu
+
+logger = logging.getLogger(__name__)
+
+API_KEY_HEADER = "X-API-Key"
+
+INFLIGHT_PREFIX = "admission:inflight:"
+TASK_CLIENT_PREFIX = "admission:task-client:"
+SERVICE_TIME_PREFIX = "admission:service-time:"
+SERVICE_TIME_ALPHA = 0.2
+
+_client: Optional[redis.Redis] = None
+_started: Dict[str, float] = {}
+
+
+def _get_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    return _client
+
+
+@dataclass
+class ClientPolicy:
+    client_id: str
+    priority: int
+
+
+def client_policy(request: Request) -> ClientPolicy:
+    """Known API keys get their configured priority and their own in-flight quota; everyone else shares by IP."""
+    api_key = request.headers.get(API_KEY_HEADER)
+    if api_key and api_key in settings.API_KEY_PRIORITIES:
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        priority = min(max(settings.API_KEY_PRIORITIES[api_key], 0), PRIORITY_STEPS[-1])
+        return ClientPolicy(client_id=f"key:{digest}", priority=priority)
+
+    host = request.client.host if request.client else "unknown"
+    return ClientPolicy(client_id=f"ip:{host}", priority=settings.ADMISSION_DEFAULT_PRIORITY)
+
+
+def job_queues(stages: List[str]) -> List[str]:
+    if not uses_gpu(stages):
+        return [settings.CPU_QUEUE]
+    _, cpu_stages = split_stages(stages)
+    return [inference_queue(), settings.CPU_QUEUE] if cpu_stages else [inference_queue()]
+
+
+def priority_queue_name(queue: str, priority: int) -> str:
+    return queue if priority == 0 else f"{queue}{PRIORITY_SEPARATOR}{priority}"
+
+
+def queue_depth(queue: str, max_priority: int = PRIORITY_STEPS[-1]) -> int:
+    """Messages waiting in a queue that a job of max_priority would have to wait behind."""
+    pipe = _get_client().pipeline()
+    for step in PRIORITY_STEPS:
+        if step <= max_priority:
+            pipe.llen(priority_queue_name(queue, step))
+    return sum(pipe.execute())
+
+
+def queue_consumers(queue: str) -> int:
+    if queue == inference_queue():
+        return max(settings.ADMISSION_GPU_CONSUMERS, 1)
+    return max(settings.ADMISSION_CPU_CONSUMERS, 1)
+
+
+def service_time(queue: str) -> float:
+    """Moving average of the seconds one job holds a worker process, as measured by the workers."""
+    value = _get_client().get(SERVICE_TIME_PREFIX + queue)
+    return float(value) if value is not None else settings.ADMISSION_DEFAULT_SERVICE_TIME
+
+
+def estimated_wait(queue: str, priority: int) -> float:
+    """Seconds until a new job at this priority could start: the work already queued ahead of it."""
+    return queue_depth(queue, priority) * service_time(queue) / queue_consumers(queue)
+
+
+def _reject(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(int(math.ceil(retry_after)), 1))},
+    )
+
+
+def _inflight(client_id: str) -> int:
+    key = INFLIGHT_PREFIX + client_id
+    pipe = _get_client().pipeline()
+    # Tareas que nunca avisaron su fin (worker caído, cadena cortada) dejan de contar.
+    pipe.zremrangebyscore(key, 0, time.time() - settings.ADMISSION_INFLIGHT_TTL)
+    pipe.zcard(key)
+    return pipe.execute()[1]
+
+
+def _too_large(detail: str) -> HTTPException:
+    return HTTPException(status_code=413, detail=detail)
+
+
+def admit(policy: ClientPolicy, queues: List[str], jobs: int = 1) -> None:
+    """Raise 429 if the client is over its in-flight quota or the queues can't start the work within budget.
+
+    Every job counts against the quota, but the wait budget only covers the work queued
+    ahead: a batch's own length is the time the client asked for. A submission larger
+    than the whole quota gets 413 instead, since retrying it would not help.
+    """
+    if not settings.ADMISSION_ENABLED:
+        return
+
+    if jobs > settings.ADMISSION_MAX_INFLIGHT_PER_CLIENT:
+        ADMISSION_REJECTIONS.labels(reason="too_large").inc()
+        raise _too_large(f"Too many jobs in one request. Maximum: {settings.ADMISSION_MAX_INFLIGHT_PER_CLIENT}")
+
+    try:
+        inflight = _inflight(policy.client_id)
+        if inflight + jobs > settings.ADMISSION_MAX_INFLIGHT_PER_CLIENT:
+            retry_after = min(service_time(queue) for queue in queues)
+            ADMISSION_REJECTIONS.labels(reason="inflight").inc()
+            raise _reject(
+                f"Too many jobs in progress. Maximum: {settings.ADMISSION_MAX_INFLIGHT_PER_CLIENT}",
+                retry_after,
+            )
+        waits = {queue: estimated_wait(queue, policy.priority) for queue in queues}
+    except redis.RedisError as e:
+        logger.warning(f"Control de admisión no disponible, se admite la petición: {e}")
+        return
+
+    queue, wait = max(waits.items(), key=lambda item: item[1])
+    if wait > settings.ADMISSION_MAX_WAIT:
+        ADMISSION_REJECTIONS.labels(reason="queue_wait").inc()
+        logger.info(f"Rechazando {policy.client_id}: espera estimada {wait:.1f}s en la cola {queue}")
+        raise _reject("Server is busy, try again later", wait - settings.ADMISSION_MAX_WAIT)
+
+
+def track(policy: ClientPolicy, task_ids: List[str]) -> None:
+    """Count admitted tasks against the client until they finish (see settle)."""
+    if not settings.ADMISSION_ENABLED or not task_ids:
+        return
+
+    now = time.time()
+    try:
+        pipe = _get_client().pipeline()
+        pipe.zadd(INFLIGHT_PREFIX + policy.client_id, {task_id: now for task_id in task_ids})
+        pipe.expire(INFLIGHT_PREFIX + policy.client_id, settings.ADMISSION_INFLIGHT_TTL)
+        for task_id in task_ids:
+            pipe.set(TASK_CLIENT_PREFIX + task_id, policy.client_id, ex=settings.ADMISSION_INFLIGHT_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"No se pudieron registrar las tareas admitidas: {e}")
+
+
+def release(task_id: str) -> None:
+    if not settings.ADMISSION_ENABLED:
+        return
+
+    try:
+        client = _get_client()
+        client_id = client.getdel(TASK_CLIENT_PREFIX + task_id)
+        if client_id is not None:
+            client.zrem(INFLIGHT_PREFIX + client_id.decode("utf-8"), task_id)
+    except redis.RedisError as e:
+        logger.warning(f"No se pudo liberar la tarea {task_id} del control de admisión: {e}")
+
+
+@task_prerun.connect
+def mark_task_start(task_id=None, **kwargs):
+    _started[task_id] = time.monotonic()
+
+
+@task_postrun.connect
+def record_service_time(task_id=None, task=None, args=None, **kwargs):
+    started = _started.pop(task_id, None)
+    if started is None or task is None:
+        return
+    queue = (task.request.delivery_info or {}).get("routing_key")
+    if not queue:
+        return
+
+    jobs = len(args[0]) if task.name == PROCESS_IMAGE_BATCH and args else 1
+    sample = (time.monotonic() - started) / max(jobs, 1)
+    try:
+        client = _get_client()
+        previous = client.get(SERVICE_TIME_PREFIX + queue)
+        value = sample if previous is None else (
+            (1 - SERVICE_TIME_ALPHA) * float(previous) + SERVICE_TIME_ALPHA * sample
+        )
+        client.set(SERVICE_TIME_PREFIX + queue, value)
+    except redis.RedisError as e:
+        logger.warning(f"No se pudo registrar el tiempo de servicio de {queue}: {e}")
+
+
+def settle(task_id: str) -> None:
+    """Bookkeeping for a task that reached a terminal state: quota and in-flight record."""
+    release(task_id)
+    inflight_jobs.finish(task_id)
+
+
+@task_postrun.connect
+def settle_finished_task(task_id=None, task=None, args=None, kwargs=None, state=None, **extra):
+    if state == "RETRY":
+        return
+    if task is not None and task.name == PROCESS_IMAGE_BATCH:
+        # celery-batches corre el lote con su propio id; cada pedido terminó dentro de él.
+        task_ids = [request.id for request in (args[0] if args else [])]
+    else:
+        task_ids = [task_id]
+        # Si la primera mitad de una cadena GPU -> CPU falla, la tarea final nunca corre.
+        report_as = (kwargs or {}).get("report_as")
+        if report_as and state != "SUCCESS":
+            task_ids.append(report_as)
+    for finished_id in task_ids:
+        settle(finished_id)
+
+
+@task_revoked.connect
+def settle_revoked_task(request=None, **kwargs):
+    if request is not None:
+        settle(request.id)
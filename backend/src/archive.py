@@ -0,0 +1,59 @@
+import io
+import os
+import time
+import zipfile
+from typing import Iterable, Iterator, Tuple
+
+from .blobstore import blob_store
+
+CHUNK_SIZE = 64 * 1024
+
+# Estos formatos ya vienen comprimidos; deflate solo gastaría CPU.
+STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".avif"}
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Unseekable sink for ZipFile; the bytes written so far are drained into the response."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(entries: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """Yield a ZIP archive of (arcname, blob key) entries chunk by chunk, never holding a whole file."""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w") as zf:
+        for arcname, key in entries:
+            blob = blob_store.stat(key)
+            if blob is None:
+                continue
+            ext = os.path.splitext(key)[1].lower()
+            info = zipfile.ZipInfo(arcname, time.localtime(blob.modified)[:6])
+            info.file_size = blob.size
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+            with blob_store.open(key) as source, zf.open(info, mode="w") as dest:
+                while chunk := source.read(CHUNK_SIZE):
+                    dest.write(chunk)
+                    yield from _drained(buffer)
+            yield from _drained(buffer)
+    yield from _drained(buffer)
+
+
+def _drained(buffer: _StreamBuffer) -> Iterator[bytes]:
+    data = buffer.drain()
+    if data:
+        yield data
@@ -0,0 +1,27 @@
+import json
+from typing import List, Optional
+
+import redis
+
+from .config import settings
+
+BATCH_KEY_PREFIX = "batch:"
+
+_client: Optional[redis.Redis] = None
+
+
+def get_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def save_batch(batch_id: str, task_type: str, items: List[dict]) -> None:
+    manifest = {"batch_id": batch_id, "task_type": task_type, "items": items}
+    get_client().set(BATCH_KEY_PREFIX + batch_id, json.dumps(manifest), ex=settings.BATCH_TTL)
+
+
+def load_batch(batch_id: str) -> Optional[dict]:
+    raw = get_client().get(BATCH_KEY_PREFIX + batch_id)
+    return json.loads(raw) if raw else None
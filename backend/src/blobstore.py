@@ -0,0 +1,370 @@
+"""Blob storage behind uploads, intermediates and results (STORAGE_BACKEND).
+
+Keys look like `uploads/ab/cd/<name>` or `results/ab/cd/<name>` and travel through
+Celery in place of filesystem paths, so API and workers only need to share the store:
+a local directory (one node or a shared volume), an S3-compatible bucket, or an
+in-memory dict for tests and single-process runs.
+"""
+import io
+import logging
+import mimetypes
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+UPLOADS = "uploads"
+RESULTS = "results"
+
+# Un acceso a /result solo reescribe el atime si el anterior tiene más de esto.
+ACCESS_RESOLUTION_SECONDS = 60
+
+
+@dataclass
+class BlobInfo:
+    key: str
+    size: int
+    modified: float
+    accessed: float
+
+
+class BlobStore:
+    """Interface shared by every backend; reads raise FileNotFoundError for missing keys."""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of the blob when the backend has one, so it can be served with sendfile."""
+        return None
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def stat(self, key: str) -> Optional[BlobInfo]:
+        raise NotImplementedError
+
+    def open(self, key: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def read(self, key: str) -> bytes:
+        with self.open(key) as f:
+            return f.read()
+
+    def write(self, key: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def put_file(self, key: str, path: str) -> None:
+        """Move a finished local file into the store; the local copy is gone afterwards."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def iter_blobs(self, namespace: str, prefix: str = "") -> Iterator[BlobInfo]:
+        """Blobs of a namespace whose name under it starts with prefix (a shard, e.g. "a")."""
+        raise NotImplementedError
+
+    def touch(self, key: str) -> None:
+        """Record a read for the janitor's LRU, where the backend keeps access times."""
+
+    def presigned_url(self, key: str, filename: str, media_type: str, encoding: Optional[str] = None) -> Optional[str]:
+        """Short-lived URL the client can download from directly, or None to stream through the API."""
+        return None
+
+    def prune(self, prefix: str = "") -> None:
+        """Housekeeping after sweeping the shards that start with prefix."""
+
+
+class LocalBlobStore(BlobStore):
+    """UPLOAD_DIR and RESULT_DIR as before; blobs from the flat pre-shard layout still resolve."""
+
+    def __init__(self, roots: Dict[str, str]):
+        self.roots = roots
+
+    def _split(self, key: str) -> Tuple[str, str]:
+        namespace, _, rest = key.partition("/")
+        if namespace not in self.roots or not rest or ".." in rest.split("/"):
+            raise ValueError(f"Invalid storage key: {key}")
+        return self.roots[namespace], rest
+
+    def _target(self, key: str) -> str:
+        root, rest = self._split(key)
+        return os.path.join(root, rest)
+
+    def local_path(self, key: str) -> Optional[str]:
+        try:
+            root, rest = self._split(key)
+        except ValueError:
+            return None
+        for path in (os.path.join(root, rest), os.path.join(root, os.path.basename(rest))):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def stat(self, key: str) -> Optional[BlobInfo]:
+        path = self.local_path(key)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return BlobInfo(key, stat.st_size, stat.st_mtime, stat.st_atime)
+
+    def open(self, key: str) -> BinaryIO:
+        path = self.local_path(key)
+        if path is None:
+            raise FileNotFoundError(f"Blob not found: {key}")
+        return open(path, "rb")
+
+    def write(self, key: str, data: bytes) -> None:
+        path = self._target(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{os.getpid()}.part"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+
+    def put_file(self, key: str, path: str) -> None:
+        target = self._target(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def delete(self, key: str) -> None:
+        path = self.local_path(key)
+        if path is not None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def iter_blobs(self, namespace: str, prefix: str = "") -> Iterator[BlobInfo]:
+        root = self.roots[namespace]
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        # Los directorios ocultos (.spool) no son blobs.
+                        if entry.name.startswith("."):
+                            continue
+                        # El prefijo filtra el primer nivel: shards y archivos del layout plano.
+                        if directory == root and not entry.name.startswith(prefix):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            try:
+                                stat = entry.stat(follow_symlinks=False)
+                            except FileNotFoundError:
+                                continue
+                            key = f"{namespace}/{os.path.relpath(entry.path, root).replace(os.sep, '/')}"
+                            yield BlobInfo(key, stat.st_size, stat.st_mtime, stat.st_atime)
+            except FileNotFoundError:
+                continue
+
+    def touch(self, key: str) -> None:
+        # Escrito a mano porque el volumen puede estar montado con noatime.
+        path = self.local_path(key)
+        if path is None:
+            return
+        try:
+            stat = os.stat(path)
+            now = time.time()
+            if now - stat.st_atime > ACCESS_RESOLUTION_SECONDS:
+                os.utime(path, (now, stat.st_mtime))
+        except OSError:
+            pass
+
+    def prune(self, prefix: str = "") -> None:
+        for root in self.roots.values():
+            try:
+                with os.scandir(root) as entries:
+                    shards = [
+                        entry.path for entry in entries
+                        if entry.name.startswith(prefix) and not entry.name.startswith(".")
+                        and entry.is_dir(follow_symlinks=False)
+                    ]
+            except FileNotFoundError:
+                continue
+            for shard in shards:
+                for directory, dirs, files in os.walk(shard, topdown=False):
+                    if not dirs and not files:
+                        try:
+                            os.rmdir(directory)
+                        except OSError:
+                            pass
+
+
+class S3BlobStore(BlobStore):
+    """S3-compatible bucket (AWS, MinIO, R2...); results are handed out as presigned GET URLs."""
+
+    def __init__(self):
+        self._client = None
+        self._public_client = None
+
+    def _make_client(self, endpoint_url: str):
+        import boto3
+        from botocore.config import Config
+
+        return boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=settings.S3_REGION or None,
+            aws_access_key_id=settings.S3_ACCESS_KEY_ID or None,
+            aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY or None,
+            config=Config(signature_version="s3v4", s3={"addressing_style": settings.S3_ADDRESSING_STYLE}),
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._make_client(settings.S3_ENDPOINT_URL)
+        return self._client
+
+    @property
+    def public_client(self):
+        # Las URLs firmadas apuntan al endpoint que ve el navegador, no al de la red interna.
+        if self._public_client is None:
+            if settings.S3_PUBLIC_ENDPOINT_URL:
+                self._public_client = self._make_client(settings.S3_PUBLIC_ENDPOINT_URL)
+            else:
+                self._public_client = self.client
+        return self._public_client
+
+    def _object(self, key: str) -> str:
+        return settings.S3_PREFIX + key
+
+    def stat(self, key: str) -> Optional[BlobInfo]:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=settings.S3_BUCKET, Key=self._object(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        modified = head["LastModified"].timestamp()
+        return BlobInfo(key, head["ContentLength"], modified, modified)
+
+    def open(self, key: str) -> BinaryIO:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client.get_object(Bucket=settings.S3_BUCKET, Key=self._object(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(f"Blob not found: {key}") from e
+            raise
+        return response["Body"]
+
+    def write(self, key: str, data: bytes) -> None:
+        self.client.put_object(
+            Bucket=settings.S3_BUCKET,
+            Key=self._object(key),
+            Body=data,
+            ContentType=mimetypes.guess_type(key)[0] or "application/octet-stream",
+        )
+
+    def put_file(self, key: str, path: str) -> None:
+        # upload_file parte los archivos grandes en un multipart upload, sin leerlos enteros.
+        self.client.upload_file(
+            path,
+            settings.S3_BUCKET,
+            self._object(key),
+            ExtraArgs={"ContentType": mimetypes.guess_type(key)[0] or "application/octet-stream"},
+        )
+        os.remove(path)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=settings.S3_BUCKET, Key=self._object(key))
+
+    def iter_blobs(self, namespace: str, prefix: str = "") -> Iterator[BlobInfo]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=settings.S3_BUCKET, Prefix=self._object(f"{namespace}/{prefix}")):
+            for item in page.get("Contents", []):
+                modified = item["LastModified"].timestamp()
+                yield BlobInfo(item["Key"][len(settings.S3_PREFIX):], item["Size"], modified, modified)
+
+    def presigned_url(self, key: str, filename: str, media_type: str, encoding: Optional[str] = None) -> Optional[str]:
+        if not settings.S3_PRESIGN:
+            return None
+        params = {
+            "Bucket": settings.S3_BUCKET,
+            "Key": self._object(key),
+            "ResponseContentType": media_type,
+            "ResponseContentDisposition": f'attachment; filename="{filename}"',
+        }
+        if encoding:
+            params["ResponseContentEncoding"] = encoding
+        return self.public_client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=settings.S3_PRESIGN_EXPIRES,
+        )
+
+
+class MemoryBlobStore(BlobStore):
+    """Process-local stand-in for tests; not shared with workers or other API processes."""
+
+    def __init__(self):
+        self._blobs: Dict[str, Tuple[bytes, float, float]] = {}
+        self._lock = threading.Lock()
+
+    def stat(self, key: str) -> Optional[BlobInfo]:
+        with self._lock:
+            blob = self._blobs.get(key)
+        if blob is None:
+            return None
+        data, modified, accessed = blob
+        return BlobInfo(key, len(data), modified, accessed)
+
+    def open(self, key: str) -> BinaryIO:
+        with self._lock:
+            blob = self._blobs.get(key)
+        if blob is None:
+            raise FileNotFoundError(f"Blob not found: {key}")
+        return io.BytesIO(blob[0])
+
+    def write(self, key: str, data: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            self._blobs[key] = (bytes(data), now, now)
+
+    def put_file(self, key: str, path: str) -> None:
+        with open(path, "rb") as f:
+            self.write(key, f.read())
+        os.remove(path)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._blobs.pop(key, None)
+
+    def iter_blobs(self, namespace: str, prefix: str = "") -> Iterator[BlobInfo]:
+        with self._lock:
+            items = [(key, blob) for key, blob in self._blobs.items() if key.startswith(f"{namespace}/{prefix}")]
+        for key, (data, modified, accessed) in items:
+            yield BlobInfo(key, len(data), modified, accessed)
+
+    def touch(self, key: str) -> None:
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is not None:
+                self._blobs[key] = (blob[0], blob[1], time.time())
+
+
+def create_blob_store() -> BlobStore:
+    if settings.STORAGE_BACKEND == "local":
+        return LocalBlobStore({UPLOADS: settings.UPLOAD_DIR, RESULTS: settings.RESULT_DIR})
+    if settings.STORAGE_BACKEND == "s3":
+        if not settings.S3_BUCKET:
+            raise ValueError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        return S3BlobStore()
+    if settings.STORAGE_BACKEND == "memory":
+        return MemoryBlobStore()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+
+
+blob_store = create_blob_store()
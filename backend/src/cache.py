@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+import redis
+
+from .blobstore import RESULTS, blob_store
+from .config import settings
+from .storage import remove_with_variants, resolve, shard_key
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate every cached result when the processing pipeline changes.
+CACHE_VERSION = "1"
+
+CACHE_KEY_PREFIX = "result-cache:key:"
+CACHE_INDEX_KEY = "result-cache:index"
+CACHE_ENTRIES_KEY = "result-cache:entries"
+CACHE_TOTAL_KEY = "result-cache:total-bytes"
+
+
+def build_cache_key(content_hash: str, task_type: str, params: dict) -> str:
+    """Key a result on the input bytes, the task type and every parameter that changes the output."""
+    payload = json.dumps(
+        {"v": CACHE_VERSION, "content": content_hash, "task_type": task_type, "params": params},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed index over the stored results, bounded by TTL and total size (LRU)."""
+
+    def __init__(self, client: Optional[redis.Redis] = None):
+        self._client = client
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(settings.REDIS_URL)
+        return self._client
+
+    def get(self, key: str) -> Optional[str]:
+        if not settings.RESULT_CACHE_ENABLED:
+            return None
+
+        filename = self.client.get(CACHE_KEY_PREFIX + key)
+        if filename is None:
+            return None
+        filename = filename.decode("utf-8")
+
+        if resolve(RESULTS, filename) is None:
+            self.drop(filename)
+            return None
+
+        pipe = self.client.pipeline()
+        pipe.zadd(CACHE_INDEX_KEY, {filename: time.time()})
+        pipe.expire(CACHE_KEY_PREFIX + key, settings.RESULT_CACHE_TTL)
+        pipe.execute()
+        return filename
+
+    def put(self, key: str, output_key: str) -> None:
+        if not settings.RESULT_CACHE_ENABLED:
+            return
+        blob = blob_store.stat(output_key)
+        if blob is None:
+            return
+
+        filename = os.path.basename(output_key)
+        size = blob.size
+
+        previous = self.client.get(CACHE_KEY_PREFIX + key)
+        if previous is not None and previous.decode("utf-8") != filename:
+            self.drop(previous.decode("utf-8"))
+
+        # Los resultados se nombran por su clave: volver a guardar el mismo no debe sumar dos veces.
+        existing = self.client.hget(CACHE_ENTRIES_KEY, filename)
+        existing_size = json.loads(existing).get("size", 0) if existing else 0
+
+        pipe = self.client.pipeline()
+        pipe.set(CACHE_KEY_PREFIX + key, filename, ex=settings.RESULT_CACHE_TTL)
+        pipe.hset(CACHE_ENTRIES_KEY, filename, json.dumps({"key": key, "size": size}))
+        pipe.zadd(CACHE_INDEX_KEY, {filename: time.time()})
+        pipe.incrby(CACHE_TOTAL_KEY, size - existing_size)
+        pipe.execute()
+
+        self.evict()
+
+    def evict(self) -> int:
+        evicted = 0
+        cutoff = time.time() - settings.RESULT_CACHE_TTL
+        for filename in self.client.zrangebyscore(CACHE_INDEX_KEY, "-inf", cutoff):
+            self.drop(filename.decode("utf-8"))
+            evicted += 1
+
+        while int(self.client.get(CACHE_TOTAL_KEY) or 0) > settings.RESULT_CACHE_MAX_BYTES:
+            oldest = self.client.zrange(CACHE_INDEX_KEY, 0, 0)
+            if not oldest:
+                break
+            self.drop(oldest[0].decode("utf-8"))
+            evicted += 1
+
+        if evicted:
+            logger.info(f"Cache de resultados: {evicted} entradas eliminadas")
+        return evicted
+
+    def drop(self, filename: str) -> None:
+        raw = self.client.hget(CACHE_ENTRIES_KEY, filename)
+        entry = json.loads(raw) if raw else {}
+
+        pipe = self.client.pipeline()
+        if entry.get("key"):
+            pipe.delete(CACHE_KEY_PREFIX + entry["key"])
+        pipe.hdel(CACHE_ENTRIES_KEY, filename)
+        pipe.zrem(CACHE_INDEX_KEY, filename)
+        if entry.get("size"):
+            pipe.decrby(CACHE_TOTAL_KEY, entry["size"])
+        pipe.execute()
+
+        remove_with_variants(shard_key(RESULTS, filename))
+
+
+result_cache = ResultCache()
@@ -1,6 +1,8 @@
 from celery import Celery
 import logging
 from .config import settings
+from .cpu_profile import inference_queue
+from .stages import uses_gpu
 
 logging.basicConfig(
     level=logging.INFO,
@@ -12,9 +14,28 @@ celery_app = Celery(
     "background_removal",
     broker=settings.CELERY_BROKER_URL,
     backend=settings.CELERY_RESULT_BACKEND,
-    include=["src.tasks"],
+    include=["src.tasks", "src.warmup", "src.admission"],
 )
 
+# Con el transporte Redis cada prioridad es una lista aparte ("gpu", "gpu:1", ... "gpu:9")
+# y el worker las consume en orden: 0 es la más alta.
+PRIORITY_STEPS = list(range(10))
+PRIORITY_SEPARATOR = ":"
+
+GPU_TASKS = {"process_image", "process_image_batch", "enhance_image"}
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    if name in GPU_TASKS:
+        return {"queue": inference_queue()}
+    if name == "vectorize_image":
+        return {"queue": inference_queue() if kwargs.get("enhance_before") else settings.CPU_QUEUE}
+    if name == "run_pipeline":
+        stages = kwargs.get("stages") or (args[2] if len(args) > 2 else [])
+        return {"queue": inference_queue() if uses_gpu(stages) else settings.CPU_QUEUE}
+    return None
+
+
 celery_app.conf.update(
     task_serializer="json",
     accept_content=["json"],
@@ -24,6 +45,21 @@ celery_app.conf.update(
     task_track_started=True,
     task_time_limit=300,
     task_soft_time_limit=240,
+    task_routes=(route_task,),
+    task_default_queue=settings.CPU_QUEUE,
+    task_default_priority=settings.ADMISSION_DEFAULT_PRIORITY,
+    broker_transport_options={
+        "priority_steps": PRIORITY_STEPS,
+        "sep": PRIORITY_SEPARATOR,
+        "queue_order_strategy": "priority",
+    },
+    # Un proceso solo reserva la tarea que ejecuta: lo que queda en la cola sigue
+    # ordenado por prioridad. El pool GPU con REMBG_BATCH_SIZE > 1 sube el
+    # prefetch desde entrypoint.sh, porque celery-batches solo junta lo reservado.
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    # Cada proceso carga y precalienta sus modelos en worker_process_init antes de recibir tareas.
+    worker_proc_alive_timeout=settings.WORKER_WARMUP_TIMEOUT,
     worker_log_format='[%(asctime)s: %(levelname)s/%(processName)s] %(message)s',
     worker_task_log_format='[%(asctime)s: %(levelname)s/%(processName)s][%(task_name)s(%(task_id)s)] %(message)s',
 )
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Dict
 import os
 
 
@@ -6,12 +7,93 @@ class Settings(BaseSettings):
     REDIS_URL: str = "redis://redis:6379/0"
     CELERY_BROKER_URL: str = "redis://redis:6379/0"
     CELERY_RESULT_BACKEND: str = "redis://redis:6379/0"
+    GPU_QUEUE: str = "gpu"
+    CPU_INFERENCE_QUEUE: str = "inference-cpu"
+    CPU_QUEUE: str = "cpu"
     UPLOAD_DIR: str = "/data/uploads"
     RESULT_DIR: str = "/data/results"
+    STORAGE_BACKEND: str = "local"
+    S3_BUCKET: str = ""
+    S3_PREFIX: str = ""
+    S3_ENDPOINT_URL: str = ""
+    S3_PUBLIC_ENDPOINT_URL: str = ""
+    S3_REGION: str = "us-east-1"
+    S3_ACCESS_KEY_ID: str = ""
+    S3_SECRET_ACCESS_KEY: str = ""
+    S3_ADDRESSING_STYLE: str = "auto"
+    S3_PRESIGN: bool = True
+    S3_PRESIGN_EXPIRES: int = 3600
     MAX_FILE_SIZE: int = 100 * 1024 * 1024
+    BATCH_MAX_FILES: int = 500
+    BATCH_MAX_ARCHIVE_SIZE: int = 1024 * 1024 * 1024
+    BATCH_TTL: int = 24 * 3600
+    UPLOAD_TTL: int = 24 * 3600
+    RESULT_TTL: int = 7 * 24 * 3600
+    STORAGE_MAX_BYTES: int = 50 * 1024 * 1024 * 1024
+    STORAGE_JANITOR_INTERVAL: int = 60
     REMBG_MODEL: str = "birefnet-general"
     REALESRGAN_MODEL: str = "RealESRGAN_x4plus"
+    CPU_REALESRGAN_MODEL: str = "realesr-general-x4v3"
     REALESRGAN_SCALE: int = 4
+    REALESRGAN_MEMORY_BUDGET_MB: int = 2048
+    REALESRGAN_TILE_PAD: int = 10
+    ALPHA_MATTING_MODE: str = "fast"
+    ALPHA_MATTING_TILE_SIZE: int = 256
+    ALPHA_MATTING_FOREGROUND_THRESHOLD: int = 240
+    ALPHA_MATTING_BACKGROUND_THRESHOLD: int = 10
+    ALPHA_MATTING_ERODE_SIZE: int = 10
+    PNG_COMPRESSION_LEVEL: int = 6
+    WEBP_METHOD: int = 4
+    AVIF_QUALITY: int = 90
+    AVIF_SPEED: int = 6
+    CROP_PADDING: int = 0
+    VECTORIZE_PRESET: str = "auto"
+    VECTORIZE_TIME_BUDGET: float = 60.0
+    VECTORIZE_MAX_PIXELS: int = 16 * 1024 * 1024
+    VECTORIZE_QUANTIZE_COLORS: int = 64
+    SVG_OPTIMIZE: bool = False
+    SVG_PRECISION: int = 1
+    SVG_MIN_PATH_SIZE: float = 1.0
+    REMBG_REDUCED_DECODE: bool = True
+    REMBG_INT8: bool = False
+    REMBG_INT8_OP_TYPES: str = "MatMul,Gemm"
+    ORT_INTRA_OP_THREADS: int = 0
+    ORT_INTER_OP_THREADS: int = 0
+    ORT_EXECUTION_MODE: str = "sequential"
+    ORT_GRAPH_OPTIMIZATION: str = "all"
+    ORT_CPU_MEM_ARENA: bool = True
+    ORT_MEM_PATTERN: bool = True
+    ORT_MODEL_CACHE: bool = True
+    ORT_MODEL_CACHE_DIR: str = "/data/models/onnx"
+    REMBG_BATCH_SIZE: int = 1
+    REMBG_BATCH_INTERVAL_MS: int = 50
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_TTL: int = 7 * 24 * 3600
+    RESULT_CACHE_MAX_BYTES: int = 10 * 1024 * 1024 * 1024
+    INFLIGHT_COALESCING: bool = True
+    INFLIGHT_TTL: int = 900
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_WAIT: float = 120.0
+    ADMISSION_DEFAULT_SERVICE_TIME: float = 5.0
+    ADMISSION_GPU_CONSUMERS: int = 1
+    ADMISSION_CPU_CONSUMERS: int = 4
+    ADMISSION_MAX_INFLIGHT_PER_CLIENT: int = 500
+    ADMISSION_INFLIGHT_TTL: int = 900
+    ADMISSION_DEFAULT_PRIORITY: int = 6
+    API_KEY_PRIORITIES: Dict[str, int] = {}
+    SYNC_PROCESS_ENABLED: bool = False
+    SYNC_MAX_PIXELS: int = 512 * 512
+    SYNC_PROCESS_WORKERS: int = 1
+    SYNC_PROCESS_BACKLOG: int = 2
+    SYNC_PROCESS_THREADS: int = 2
+    SYNC_PROCESS_MODELS: str = "rembg"
+    DEVICE_PROFILE: str = "gpu"
+    CPU_INFERENCE_THREADS: int = 0
+    CPU_PIN_THREADS: bool = True
+    WORKER_METRICS_PORT: int = 9100
+    WORKER_WARMUP: bool = True
+    WORKER_WARMUP_TIMEOUT: int = 600
+    WORKER_READY_DIR: str = "/tmp/worker-ready"
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
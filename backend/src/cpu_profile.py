@@ -0,0 +1,68 @@
+"""CPU execution profile (DEVICE_PROFILE=cpu) for workers without a GPU.
+
+The inference pool runs several prefork processes; each one gets CPU_INFERENCE_THREADS
+threads for torch and ONNX Runtime and, with CPU_PIN_THREADS, its own slice of cores.
+Each profile consumes its own inference queue with its own enhance model, so the API's
+DEVICE_PROFILE decides which pool runs a job and the cache key says what produced it.
+"""
+import logging
+import os
+from typing import List
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def is_cpu_profile() -> bool:
+    return settings.DEVICE_PROFILE == "cpu"
+
+
+def inference_queue() -> str:
+    return settings.CPU_INFERENCE_QUEUE if is_cpu_profile() else settings.GPU_QUEUE
+
+
+def realesrgan_model() -> str:
+    return settings.CPU_REALESRGAN_MODEL if is_cpu_profile() else settings.REALESRGAN_MODEL
+
+
+def rembg_precision() -> str:
+    """int8 only on the CPU profile (REMBG_INT8); the API keys results on it, so a GPU pool never applies it."""
+    return "int8" if settings.REMBG_INT8 and is_cpu_profile() else "fp32"
+
+
+def inference_threads() -> int:
+    return settings.CPU_INFERENCE_THREADS or int(os.environ.get("OMP_NUM_THREADS") or 0) or os.cpu_count() or 1
+
+
+def core_slice(index: int, threads: int) -> List[int]:
+    """Cores for the index-th process, taken in order from the cores this container may use."""
+    cores = sorted(os.sched_getaffinity(0))
+    count = min(threads, len(cores))
+    start = index * count % len(cores)
+    return [cores[(start + offset) % len(cores)] for offset in range(count)]
+
+
+def configure_inference_process() -> None:
+    """Bound torch's thread pools and pin this prefork child to its cores; no-op on the GPU profile."""
+    if not is_cpu_profile():
+        return
+
+    import torch
+    from billiard.process import current_process
+
+    threads = inference_threads()
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Solo se puede fijar antes del primer trabajo paralelo de torch en el proceso.
+        pass
+
+    index = getattr(current_process(), "index", None)
+    if settings.CPU_PIN_THREADS and index is not None and hasattr(os, "sched_setaffinity"):
+        cores = core_slice(index, threads)
+        os.sched_setaffinity(0, cores)
+        logger.info(f"Proceso {index}: {threads} hilos fijados a los cores {cores}")
+    else:
+        logger.info(f"Proceso de inferencia en CPU con {threads} hilos")
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Optional, Set
+
+import redis
+import redis.asyncio as aioredis
+from celery import Task
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "task-events:"
+TERMINAL_STATES = ("SUCCESS", "FAILURE")
+
+_publisher: Optional[redis.Redis] = None
+
+
+def _get_publisher() -> redis.Redis:
+    global _publisher
+    if _publisher is None:
+        _publisher = redis.Redis.from_url(settings.REDIS_URL)
+    return _publisher
+
+
+def publish_task_event(task_id: str, status: str, result=None) -> None:
+    """Broadcast a state transition; failures only cost subscribers the push, never the task."""
+    try:
+        payload = json.dumps({"task_id": task_id, "status": status, "result": result})
+        _get_publisher().publish(CHANNEL_PREFIX + task_id, payload)
+    except Exception as e:
+        logger.warning(f"No se pudo publicar el evento de la tarea {task_id}: {e}")
+
+
+class ProgressTask(Task):
+    """Task base that pushes PROCESSING/SUCCESS/FAILURE transitions to the task's event channel."""
+
+    def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+        super().update_state(task_id=task_id, state=state, meta=meta, **kwargs)
+        if state == "PROCESSING":
+            progress = meta.get("progress", 0) if meta else 0
+            publish_task_event(task_id or self.request.id, "PROCESSING", progress)
+
+    def on_success(self, retval, task_id, args, kwargs):
+        filename = retval.get("filename") if isinstance(retval, dict) else None
+        publish_task_event(task_id, "SUCCESS", filename)
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        publish_task_event(task_id, "FAILURE", str(exc))
+
+        # La primera mitad de una cadena GPU -> CPU reporta bajo el id de la tarea final,
+        # que nunca llega a ejecutarse si esta falla.
+        report_as = kwargs.get("report_as")
+        if report_as:
+            self.backend.mark_as_failure(report_as, exc)
+            publish_task_event(report_as, "FAILURE", str(exc))
+
+
+class TaskEventHub:
+    """One pattern subscription per API process, fanned out to per-client queues."""
+
+    def __init__(self):
+        self._subscribers: defaultdict = defaultdict(set)
+        self._reader: Optional[asyncio.Task] = None
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers[task_id].add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue) -> None:
+        queues: Set[asyncio.Queue] = self._subscribers.get(task_id, set())
+        queues.discard(queue)
+        if not queues:
+            self._subscribers.pop(task_id, None)
+
+    async def start(self) -> None:
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+
+    async def _run(self) -> None:
+        while True:
+            client = aioredis.Redis.from_url(settings.REDIS_URL)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(CHANNEL_PREFIX + "*")
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    task_id = message["channel"].decode("utf-8")[len(CHANNEL_PREFIX):]
+                    queues = self._subscribers.get(task_id)
+                    if not queues:
+                        continue
+                    event = json.loads(message["data"])
+                    for queue in list(queues):
+                        queue.put_nowait(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Suscripción a eventos de tareas interrumpida, reintentando: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+
+
+event_hub = TaskEventHub()
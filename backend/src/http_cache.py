@@ -0,0 +1,193 @@
+"""Conditional GET, byte ranges and precompressed variants for immutable blobs.
+
+Results and originals never change once written (uploads get a fresh uuid name,
+results are named after the hash of their input and parameters), so they are served
+with a strong ETag and a one-year immutable Cache-Control. Blobs that live outside
+the local filesystem are handed out as a redirect to a presigned URL.
+"""
+import os
+from typing import Iterator, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, RedirectResponse, Response, StreamingResponse
+
+from .blobstore import BlobInfo, blob_store
+from .storage import COMPRESSIBLE_EXTENSIONS, PRECOMPRESSED_VARIANTS
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+RANGE_CHUNK_SIZE = 64 * 1024
+
+# Preferencia del servidor cuando el cliente acepta varias codificaciones.
+ENCODING_PREFERENCE = ("br", "gzip")
+
+
+def file_etag(stat: os.stat_result, encoding: Optional[str] = None) -> str:
+    tag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires."""
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def accepted_encodings(header: Optional[str]) -> set:
+    accepted = set()
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name and quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def negotiate_variant(request: Request, path: str) -> Tuple[str, Optional[str], bool]:
+    """Pick a precompressed copy of `path` the client accepts; returns (path, encoding, has variants)."""
+    variants = {
+        encoding: path + suffix
+        for encoding, suffix in PRECOMPRESSED_VARIANTS.items()
+        if os.path.isfile(path + suffix)
+    }
+    accepted = accepted_encodings(request.headers.get("accept-encoding"))
+    for encoding in ENCODING_PREFERENCE:
+        if encoding in variants and encoding in accepted:
+            return variants[encoding], encoding, True
+    return path, None, bool(variants)
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=` range into inclusive offsets; None means serve the whole file."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if not start_text:
+            length = int(end_text)
+            start, end = max(size - length, 0), size - 1
+            if length == 0:
+                start = size
+        else:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def iter_file_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def immutable_file_response(request: Request, path: str, media_type: str, filename: str) -> Response:
+    path, encoding, has_variants = negotiate_variant(request, path)
+    stat = os.stat(path)
+    etag = file_etag(stat, encoding)
+
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if has_variants:
+        headers["Vary"] = "Accept-Encoding"
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    headers["Accept-Ranges"] = "bytes"
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = parse_range(range_header, stat.st_size)
+
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_file_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+
+def blob_etag(blob: BlobInfo, encoding: Optional[str] = None) -> str:
+    tag = f"{blob.size:x}-{int(blob.modified * 1e9):x}"
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+
+def negotiate_blob_variant(request: Request, key: str) -> Tuple[str, Optional[str], bool]:
+    """negotiate_variant for blob keys; only text results have precompressed copies to look up."""
+    if os.path.splitext(key)[1] not in COMPRESSIBLE_EXTENSIONS:
+        return key, None, False
+    accepted = accepted_encodings(request.headers.get("accept-encoding"))
+    has_variants = False
+    for encoding in ENCODING_PREFERENCE:
+        variant = key + PRECOMPRESSED_VARIANTS[encoding]
+        if blob_store.exists(variant):
+            if encoding in accepted:
+                return variant, encoding, True
+            has_variants = True
+    return key, None, has_variants
+
+
+def iter_blob(key: str) -> Iterator[bytes]:
+    with blob_store.open(key) as f:
+        while chunk := f.read(RANGE_CHUNK_SIZE):
+            yield chunk
+
+
+def immutable_blob_response(request: Request, key: str, media_type: str, filename: str) -> Response:
+    """Serve a blob: from disk on the local backend, else a presigned redirect, else streamed through the API."""
+    path = blob_store.local_path(key)
+    if path is not None:
+        return immutable_file_response(request, path, media_type, filename)
+
+    key, encoding, has_variants = negotiate_blob_variant(request, key)
+    headers = {}
+    if has_variants:
+        headers["Vary"] = "Accept-Encoding"
+
+    url = blob_store.presigned_url(key, filename, media_type, encoding)
+    if url is not None:
+        # La URL firmada caduca: la redirección no se guarda, el contenido de destino sí.
+        headers["Cache-Control"] = "no-store"
+        return RedirectResponse(url, status_code=307, headers=headers)
+
+    blob = blob_store.stat(key)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    etag = blob_etag(blob, encoding)
+    headers.update({"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL})
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    headers["Content-Length"] = str(blob.size)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(iter_blob(key), media_type=media_type, headers=headers)
@@ -0,0 +1,160 @@
+import json
+import logging
+from typing import List, Optional
+
+import redis
+
+from .config import settings
+from .storage import remove_with_variants
+
+logger = logging.getLogger(__name__)
+
+INFLIGHT_KEY_PREFIX = "inflight:key:"
+INFLIGHT_TASK_PREFIX = "inflight:task:"
+# Suscriptores por cliente (client_id -> cantidad): cada uno solo puede soltar lo que pidió.
+SUBSCRIBERS_PREFIX = "inflight:subscribers:"
+# Reintentos de claim cuando la tarea que ocupaba la clave termina a mitad de camino.
+CLAIM_ATTEMPTS = 3
+# Cancelar y guardar el resultado compiten por esta clave: quien la escribe primero gana.
+OUTCOME_PREFIX = "inflight:outcome:"
+CANCELLED = b"cancelled"
+COMMITTED = b"committed"
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class InflightJobs:
+    """Keeps a record of every queued or running job and, with INFLIGHT_COALESCING, maps its cache key
+    to its task id so identical submissions share it.
+
+    Each task counts its subscribers per client: the submission that enqueued it plus every one
+    attached later. DELETE /task/{id} drops one of the caller's and only cancels the task when none remain.
+    """
+
+    def __init__(self, client: Optional[redis.Redis] = None):
+        self._client = client
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(settings.REDIS_URL)
+        return self._client
+
+    def claim(self, cache_key: str, task_id: str, job: dict, keys: List[str], client_id: str) -> Optional[dict]:
+        """Register a new job; if an identical one is in flight, attach to it and return its job instead."""
+        record_key = INFLIGHT_TASK_PREFIX + task_id
+        try:
+            # El registro se escribe antes de publicar la clave: quien la encuentra siempre tiene su job.
+            # Sin coalescing se escribe igual, así DELETE /task puede cancelar la tarea.
+            pipe = self.client.pipeline()
+            pipe.hset(record_key, mapping={
+                "cache_key": cache_key,
+                "job": json.dumps(job),
+                "files": json.dumps(keys),
+            })
+            pipe.expire(record_key, settings.INFLIGHT_TTL)
+            pipe.hincrby(SUBSCRIBERS_PREFIX + task_id, client_id, 1)
+            pipe.expire(SUBSCRIBERS_PREFIX + task_id, settings.INFLIGHT_TTL)
+            pipe.execute()
+
+            if not settings.INFLIGHT_COALESCING:
+                return None
+
+            for _ in range(CLAIM_ATTEMPTS):
+                if self.client.set(INFLIGHT_KEY_PREFIX + cache_key, task_id, nx=True, ex=settings.INFLIGHT_TTL):
+                    return None
+                existing_id = self.client.get(INFLIGHT_KEY_PREFIX + cache_key)
+                if existing_id is None:
+                    # La otra tarea terminó entre el SET y el GET: se vuelve a intentar.
+                    continue
+                existing_id = existing_id.decode("utf-8")
+                existing_job = self.client.hget(INFLIGHT_TASK_PREFIX + existing_id, "job")
+                if existing_job is None:
+                    continue
+                self.client.hincrby(SUBSCRIBERS_PREFIX + existing_id, client_id, 1)
+                self.client.delete(record_key, SUBSCRIBERS_PREFIX + task_id)
+                return json.loads(existing_job)
+        except redis.RedisError as e:
+            logger.warning(f"No se pudo registrar la tarea en curso {task_id}: {e}")
+            return None
+
+        # La clave sigue ocupada por otra tarea: esta se encola sin compartirse, pero queda registrada.
+        return None
+
+    def get(self, task_id: str) -> Optional[dict]:
+        record = self.client.hgetall(INFLIGHT_TASK_PREFIX + task_id)
+        if not record:
+            return None
+        return {
+            "cache_key": record[b"cache_key"].decode("utf-8"),
+            "job": json.loads(record[b"job"]),
+            "files": json.loads(record[b"files"]),
+            "subscribers": self._subscriber_count(task_id),
+        }
+
+    def _subscriber_count(self, task_id: str) -> int:
+        return sum(int(count) for count in self.client.hvals(SUBSCRIBERS_PREFIX + task_id))
+
+    def detach(self, task_id: str, client_id: str) -> Optional[int]:
+        """Drop one of the client's subscriptions; returns how many remain, or None if it had none."""
+        key = SUBSCRIBERS_PREFIX + task_id
+        count = self.client.hincrby(key, client_id, -1)
+        if count <= 0:
+            self.client.hdel(key, client_id)
+        if count < 0:
+            return None
+        return self._subscriber_count(task_id)
+
+    def cancel(self, task_id: str) -> bool:
+        """Flag the task for the worker, stop new submissions from attaching and delete its files.
+
+        Returns False, changing nothing, if the worker already started saving the result.
+        """
+        key = OUTCOME_PREFIX + task_id
+        if not self.client.set(key, CANCELLED, nx=True, ex=settings.INFLIGHT_TTL) and self.client.get(key) != CANCELLED:
+            return False
+
+        record = self.get(task_id)
+        if record is not None:
+            self._unlink(record["cache_key"], task_id)
+            for blob_key in record["files"]:
+                remove_with_variants(blob_key)
+        return True
+
+    def is_cancelled(self, task_id: str) -> bool:
+        try:
+            return self.client.get(OUTCOME_PREFIX + task_id) == CANCELLED
+        except redis.RedisError:
+            return False
+
+    def commit(self, task_id: str) -> None:
+        """Claim the right to save and publish the result; raises TaskCancelled if a cancel got there first."""
+        key = OUTCOME_PREFIX + task_id
+        try:
+            if self.client.set(key, COMMITTED, nx=True, ex=settings.INFLIGHT_TTL) or self.client.get(key) != CANCELLED:
+                return
+        except redis.RedisError as e:
+            logger.warning(f"No se pudo marcar la tarea {task_id} como terminada: {e}")
+            return
+        raise TaskCancelled(f"Task {task_id} was cancelled")
+
+    def finish(self, task_id: str) -> None:
+        """Forget a task that reached a terminal state; later submissions go to the result cache."""
+        try:
+            cache_key = self.client.hget(INFLIGHT_TASK_PREFIX + task_id, "cache_key")
+            if cache_key is None:
+                return
+            self._unlink(cache_key.decode("utf-8"), task_id)
+            self.client.delete(INFLIGHT_TASK_PREFIX + task_id, SUBSCRIBERS_PREFIX + task_id)
+        except redis.RedisError as e:
+            logger.warning(f"No se pudo liberar la tarea en curso {task_id}: {e}")
+
+    def _unlink(self, cache_key: str, task_id: str) -> None:
+        current = self.client.get(INFLIGHT_KEY_PREFIX + cache_key)
+        if current is not None and current.decode("utf-8") == task_id:
+            self.client.delete(INFLIGHT_KEY_PREFIX + cache_key)
+
+
+inflight_jobs = InflightJobs()
@@ -1,21 +1,80 @@
+import asyncio
+import json
 import os
 import uuid
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from celery import Signature, chain, group, states
 from celery.result import AsyncResult
 from pydantic import BaseModel
 from .config import settings
+from .admission import ClientPolicy, admit, client_policy, job_queues, settle, track
 from .celery_app import celery_app
-from .tasks import process_image, vectorize_image, enhance_image
+from .cpu_profile import realesrgan_model, rembg_precision
+from .cache import build_cache_key, result_cache
+from .archive import iter_zip
+from .batches import load_batch, save_batch
+from .events import TERMINAL_STATES, event_hub, publish_task_event
+from .blobstore import RESULTS, UPLOADS
+from .http_cache import immutable_blob_response
+from .inflight import inflight_jobs
+from .metrics import CACHE_LOOKUPS, build_registry, render
+from .storage import record_access, resolve, result_key, storage_janitor, upload_key
+from .sync_processing import sync_processor
+from .uploads import StoredUpload, extract_archive, receive_multipart
+from .stages import (
+    INTERMEDIATE_EXTENSION,
+    MATTING_MODES,
+    OUTPUT_FORMATS,
+    TASK_TYPE_STAGES,
+    VECTORIZE_PRESETS,
+    output_extension,
+    split_stages,
+    validate_stages,
+)
+from .signatures import (
+    ENHANCE_IMAGE,
+    PROCESS_IMAGE,
+    PROCESS_IMAGE_BATCH,
+    RUN_PIPELINE,
+    VECTORIZE_IMAGE,
+    task_signature,
+)
 
 app = FastAPI(title="Background Removal API")
 
+SSE_KEEPALIVE_SECONDS = 15
+
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+    ".svg": "image/svg+xml",
+}
+
+METRICS_REGISTRY = build_registry(include_queue_depth=True)
+
 
 class UploadRequest(BaseModel):
     task_type: str
     scale: int = 4
     enhance_before: bool = False
+    stages: List[str] = []
+    matting: str = settings.ALPHA_MATTING_MODE
+    output_format: str = "png"
+    crop: bool = False
+    crop_padding: int = settings.CROP_PADDING
+    png_compression: int = settings.PNG_COMPRESSION_LEVEL
+    png_palette: bool = False
+    optimize_svg: bool = settings.SVG_OPTIMIZE
+    vectorize_preset: str = settings.VECTORIZE_PRESET
+    svg_precision: int = settings.SVG_PRECISION
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,6 +82,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Output-Filename"],
 )
 
 
@@ -30,8 +90,77 @@ app.add_middleware(
 async def startup_event():
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
     os.makedirs(settings.RESULT_DIR, exist_ok=True)
+    await event_hub.start()
+    await storage_janitor.start()
+    await sync_processor.start()
 
-ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await event_hub.stop()
+    await storage_janitor.stop()
+    await sync_processor.stop()
+
+
+def task_cache_params(options: UploadRequest) -> dict:
+    params = {"stages": options.stages}
+    if "remove_background" in options.stages:
+        params["remove_background"] = {
+            "model": settings.REMBG_MODEL,
+            "device_profile": settings.DEVICE_PROFILE,
+            "precision": rembg_precision(),
+            "matting": options.matting,
+            "reduced_decode": settings.REMBG_REDUCED_DECODE,
+        }
+        if options.matting != "none":
+            params["remove_background"].update({
+                "foreground_threshold": settings.ALPHA_MATTING_FOREGROUND_THRESHOLD,
+                "background_threshold": settings.ALPHA_MATTING_BACKGROUND_THRESHOLD,
+                "erode_size": settings.ALPHA_MATTING_ERODE_SIZE,
+            })
+    if "enhance" in options.stages:
+        params["enhance"] = {
+            "model": realesrgan_model(),
+            "device_profile": settings.DEVICE_PROFILE,
+            "scale": options.scale,
+        }
+    if "vectorize" in options.stages:
+        params["vectorize"] = {
+            "time_budget": settings.VECTORIZE_TIME_BUDGET,
+            "max_pixels": settings.VECTORIZE_MAX_PIXELS,
+            "quantize_colors": settings.VECTORIZE_QUANTIZE_COLORS,
+        }
+    params["output"] = output_options(options)
+    return params
+
+
+def output_options(options: UploadRequest) -> dict:
+    """Encoding options for the final result: SVG optimization, or crop and format for raster output."""
+    if options.stages[-1] == "vectorize":
+        return {
+            "vectorize_preset": options.vectorize_preset,
+            "optimize_svg": options.optimize_svg,
+            "svg_precision": options.svg_precision,
+        }
+    output = {"format": options.output_format, "crop": options.crop, "crop_padding": options.crop_padding}
+    if options.output_format == "png":
+        output.update({"png_compression": options.png_compression, "png_palette": options.png_palette})
+    return output
+
+
+def complete_cached_task(cached_filename: str) -> str:
+    task_id = str(uuid.uuid4())
+    celery_app.backend.store_result(
+        task_id,
+        {
+            "status": "SUCCESS",
+            "output_key": result_key(cached_filename),
+            "filename": cached_filename,
+            "cached": True,
+        },
+        "SUCCESS",
+    )
+    return task_id
 
 
 @app.get("/")
@@ -39,98 +168,502 @@ async def root():
     return {"message": "Background Removal API"}
 
 
-@app.post("/upload")
-async def upload_file(
-    file: UploadFile = File(...),
-    task_type: str = Form("remove_background"),
-    scale: int = Form(4),
-    enhance_before: bool = Form(False)
-):
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="No file provided")
+TASK_OPTION_PROPERTIES = {
+    "task_type": {"type": "string", "default": "remove_background"},
+    "scale": {"type": "integer", "default": 4},
+    "enhance_before": {"type": "boolean", "default": False},
+    "matting": {
+        "type": "string",
+        "enum": ["none", "fast", "full"],
+        "description": "Alpha matting quality for background removal",
+    },
+    "stages": {
+        "type": "string",
+        "description": "Comma-separated stages for task_type=pipeline, e.g. remove_background,enhance,vectorize",
+    },
+    "output_format": {"type": "string", "enum": ["png", "webp", "avif"], "default": "png"},
+    "crop": {"type": "boolean", "default": False, "description": "Crop to the alpha bounding box"},
+    "crop_padding": {"type": "integer", "description": "Pixels kept around the alpha bounding box"},
+    "png_compression": {"type": "integer", "minimum": 0, "maximum": 9},
+    "png_palette": {"type": "boolean", "default": False, "description": "Quantize to a 256-color palette PNG"},
+    "vectorize_preset": {
+        "type": "string",
+        "enum": list(VECTORIZE_PRESETS),
+        "description": "vtracer preset; auto picks one from the image's size and color count",
+    },
+    "optimize_svg": {"type": "boolean", "description": "Round, merge and relativize vectorize output"},
+    "svg_precision": {"type": "integer", "minimum": 0, "maximum": 6, "description": "Decimals kept in SVG coordinates"},
+}
+
+
+def multipart_form_schema(required: List[str], properties: dict) -> dict:
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {"type": "object", "required": required, "properties": properties}
+                }
+            },
+        }
+    }
+
+
+UPLOAD_FORM_SCHEMA = multipart_form_schema(
+    ["file"],
+    {"file": {"type": "string", "format": "binary"}, **TASK_OPTION_PROPERTIES},
+)
+
+BATCH_FORM_SCHEMA = multipart_form_schema(
+    ["files"],
+    {
+        "files": {
+            "type": "array",
+            "items": {"type": "string", "format": "binary"},
+            "description": "Images, or a single ZIP archive of images",
+        },
+        **TASK_OPTION_PROPERTIES,
+    },
+)
+
+
+def parse_bool_field(fields: Dict[str, str], name: str, default: bool = False) -> bool:
+    if name not in fields:
+        return default
+    return fields[name].strip().lower() in ("1", "true", "yes", "on")
+
+
+def parse_int_field(fields: Dict[str, str], name: str, default: int, low: int, high: int) -> int:
+    try:
+        value = int(fields.get(name, default))
+    except ValueError:
+        value = low - 1
+    if not low <= value <= high:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}. Must be between {low} and {high}")
+    return value
+
 
-    if task_type not in ["remove_background", "vectorize", "enhance", "vectorize_enhance"]:
+def parse_task_options(fields: Dict[str, str]) -> UploadRequest:
+    task_type = fields.get("task_type", "remove_background")
+    try:
+        scale = int(fields.get("scale", "4"))
+    except ValueError:
+        scale = 0
+
+    if task_type not in ["remove_background", "vectorize", "enhance", "vectorize_enhance", "pipeline"]:
         raise HTTPException(
             status_code=400,
-            detail="Invalid task_type. Use 'remove_background', 'vectorize', 'enhance', or 'vectorize_enhance'"
+            detail="Invalid task_type. Use 'remove_background', 'vectorize', 'enhance', 'vectorize_enhance', or 'pipeline'"
         )
 
+    if task_type == "pipeline":
+        stages = [stage.strip() for stage in fields.get("stages", "").split(",") if stage.strip()]
+        try:
+            validate_stages(stages)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        stages = TASK_TYPE_STAGES[task_type]
+
     if scale not in [2, 4, 8]:
         raise HTTPException(
             status_code=400,
             detail="Invalid scale. Must be 2, 4, or 8"
         )
 
-    ext = os.path.splitext(file.filename)[1].lower()
-    if ext not in ALLOWED_EXTENSIONS:
+    matting = fields.get("matting", settings.ALPHA_MATTING_MODE)
+    if matting not in MATTING_MODES:
         raise HTTPException(
             status_code=400,
-            detail=f"File type not allowed. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+            detail=f"Invalid matting. Use {', '.join(MATTING_MODES)}"
         )
 
-    file_content = await file.read()
-    file_size = len(file_content)
+    output_format = fields.get("output_format", "png")
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid output_format. Use {', '.join(OUTPUT_FORMATS)}"
+        )
 
-    if file_size > settings.MAX_FILE_SIZE:
+    vectorize_preset = fields.get("vectorize_preset", settings.VECTORIZE_PRESET)
+    if vectorize_preset not in VECTORIZE_PRESETS:
         raise HTTPException(
             status_code=400,
-            detail=f"File too large. Maximum size: {settings.MAX_FILE_SIZE / (1024 * 1024)}MB"
+            detail=f"Invalid vectorize_preset. Use {', '.join(VECTORIZE_PRESETS)}"
         )
 
-    filename = f"{uuid.uuid4()}{ext}"
+    return UploadRequest(
+        task_type=task_type,
+        scale=scale,
+        stages=stages,
+        matting=matting,
+        output_format=output_format,
+        crop=parse_bool_field(fields, "crop"),
+        crop_padding=parse_int_field(fields, "crop_padding", settings.CROP_PADDING, 0, 4096),
+        png_compression=parse_int_field(fields, "png_compression", settings.PNG_COMPRESSION_LEVEL, 0, 9),
+        png_palette=parse_bool_field(fields, "png_palette"),
+        vectorize_preset=vectorize_preset,
+        optimize_svg=parse_bool_field(fields, "optimize_svg", settings.SVG_OPTIMIZE),
+        svg_precision=parse_int_field(fields, "svg_precision", settings.SVG_PRECISION, 0, 6),
+    )
 
-    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-    os.makedirs(settings.RESULT_DIR, exist_ok=True)
 
-    input_path = os.path.join(settings.UPLOAD_DIR, filename)
-
-    with open(input_path, "wb") as f:
-        f.write(file_content)
-
-    if task_type == "remove_background":
-        output_filename = f"{uuid.uuid4()}.png"
-        output_path = os.path.join(settings.RESULT_DIR, output_filename)
-        task = process_image.delay(input_path, output_path)
-    elif task_type == "vectorize":
-        output_filename = f"{uuid.uuid4()}.svg"
-        output_path = os.path.join(settings.RESULT_DIR, output_filename)
-        task = vectorize_image.delay(input_path, output_path, enhance_before=False, enhance_scale=scale)
-    elif task_type == "enhance":
-        output_filename = f"{uuid.uuid4()}.png"
-        output_path = os.path.join(settings.RESULT_DIR, output_filename)
-        task = enhance_image.delay(input_path, output_path, scale=scale)
-    elif task_type == "vectorize_enhance":
-        output_filename = f"{uuid.uuid4()}.svg"
-        output_path = os.path.join(settings.RESULT_DIR, output_filename)
-        task = vectorize_image.delay(input_path, output_path, enhance_before=True, enhance_scale=scale)
+def build_signature(
+    options: UploadRequest, input_key: str, output_key: str, cache_key: str, task_id: str, priority: int,
+) -> Signature:
+    scale = options.scale
+    output = output_options(options)
+    if options.task_type == "remove_background":
+        remove_task = PROCESS_IMAGE_BATCH if settings.REMBG_BATCH_SIZE > 1 else PROCESS_IMAGE
+        return task_signature(
+            remove_task, input_key, output_key, cache_key=cache_key, matting=options.matting, output=output,
+        ).set(task_id=task_id, priority=priority)
+    if options.task_type == "vectorize":
+        return task_signature(
+            VECTORIZE_IMAGE, input_key, output_key, enhance_before=False, enhance_scale=scale, cache_key=cache_key,
+            output=output,
+        ).set(task_id=task_id, priority=priority)
+    if options.task_type == "enhance":
+        return task_signature(
+            ENHANCE_IMAGE, input_key, output_key, scale=scale, cache_key=cache_key, output=output,
+        ).set(task_id=task_id, priority=priority)
 
-    return {
-        "task_id": task.id,
-        "filename": filename,
+    gpu_stages, cpu_stages = split_stages(options.stages)
+    if not cpu_stages:
+        return task_signature(
+            RUN_PIPELINE, input_key, output_key, options.stages, scale=scale, cache_key=cache_key,
+            matting=options.matting, output=output,
+        ).set(task_id=task_id, priority=priority)
+
+    # La GPU queda libre en cuanto termina su parte; vtracer sigue en la cola de CPU.
+    intermediate_key = upload_key(f"{uuid.uuid4()}{INTERMEDIATE_EXTENSION}")
+    return chain(
+        task_signature(
+            RUN_PIPELINE, input_key, intermediate_key, gpu_stages, scale=scale, matting=options.matting,
+            report_as=task_id, progress_range=[0, 50], immutable=True,
+        ).set(priority=priority),
+        task_signature(
+            RUN_PIPELINE, intermediate_key, output_key, cpu_stages, scale=scale, cache_key=cache_key,
+            output=output, progress_range=[50, 100], immutable=True,
+        ).set(task_id=task_id, priority=priority),
+    )
+
+
+def prepare_job(
+    upload: StoredUpload, options: UploadRequest, policy: ClientPolicy,
+) -> Tuple[dict, Optional[Signature]]:
+    """Resolve one upload against the result cache; returns the job description and, on a miss, the task to enqueue."""
+    cache_key = build_cache_key(upload.content_hash, options.task_type, task_cache_params(options))
+
+    cached_filename = result_cache.get(cache_key)
+    if settings.RESULT_CACHE_ENABLED:
+        CACHE_LOOKUPS.labels(task_type=options.task_type, result="miss" if cached_filename is None else "hit").inc()
+    if cached_filename is not None:
+        job = {
+            "task_id": complete_cached_task(cached_filename),
+            "filename": upload.filename,
+            "original_filename": upload.original_filename,
+            "output_filename": cached_filename,
+            "cached": True,
+            "coalesced": False,
+        }
+        return job, None
+
+    # El resultado se nombra por su clave de cache: mismo contenido y parámetros, mismo blob.
+    output_filename = f"{cache_key}{output_extension(options.stages, options.output_format)}"
+    output_key = result_key(output_filename)
+    task_id = str(uuid.uuid4())
+    job = {
+        "task_id": task_id,
+        "filename": upload.filename,
+        "original_filename": upload.original_filename,
         "output_filename": output_filename,
-        "task_type": task_type,
+        "cached": False,
+        "coalesced": False,
     }
 
+    # Mismo contenido y parámetros que una tarea en cola o en ejecución: se comparte su task_id.
+    existing = inflight_jobs.claim(cache_key, task_id, job, [upload.key, output_key], policy.client_id)
+    if existing is not None:
+        upload.discard()
+        return {**existing, "original_filename": upload.original_filename, "coalesced": True}, None
 
-@app.get("/status/{task_id}")
-async def get_status(task_id: str):
+    return job, build_signature(options, upload.key, output_key, cache_key, task_id, policy.priority)
+
+
+def abandon_jobs(jobs: List[dict], policy: ClientPolicy) -> None:
+    """Undo the in-flight registrations of jobs that were not enqueued after all."""
+    for job in jobs:
+        if job["coalesced"]:
+            inflight_jobs.detach(job["task_id"], policy.client_id)
+        elif not job["cached"]:
+            inflight_jobs.finish(job["task_id"])
+
+
+async def receive_single_upload(request: Request) -> Tuple[StoredUpload, UploadRequest]:
+    fields, uploads = await receive_multipart(request)
+    upload = next((u for u in uploads if u.field_name == "file"), None)
+    if upload is None:
+        for stray in uploads:
+            stray.discard()
+        raise HTTPException(status_code=400, detail="No file provided")
+
+    try:
+        options = parse_task_options(fields)
+    except HTTPException:
+        upload.discard()
+        raise
+    return upload, options
+
+
+def enqueue_upload(request: Request, upload: StoredUpload, options: UploadRequest) -> dict:
+    policy = client_policy(request)
+    job, signature = prepare_job(upload, options, policy)
+    if signature is not None:
+        try:
+            admit(policy, job_queues(options.stages))
+        except HTTPException:
+            abandon_jobs([job], policy)
+            upload.discard()
+            raise
+        signature.apply_async()
+        track(policy, [job["task_id"]])
+
+    return {
+        "task_id": job["task_id"],
+        "filename": job["filename"],
+        "output_filename": job["output_filename"],
+        "task_type": options.task_type,
+        "stages": options.stages,
+        "cached": job["cached"],
+        "coalesced": job["coalesced"],
+    }
+
+
+@app.post("/upload", openapi_extra=UPLOAD_FORM_SCHEMA)
+async def upload_file(request: Request):
+    upload, options = await receive_single_upload(request)
+    return await run_in_threadpool(enqueue_upload, request, upload, options)
+
+
+@app.post("/process", openapi_extra=UPLOAD_FORM_SCHEMA)
+async def process_file(request: Request):
+    """Process small images in this request and return the bytes; anything else is queued like /upload (202)."""
+    upload, options = await receive_single_upload(request)
+
+    dimensions = upload.dimensions
+    small = dimensions is not None and dimensions[0] * dimensions[1] <= settings.SYNC_MAX_PIXELS
+    # El lugar se reserva antes del primer await: si no, varias peticiones pasarían el chequeo a la vez.
+    if small and sync_processor.reserve():
+        try:
+            response = await process_in_request(request, upload, options)
+        finally:
+            sync_processor.release()
+        if response is not None:
+            return response
+
+    # Imagen grande, pool ocupado o no disponible: mismo camino que /upload.
+    return JSONResponse(status_code=202, content=await run_in_threadpool(enqueue_upload, request, upload, options))
+
+
+async def process_in_request(request: Request, upload: StoredUpload, options: UploadRequest) -> Optional[Response]:
+    """Serve /process from the cache or the sync pool; None if the pool broke and the job must be queued.
+
+    The client never gets the upload's name back from here, so it is discarded once answered.
+    """
+    cache_key = build_cache_key(upload.content_hash, options.task_type, task_cache_params(options))
+    cached_filename = await run_in_threadpool(result_cache.get, cache_key)
+    if cached_filename is not None:
+        await run_in_threadpool(upload.discard)
+        record_access(result_key(cached_filename))
+        media_type = MEDIA_TYPES.get(os.path.splitext(cached_filename)[1].lower(), "application/octet-stream")
+        return await run_in_threadpool(
+            immutable_blob_response, request, result_key(cached_filename), media_type, cached_filename,
+        )
+
+    output_filename = f"{cache_key}{output_extension(options.stages, options.output_format)}"
+    output_key = result_key(output_filename)
+    stage_options = {"scale": options.scale, "matting": options.matting, "output": output_options(options)}
+    try:
+        data = await sync_processor.process(upload.key, output_key, options.stages, stage_options)
+    except BrokenProcessPool:
+        return None
+    except Exception as e:
+        await run_in_threadpool(upload.discard)
+        raise HTTPException(status_code=500, detail=f"Processing failed: {e}")
+
+    await run_in_threadpool(upload.discard)
+    await run_in_threadpool(result_cache.put, cache_key, output_key)
+    media_type = MEDIA_TYPES.get(os.path.splitext(output_filename)[1].lower(), "application/octet-stream")
+    return Response(
+        content=data,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{output_filename}"',
+            "X-Output-Filename": output_filename,
+        },
+    )
+
+
+@app.post("/batch", openapi_extra=BATCH_FORM_SCHEMA)
+async def create_batch(request: Request):
+    fields, uploads = await receive_multipart(request, max_files=settings.BATCH_MAX_FILES, allow_archive=True)
+
+    images: List[StoredUpload] = []
+    try:
+        options = parse_task_options(fields)
+        for upload in uploads:
+            if upload.is_archive:
+                remaining = settings.BATCH_MAX_FILES - len(images)
+                images.extend(await run_in_threadpool(extract_archive, upload, remaining))
+            else:
+                images.append(upload)
+        if not images:
+            raise HTTPException(status_code=400, detail="No images provided")
+    except HTTPException:
+        for upload in uploads + images:
+            upload.discard()
+        raise
+
+    return await run_in_threadpool(enqueue_batch, request, images, options)
+
+
+def enqueue_batch(request: Request, images: List[StoredUpload], options: UploadRequest) -> dict:
+    """Cache lookups, admission and enqueueing for every image; one Redis round-trip or more per image."""
+    policy = client_policy(request)
+    jobs = []
+    signatures = []
+    for image in images:
+        job, signature = prepare_job(image, options, policy)
+        jobs.append(job)
+        if signature is not None:
+            signatures.append(signature)
+
+    if signatures:
+        try:
+            admit(policy, job_queues(options.stages), len(signatures))
+        except HTTPException:
+            abandon_jobs(jobs, policy)
+            for image in images:
+                image.discard()
+            raise
+
+    batch_id = str(uuid.uuid4())
+    save_batch(batch_id, options.task_type, jobs)
+    if signatures:
+        group(signatures).apply_async()
+        track(policy, [job["task_id"] for job in jobs if not job["cached"] and not job["coalesced"]])
+
+    return {
+        "batch_id": batch_id,
+        "task_type": options.task_type,
+        "stages": options.stages,
+        "total": len(jobs),
+        "cached": sum(1 for job in jobs if job["cached"]),
+        "coalesced": sum(1 for job in jobs if job["coalesced"]),
+        "items": jobs,
+    }
+
+
+@app.get("/batch/{batch_id}")
+async def get_batch_status(batch_id: str):
+    return await run_in_threadpool(summarize_batch, batch_id)
+
+
+def summarize_batch(batch_id: str) -> dict:
+    batch = load_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    items = []
+    counts = {"PENDING": 0, "PROCESSING": 0, "SUCCESS": 0, "FAILURE": 0}
+    progress = 0
+    for job in batch["items"]:
+        status = task_status(job["task_id"])
+        counts[status["status"]] += 1
+        if status["status"] in ("SUCCESS", "FAILURE"):
+            progress += 100
+        elif status["status"] == "PROCESSING":
+            progress += status["result"] or 0
+        items.append({**job, **status})
+
+    total = len(items)
+    finished = counts["SUCCESS"] + counts["FAILURE"]
+    if finished < total:
+        batch_status = "PROCESSING" if finished or counts["PROCESSING"] else "PENDING"
+    else:
+        batch_status = "SUCCESS" if not counts["FAILURE"] else "PARTIAL_FAILURE"
+
+    return {
+        "batch_id": batch_id,
+        "status": batch_status,
+        "total": total,
+        "completed": counts["SUCCESS"],
+        "failed": counts["FAILURE"],
+        "pending": counts["PENDING"],
+        "processing": counts["PROCESSING"],
+        "progress": round(progress / total) if total else 100,
+        "items": items,
+    }
+
+
+@app.get("/batch/{batch_id}/download")
+async def download_batch(batch_id: str):
+    entries = await run_in_threadpool(batch_entries, batch_id)
+    return StreamingResponse(
+        iter_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="batch-{batch_id}.zip"'},
+    )
+
+
+def batch_entries(batch_id: str) -> List[Tuple[str, str]]:
+    """(arcname, result key) of every finished item of a batch."""
+    batch = load_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    entries = []
+    used_names = set()
+    for job in batch["items"]:
+        if task_status(job["task_id"])["status"] != "SUCCESS":
+            continue
+        stem = os.path.splitext(job["original_filename"])[0]
+        ext = os.path.splitext(job["output_filename"])[1]
+        arcname = f"{stem}{ext}"
+        suffix = 1
+        while arcname in used_names:
+            arcname = f"{stem}_{suffix}{ext}"
+            suffix += 1
+        used_names.add(arcname)
+        # iter_zip omite los blobs que ya no existen.
+        entries.append((arcname, result_key(job["output_filename"])))
+
+    if not entries:
+        raise HTTPException(status_code=404, detail="No finished results in batch")
+    return entries
+
+
+def task_status(task_id: str) -> dict:
     task_result = AsyncResult(task_id, app=celery_app)
     
-    if task_result.state == "PENDING":
+    if task_result.state in ("PENDING", "RETRY"):
         response = {
             "status": "PENDING",
             "result": None,
         }
-    elif task_result.state == "PROCESSING":
+    elif task_result.state in ("STARTED", "PROCESSING"):
         response = {
             "status": "PROCESSING",
-            "result": task_result.info.get("progress", 0) if task_result.info else 0,
+            "result": task_result.info.get("progress", 0) if isinstance(task_result.info, dict) else 0,
         }
     elif task_result.state == "SUCCESS":
         response = {
             "status": "SUCCESS",
             "result": task_result.result.get("filename") if task_result.result else None,
         }
+        if task_result.result and task_result.result.get("svg_optimization"):
+            response["svg_optimization"] = task_result.result["svg_optimization"]
     else:
         response = {
             "status": "FAILURE",
@@ -140,31 +673,108 @@ async def get_status(task_id: str):
     return response
 
 
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render(METRICS_REGISTRY)
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/status/{task_id}")
+async def get_status(task_id: str):
+    return await run_in_threadpool(task_status, task_id)
+
+
+def format_sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+
+async def stream_task_events(task_id: str):
+    queue = event_hub.subscribe(task_id)
+    try:
+        current = await run_in_threadpool(task_status, task_id)
+        yield format_sse(current)
+        if current["status"] in TERMINAL_STATES:
+            return
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Un evento publicado mientras el hub se reconectaba se pierde: se consulta el estado.
+                current = await run_in_threadpool(task_status, task_id)
+                if current["status"] in TERMINAL_STATES:
+                    yield format_sse(current)
+                    return
+                yield ": keepalive\n\n"
+                continue
+
+            yield format_sse({"status": event["status"], "result": event["result"]})
+            if event["status"] in TERMINAL_STATES:
+                return
+    finally:
+        event_hub.unsubscribe(task_id, queue)
+
+
+@app.delete("/task/{task_id}")
+async def cancel_task(task_id: str, request: Request):
+    return await run_in_threadpool(cancel_job, task_id, client_policy(request))
+
+
+def cancel_job(task_id: str, policy: ClientPolicy) -> dict:
+    record = inflight_jobs.get(task_id)
+    if record is None:
+        # Sin registro (ya terminó, o pasó INFLIGHT_TTL): decide el estado en Celery. PENDING
+        # sin registro es un id desconocido, porque Celery no guarda nada de las tareas en cola.
+        state = AsyncResult(task_id, app=celery_app).state
+        if state == states.PENDING or state in states.READY_STATES:
+            raise HTTPException(status_code=404, detail="Task not found or already finished")
+    else:
+        remaining = inflight_jobs.detach(task_id, policy.client_id)
+        if remaining is None:
+            raise HTTPException(status_code=403, detail="Task was not submitted by this client")
+        if remaining > 0:
+            return {"task_id": task_id, "status": "DETACHED", "subscribers": remaining}
+
+    # Sin suscriptores: la tarea se revoca si sigue en cola y el worker la corta entre etapas si ya empezó.
+    if not inflight_jobs.cancel(task_id):
+        raise HTTPException(status_code=409, detail="Task is already saving its result")
+    celery_app.control.revoke(task_id)
+    celery_app.backend.mark_as_revoked(task_id, reason="cancelled")
+    publish_task_event(task_id, "FAILURE", "Task cancelled")
+    settle(task_id)
+    return {"task_id": task_id, "status": "CANCELLED", "subscribers": 0}
+
+
+@app.get("/events/{task_id}")
+async def get_events(task_id: str):
+    return StreamingResponse(
+        stream_task_events(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/result/{filename}")
-async def get_result(filename: str):
-    file_path = os.path.join(settings.RESULT_DIR, filename)
+async def get_result(filename: str, request: Request):
+    key = await run_in_threadpool(resolve, RESULTS, filename)
 
-    if not os.path.exists(file_path):
+    if key is None:
         raise HTTPException(status_code=404, detail="File not found")
 
-    media_type = "image/svg+xml" if filename.endswith(".svg") else "image/png"
+    record_access(key)
 
-    return FileResponse(
-        file_path,
-        media_type=media_type,
-        filename=filename,
-    )
+    media_type = MEDIA_TYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
+
+    return await run_in_threadpool(immutable_blob_response, request, key, media_type, os.path.basename(key))
 
 
 @app.get("/original/{filename}")
-async def get_original(filename: str):
-    file_path = os.path.join(settings.UPLOAD_DIR, filename)
+async def get_original(filename: str, request: Request):
+    key = await run_in_threadpool(resolve, UPLOADS, filename)
     
-    if not os.path.exists(file_path):
+    if key is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    return FileResponse(
-        file_path,
-        media_type="image/jpeg" if filename.lower().endswith((".jpg", ".jpeg")) else "image/png",
-        filename=filename,
-    )
+    media_type = MEDIA_TYPES.get(os.path.splitext(filename)[1].lower(), "image/jpeg")
+
+    return await run_in_threadpool(immutable_blob_response, request, key, media_type, os.path.basename(key))
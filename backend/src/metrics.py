@@ -0,0 +1,213 @@
+"""Prometheus metrics shared by the API and the workers.
+
+Workers run several prefork processes, so the entrypoint sets PROMETHEUS_MULTIPROC_DIR and
+serves the aggregated view with `python -m src.metrics`. The API exposes /metrics itself.
+"""
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import redis
+from celery.signals import before_task_publish, task_failure, task_prerun, worker_process_shutdown
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from .celery_app import PRIORITY_SEPARATOR, PRIORITY_STEPS
+from .config import settings
+from .cpu_profile import inference_queue
+from .stages import TASK_TYPE_STAGES
+
+logger = logging.getLogger(__name__)
+
+ENQUEUED_AT_HEADER = "enqueued_at"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+QUEUE_WAIT = Histogram(
+    "image_task_queue_wait_seconds",
+    "Time between publishing a task and a worker starting it",
+    ["task_type", "scale"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_DURATION = Histogram(
+    "image_task_stage_seconds",
+    "Time spent per processing stage (decode, inference, matting, vectorize, encode, compress, io)",
+    ["stage", "task_type", "scale"],
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_REJECTIONS = Counter(
+    "image_admission_rejections_total",
+    "Submissions rejected by admission control (429, or 413 for requests that can never fit)",
+    ["reason"],
+)
+CACHE_LOOKUPS = Counter(
+    "image_result_cache_lookups_total",
+    "Result cache lookups at submission time",
+    ["task_type", "result"],
+)
+TASK_FAILURES = Counter(
+    "image_task_failures_total",
+    "Failed tasks by exception type",
+    ["task_type", "exception"],
+)
+TASK_OOMS = Counter(
+    "image_task_oom_total",
+    "Tasks that failed by running out of host or GPU memory",
+    ["task_type"],
+)
+SVG_SIZE_REDUCTION = Histogram(
+    "image_svg_size_reduction_ratio",
+    "Fraction of the vtracer SVG removed by the optimizer",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9),
+)
+MODELS_LOADED = Gauge(
+    "image_worker_models_loaded",
+    "Worker processes with the model loaded",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+
+
+def task_type_for(stages: List[str]) -> str:
+    for task_type, task_stages in TASK_TYPE_STAGES.items():
+        if task_stages == list(stages):
+            return task_type
+    return "pipeline"
+
+
+def scale_label(stages: List[str], scale: Optional[int]) -> str:
+    return str(scale) if "enhance" in stages and scale else "none"
+
+
+def task_stages(name: str, args, kwargs) -> List[str]:
+    """Stages a Celery task will run, recovered from its name and arguments."""
+    if name in ("process_image", "process_image_batch"):
+        return ["remove_background"]
+    if name == "enhance_image":
+        return ["enhance"]
+    if name == "vectorize_image":
+        return ["enhance", "vectorize"] if kwargs.get("enhance_before") else ["vectorize"]
+    if name == "run_pipeline":
+        return list(kwargs.get("stages") or (args[2] if len(args) > 2 else []))
+    return []
+
+
+def task_labels(name: str, args, kwargs) -> Tuple[str, str]:
+    stages = task_stages(name, args or (), kwargs or {})
+    scale = (kwargs or {}).get("scale") or (kwargs or {}).get("enhance_scale")
+    return task_type_for(stages), scale_label(stages, scale)
+
+
+def observe_stages(timings: Dict[str, float], stages: List[str], scale: Optional[int] = None) -> None:
+    task_type = task_type_for(stages)
+    scale = scale_label(stages, scale)
+    for stage, seconds in timings.items():
+        STAGE_DURATION.labels(stage=stage, task_type=task_type, scale=scale).observe(seconds)
+
+
+def is_oom(exc: BaseException) -> bool:
+    if isinstance(exc, MemoryError) or type(exc).__name__ == "OutOfMemoryError":
+        return True
+    message = str(exc).lower()
+    return "out of memory" in message or "failed to allocate memory" in message
+
+
+def record_failure(task_type: str, exc: BaseException) -> None:
+    TASK_FAILURES.labels(task_type=task_type, exception=type(exc).__name__).inc()
+    if is_oom(exc):
+        TASK_OOMS.labels(task_type=task_type).inc()
+
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers=None, **kwargs):
+    # También corre en el worker cuando una cadena publica su siguiente tarea.
+    if headers is not None:
+        headers.setdefault(ENQUEUED_AT_HEADER, time.time())
+
+
+def observe_queue_wait(enqueued_at: Optional[float], task_type: str, scale: str = "none") -> None:
+    if enqueued_at is not None:
+        QUEUE_WAIT.labels(task_type=task_type, scale=scale).observe(max(time.time() - enqueued_at, 0))
+
+
+@task_prerun.connect
+def observe_task_start(sender=None, task=None, args=None, kwargs=None, **extra):
+    # Las tareas de celery-batches se miden por request dentro del propio lote.
+    if task is None or task.name == "process_image_batch":
+        return
+    task_type, scale = task_labels(task.name, args, kwargs)
+    observe_queue_wait(task.request.get(ENQUEUED_AT_HEADER), task_type, scale)
+
+
+@task_failure.connect
+def count_task_failure(sender=None, exception=None, args=None, kwargs=None, **extra):
+    task_type, _ = task_labels(sender.name, args, kwargs)
+    record_failure(task_type, exception)
+
+
+@worker_process_shutdown.connect
+def mark_process_dead(pid=None, **kwargs):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+class QueueDepthCollector:
+    """Reads the broker queue lengths at scrape time instead of polling in the background."""
+
+    def __init__(self):
+        self._client: Optional[redis.Redis] = None
+
+    @staticmethod
+    def _family() -> GaugeMetricFamily:
+        return GaugeMetricFamily("image_queue_depth", "Tasks waiting in each broker queue", labels=["queue"])
+
+    def describe(self):
+        # Sin describe(), registry.register() llamaría a collect() y abriría Redis al registrar.
+        yield self._family()
+
+    def collect(self):
+        gauge = self._family()
+        try:
+            if self._client is None:
+                self._client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+            for queue in (inference_queue(), settings.CPU_QUEUE):
+                pipe = self._client.pipeline()
+                for step in PRIORITY_STEPS:
+                    pipe.llen(queue if step == 0 else f"{queue}{PRIORITY_SEPARATOR}{step}")
+                gauge.add_metric([queue], sum(pipe.execute()))
+        except Exception as e:
+            logger.warning(f"No se pudo leer la profundidad de las colas: {e}")
+        yield gauge
+
+
+def build_registry(include_queue_depth: bool = False) -> CollectorRegistry:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        from prometheus_client import REGISTRY as registry
+    if include_queue_depth:
+        registry.register(QueueDepthCollector())
+    return registry
+
+
+def render(registry: CollectorRegistry) -> Tuple[bytes, str]:
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    start_http_server(settings.WORKER_METRICS_PORT, registry=build_registry())
+    logger.info(f"Exportando métricas del worker en :{settings.WORKER_METRICS_PORT}")
+    while True:
+        time.sleep(3600)
@@ -0,0 +1,144 @@
+import logging
+from .config import settings
+from .cpu_profile import is_cpu_profile, realesrgan_model
+from .metrics import MODELS_LOADED
+from .onnx_session import create_session
+
+logger = logging.getLogger(__name__)
+
+session = None
+upsampler = None
+
+# nombre -> (arquitectura, escala, pesos). realesr-general-x4v3 es la red compacta
+# (SRVGGNetCompact): mucho más liviana que RRDBNet, pensada para CPU.
+REALESRGAN_MODELS = {
+    "RealESRGAN_x4plus": (
+        "rrdb", 4, "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth",
+    ),
+    "RealESRGAN_x2plus": (
+        "rrdb", 2, "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth",
+    ),
+    "realesr-general-x4v3": (
+        "compact", 4, "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-x4v3.pth",
+    ),
+}
+
+
+def check_gpu_availability():
+    try:
+        import torch
+        if torch.cuda.is_available():
+            logger.info("="*60)
+            logger.info("GPU DETECTADA - PYTORCH")
+            logger.info("="*60)
+            logger.info(f"  ✓ Dispositivo: {torch.cuda.get_device_name(0)}")
+            logger.info(f"  ✓ Versión CUDA: {torch.version.cuda}")
+            logger.info(f"  ✓ Memoria: {torch.cuda.get_device_properties(0).total_memory / 1024**3:.2f} GB")
+            logger.info(f"  ✓ Número de GPUs: {torch.cuda.device_count()}")
+        else:
+            logger.warning("⚠ CUDA NO DISPONIBLE en PyTorch - Procesamiento será en CPU")
+    except ImportError:
+        logger.error("⚠ PyTorch no está instalado")
+    except Exception as e:
+        logger.error(f"⚠ Error verificando PyTorch CUDA: {e}")
+
+    try:
+        import onnxruntime as ort
+        available_providers = ort.get_available_providers()
+        logger.info("="*60)
+        logger.info("ONNX RUNTIME PROVIDERS")
+        logger.info("="*60)
+        for i, provider in enumerate(available_providers, 1):
+            status = "✓" if provider in available_providers else "✗"
+            logger.info(f"  {status} {provider}")
+        
+        if "CUDAExecutionProvider" in available_providers:
+            logger.info("  ✓ ONNX Runtime usará GPU (CUDA)")
+        else:
+            logger.warning("  ⚠ ONNX Runtime usará CPU (CUDA no disponible)")
+    except ImportError:
+        logger.error("⚠ ONNX Runtime no está instalado")
+    except Exception as e:
+        logger.error(f"⚠ Error verificando ONNX Runtime: {e}")
+    
+    logger.info("="*60)
+
+
+def get_session():
+    global session
+    if session is None:
+        if not is_cpu_profile():
+            check_gpu_availability()
+        model_name = settings.REMBG_MODEL
+        logger.info(f"Cargando modelo {model_name}...")
+
+        if is_cpu_profile():
+            session = create_session(model_name, ["CPUExecutionProvider"])
+            logger.info("Modelo cargado en CPU (DEVICE_PROFILE=cpu)")
+            MODELS_LOADED.labels(model=model_name).set(1)
+            return session
+
+        try:
+            providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+            session = create_session(model_name, providers)
+            logger.info("Modelo cargado exitosamente con GPU")
+            logger.info(f"  Session providers: {session.providers}")
+        except Exception as e:
+            logger.error(f"Error cargando modelo con GPU: {e}")
+            logger.error("Intentando fallback a CPU...")
+            session = create_session(model_name, ["CPUExecutionProvider"])
+            logger.info("Modelo cargado en CPU (fallback)")
+
+        MODELS_LOADED.labels(model=model_name).set(1)
+
+    return session
+
+
+def build_realesrgan_model(model_name: str):
+    """Network and weights URL for a supported Real-ESRGAN model."""
+    if model_name not in REALESRGAN_MODELS:
+        raise ValueError(f"Unknown Real-ESRGAN model: {model_name}. Available: {', '.join(REALESRGAN_MODELS)}")
+
+    arch, scale, url = REALESRGAN_MODELS[model_name]
+    if arch == "compact":
+        from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+
+        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=scale, act_type="prelu")
+    else:
+        from basicsr.archs.rrdbnet_arch import RRDBNet
+
+        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=scale)
+    return model, scale, url
+
+
+def get_realesrgan_upsampler():
+    global upsampler
+    if upsampler is None:
+        model_name = realesrgan_model()
+        logger.info(f"Cargando modelo Real-ESRGAN {model_name}...")
+
+        try:
+            import torch
+            from realesrgan import RealESRGANer
+
+            model, scale, url = build_realesrgan_model(model_name)
+
+            # fp16 solo tiene sentido en GPU; en CPU es más lento o directamente no está soportado.
+            use_gpu = torch.cuda.is_available() and not is_cpu_profile()
+            upsampler = RealESRGANer(
+                scale=scale,
+                model_path=url,
+                model=model,
+                tile=0,
+                tile_pad=10,
+                pre_pad=0,
+                half=use_gpu,
+                device=None if use_gpu else torch.device("cpu"),
+            )
+            logger.info(f"Modelo Real-ESRGAN {model_name} cargado exitosamente ({'GPU fp16' if use_gpu else 'CPU fp32'})")
+            MODELS_LOADED.labels(model=model_name).set(1)
+        except Exception as e:
+            logger.error(f"Error cargando modelo Real-ESRGAN: {e}")
+            raise
+
+    return upsampler
@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+import platform
+from typing import List, Optional
+
+import onnxruntime as ort
+from rembg.sessions import sessions_class
+
+from .config import settings
+from .cpu_profile import inference_threads, is_cpu_profile, rembg_precision
+
+logger = logging.getLogger(__name__)
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def session_options(preoptimized: bool = False) -> ort.SessionOptions:
+    """SessionOptions from Settings; a graph loaded from the optimized-model cache is not optimized again."""
+    opts = ort.SessionOptions()
+
+    if is_cpu_profile():
+        intra_op_threads = settings.ORT_INTRA_OP_THREADS or inference_threads()
+        inter_op_threads = settings.ORT_INTER_OP_THREADS or 1
+        # Con varios procesos por nodo, los hilos que esperan en spin le roban CPU a los vecinos.
+        opts.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    else:
+        intra_op_threads = settings.ORT_INTRA_OP_THREADS or int(os.environ.get("OMP_NUM_THREADS") or 0)
+        inter_op_threads = settings.ORT_INTER_OP_THREADS
+    if intra_op_threads:
+        opts.intra_op_num_threads = intra_op_threads
+    if inter_op_threads:
+        opts.inter_op_num_threads = inter_op_threads
+
+    opts.execution_mode = EXECUTION_MODES[settings.ORT_EXECUTION_MODE]
+    opts.enable_cpu_mem_arena = settings.ORT_CPU_MEM_ARENA
+    opts.enable_mem_pattern = settings.ORT_MEM_PATTERN
+    opts.graph_optimization_level = (
+        ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        if preoptimized
+        else GRAPH_OPTIMIZATION_LEVELS[settings.ORT_GRAPH_OPTIMIZATION]
+    )
+    return opts
+
+
+def _cache_dir() -> Optional[str]:
+    try:
+        os.makedirs(settings.ORT_MODEL_CACHE_DIR, exist_ok=True)
+    except OSError as e:
+        logger.warning(f"Cache de modelos ONNX no disponible en {settings.ORT_MODEL_CACHE_DIR}: {e}")
+        return None
+    return settings.ORT_MODEL_CACHE_DIR
+
+
+def _hardware_id() -> str:
+    """CPU architecture and instruction-set flags: level "all" bakes in layouts for this hardware."""
+    flags = ""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    flags = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        flags = platform.processor()
+    return f"{platform.machine()}-{hashlib.sha256(flags.encode('utf-8')).hexdigest()[:8]}"
+
+
+def _variant_path(source: str, *parts: str) -> Optional[str]:
+    """Cache path for a derived model, keyed on the source file and everything that shapes the derived graph."""
+    cache_dir = _cache_dir()
+    if cache_dir is None:
+        return None
+    stat = os.stat(source)
+    key = "|".join([os.path.basename(source), str(stat.st_size), str(stat.st_mtime_ns), ort.__version__, *parts])
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(cache_dir, f"{stem}.{parts[0]}.{digest}.onnx")
+
+
+def quantized_model(source: str) -> str:
+    """Dynamically quantized int8 copy of the model, built once and reused by every process."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    op_types = [op for op in settings.REMBG_INT8_OP_TYPES.split(",") if op]
+    target = _variant_path(source, "int8", ",".join(op_types))
+    if target is None:
+        return source
+    if os.path.exists(target):
+        return target
+
+    logger.info(f"Cuantizando {os.path.basename(source)} a int8 ({', '.join(op_types) or 'todas las ops'})...")
+    partial = f"{target}.{os.getpid()}.part"
+    quantize_dynamic(
+        source,
+        partial,
+        op_types_to_quantize=op_types or None,
+        weight_type=QuantType.QUInt8,
+    )
+    os.replace(partial, target)
+    logger.info(f"Modelo int8 guardado en {target}")
+    return target
+
+
+def _session_class(base, model_path: str):
+    class CachedModelSession(base):
+        @classmethod
+        def download_models(cls, *args, **kwargs):
+            return model_path
+
+    return CachedModelSession
+
+
+def create_session(model_name: str, providers: List[str]):
+    """Build a rembg session with tuned SessionOptions, reusing the optimized graph saved by a previous start."""
+    base = next((cls for cls in sessions_class if cls.name() == model_name), None)
+    if base is None:
+        raise ValueError(f"Unknown rembg model: {model_name}")
+
+    source = str(base.download_models())
+    available = ort.get_available_providers()
+    # onnxruntime-gpu lista CUDA aunque CUDA_VISIBLE_DEVICES oculte todos los dispositivos.
+    if is_cpu_profile() or os.environ.get("CUDA_VISIBLE_DEVICES") == "":
+        available = [p for p in available if p != "CUDAExecutionProvider"]
+        providers = [p for p in providers if p in available] or ["CPUExecutionProvider"]
+    provider = next((p for p in providers if p in available), "CPUExecutionProvider")
+
+    if rembg_precision() == "int8":
+        source = quantized_model(source)
+    elif settings.REMBG_INT8:
+        logger.warning("REMBG_INT8 solo aplica con DEVICE_PROFILE=cpu; se usa el modelo fp32")
+
+    target = None
+    if settings.ORT_MODEL_CACHE:
+        # El grafo optimizado depende del provider y, con "all", del CPU que lo generó:
+        # workers de otro hardware que comparten el volumen guardan su propia copia.
+        target = _variant_path(source, "opt", provider, settings.ORT_GRAPH_OPTIMIZATION, _hardware_id())
+
+    if target is not None and os.path.exists(target):
+        logger.info(f"Cargando grafo optimizado desde cache: {target}")
+        return _session_class(base, target)(model_name, session_options(preoptimized=True), providers)
+
+    opts = session_options()
+    partial = None
+    if target is not None:
+        partial = f"{target}.{os.getpid()}.part"
+        opts.optimized_model_filepath = partial
+
+    session = _session_class(base, source)(model_name, opts, providers)
+
+    if partial is not None and os.path.exists(partial):
+        os.replace(partial, target)
+        logger.info(f"Grafo optimizado guardado en {target}")
+    return session
@@ -0,0 +1,244 @@
+import io
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+import cv2
+import numpy as np
+import vtracer
+from PIL import Image, ImageOps
+
+from .config import settings
+from .models import get_realesrgan_upsampler, get_session
+from .metrics import SVG_SIZE_REDUCTION
+from .profiling import stage_timer
+from .segmentation import cutout, decode_for_model, model_input_size, predict_masks, upsample_mask
+from .stages import validate_stages
+from .svg_optimize import optimize_svg
+from .vectorize_presets import plan_vectorize, prepare_pixels, restore_size
+from .tiling import enhance_tiled
+
+logger = logging.getLogger(__name__)
+
+# Una etapa recibe píxeles RGB/RGBA uint8 y devuelve píxeles o, si es la última, un SVG.
+Pixels = np.ndarray
+StageOutput = Union[Pixels, str]
+
+
+def decode(data: bytes) -> Pixels:
+    with stage_timer("decode"):
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        return np.asarray(img.convert("RGBA" if has_alpha else "RGB"))
+
+
+def crop_to_alpha(pixels: Pixels, padding: int = 0) -> Pixels:
+    """Crop an RGBA image to the bounding box of its visible pixels, plus `padding` on each side."""
+    if pixels.shape[2] != 4:
+        return pixels
+
+    visible = pixels[:, :, 3] > 0
+    rows = np.flatnonzero(visible.any(axis=1))
+    if rows.size == 0:
+        return pixels
+    cols = np.flatnonzero(visible.any(axis=0))
+
+    height, width = visible.shape
+    y0, y1 = max(rows[0] - padding, 0), min(rows[-1] + 1 + padding, height)
+    x0, x1 = max(cols[0] - padding, 0), min(cols[-1] + 1 + padding, width)
+    return pixels[y0:y1, x0:x1]
+
+
+def _encode_png(pixels: Pixels, compression: int) -> bytes:
+    if pixels.shape[2] == 4:
+        bgr = cv2.cvtColor(pixels, cv2.COLOR_RGBA2BGRA)
+    else:
+        bgr = cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
+    ok, buffer = cv2.imencode(".png", bgr, [cv2.IMWRITE_PNG_COMPRESSION, compression])
+    if not ok:
+        raise ValueError("Error codificando imagen PNG")
+    return buffer.tobytes()
+
+
+def _encode_with_pil(pixels: Pixels, output_format: str, output: dict) -> bytes:
+    img = Image.fromarray(pixels)
+    buffer = io.BytesIO()
+    if output_format == "webp":
+        # Sin pérdida: mismo resultado que el PNG, normalmente bastante más chico.
+        img.save(buffer, "WEBP", lossless=True, quality=100, method=settings.WEBP_METHOD)
+    elif output_format == "avif":
+        import pillow_avif  # noqa: F401  registra el codec AVIF en Pillow
+
+        img.save(buffer, "AVIF", quality=settings.AVIF_QUALITY, speed=settings.AVIF_SPEED)
+    else:
+        # Paleta de 256 colores con alfa; FASTOCTREE es el cuantizador de Pillow que admite RGBA.
+        method = Image.Quantize.FASTOCTREE if img.mode == "RGBA" else Image.Quantize.MEDIANCUT
+        palette = img.quantize(colors=256, method=method)
+        palette.save(buffer, "PNG", optimize=True, compress_level=output.get("png_compression", settings.PNG_COMPRESSION_LEVEL))
+    return buffer.getvalue()
+
+
+def encode(result: StageOutput, output: Optional[dict] = None) -> bytes:
+    """Encode the final stage output; `output` selects crop, format and PNG compression for raster results."""
+    output = output or {}
+    with stage_timer("encode"):
+        if isinstance(result, str):
+            return result.encode("utf-8")
+
+        if output.get("crop"):
+            result = crop_to_alpha(result, output.get("crop_padding", 0))
+
+        output_format = output.get("format", "png")
+        if output_format == "png" and not output.get("png_palette"):
+            return _encode_png(result, output.get("png_compression", settings.PNG_COMPRESSION_LEVEL))
+        return _encode_with_pil(result, output_format, output)
+
+
+def predict_reduced_mask(data: bytes) -> Optional[Image.Image]:
+    """Mask predicted from a reduced JPEG decode, before the full-resolution image is ever decoded."""
+    session = get_session()
+    with stage_timer("decode"):
+        small = decode_for_model(data, model_input_size(session))
+    if small is None:
+        return None
+    with stage_timer("inference"):
+        return predict_masks(session, [small])[0]
+
+
+def remove_background(pixels: Pixels, options: dict) -> Pixels:
+    img = Image.fromarray(pixels)
+    mask = options.get("reduced_mask")
+    with stage_timer("inference"):
+        if mask is None:
+            mask = predict_masks(get_session(), [img])[0]
+        else:
+            mask = upsample_mask(mask, img.size)
+    with stage_timer("matting"):
+        return np.asarray(cutout(img, mask, options.get("matting", settings.ALPHA_MATTING_MODE)))
+
+
+def enhance(pixels: Pixels, options: dict) -> Pixels:
+    scale = options.get("scale", 4)
+    if scale not in [2, 4, 8]:
+        raise ValueError(f"Invalid scale: {scale}. Must be 2, 4, or 8")
+
+    upsampler = get_realesrgan_upsampler()
+    if upsampler.scale != scale:
+        logger.warning(f"Modelo escala {upsampler.scale}x, solicitado {scale}x. Se reescala la salida.")
+
+    rgb = pixels[:, :, :3]
+    with stage_timer("inference"):
+        output = enhance_tiled(upsampler, rgb, outscale=scale)
+
+    if pixels.shape[2] == 4:
+        alpha = cv2.resize(pixels[:, :, 3], (output.shape[1], output.shape[0]), interpolation=cv2.INTER_LINEAR)
+        output = np.dstack([output, alpha])
+
+    return output
+
+
+# Estadísticas de la optimización de SVG de la ejecución actual; None cuando nadie las pide.
+_svg_stats: ContextVar[Optional[Dict[str, float]]] = ContextVar("svg_stats", default=None)
+
+
+@contextmanager
+def collect_svg_stats() -> Iterator[Dict[str, float]]:
+    """Collect bytes_in, bytes_out and reduction of an SVG optimized inside the block (empty if none was)."""
+    stats: Dict[str, float] = {}
+    token = _svg_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _svg_stats.reset(token)
+
+
+def vectorize(pixels: Pixels, options: dict) -> str:
+    output = options.get("output") or {}
+    height, width = pixels.shape[:2]
+
+    with stage_timer("vectorize_prepare"):
+        plan = plan_vectorize(pixels, output.get("vectorize_preset", settings.VECTORIZE_PRESET))
+        traced = prepare_pixels(pixels, plan)
+    traced_height, traced_width = traced.shape[:2]
+    logger.info(
+        f"Vectorizando con preset {plan.preset} ({plan.colors} colores): {width}x{height} -> "
+        f"{traced_width}x{traced_height}" + (f", paleta de {plan.quantize_colors} colores" if plan.quantize_colors else "")
+    )
+
+    with stage_timer("vectorize"):
+        # PNG sin compresión: vtracer lo decodifica en Rust, sin una tupla de Python por píxel.
+        buffer = io.BytesIO()
+        Image.fromarray(np.ascontiguousarray(traced), "RGBA").save(buffer, format="PNG", compress_level=0)
+        svg = vtracer.convert_raw_image_to_svg(buffer.getvalue(), img_format="png", **plan.options)
+    svg = restore_size(svg, (traced_width, traced_height), (width, height))
+
+    if not output.get("optimize_svg", settings.SVG_OPTIMIZE):
+        return svg
+
+    with stage_timer("svg_optimize"):
+        svg, stats = optimize_svg(
+            svg,
+            precision=output.get("svg_precision", settings.SVG_PRECISION),
+            min_size=settings.SVG_MIN_PATH_SIZE,
+        )
+    SVG_SIZE_REDUCTION.observe(stats.reduction)
+    collected = _svg_stats.get()
+    if collected is not None:
+        collected.update(bytes_in=stats.bytes_in, bytes_out=stats.bytes_out, reduction=round(stats.reduction, 4))
+    logger.info(
+        f"SVG optimizado: {stats.bytes_in / 1024:.0f}KB -> {stats.bytes_out / 1024:.0f}KB "
+        f"(-{stats.reduction:.0%}), paths {stats.paths_in} -> {stats.paths_out}, {stats.dropped} descartados"
+    )
+    return svg
+
+
+STAGE_FUNCTIONS = {
+    "remove_background": remove_background,
+    "enhance": enhance,
+    "vectorize": vectorize,
+}
+
+
+def run_stages(
+    pixels: Pixels,
+    stages: List[str],
+    options: Optional[dict] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> StageOutput:
+    validate_stages(stages)
+    options = options or {}
+
+    result: StageOutput = pixels
+    for index, stage in enumerate(stages):
+        logger.info(f"Etapa {index + 1}/{len(stages)}: {stage}")
+        start_time = time.time()
+        result = STAGE_FUNCTIONS[stage](result, options)
+        logger.info(f"Tiempo de {stage}: {time.time() - start_time:.2f}s")
+
+        if on_progress is not None:
+            on_progress(int(90 * (index + 1) / len(stages)))
+
+    return result
+
+
+def run_pipeline(
+    data: bytes,
+    stages: List[str],
+    options: Optional[dict] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> bytes:
+    """Decode once, run every stage on in-memory pixels and encode the final result once."""
+    return encode(run_stages(decode(data), stages, options, on_progress))
+
+
+def save_intermediate(pixels: Pixels) -> bytes:
+    """Hand raw pixels to the next queue's task without an encode/decode round-trip."""
+    buffer = io.BytesIO()
+    np.save(buffer, pixels, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def load_intermediate(data: bytes) -> Pixels:
+    return np.load(io.BytesIO(data), allow_pickle=False)
@@ -0,0 +1,37 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+# Acumulador activo de la ejecución actual; None cuando nadie está midiendo.
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Time a block and add it to the active collector under `stage` (decode, inference, matting, ...)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def collect_timings() -> Iterator[Dict[str, float]]:
+    """Collect the seconds spent per stage by every stage_timer run inside the block.
+
+    A collector opened inside another one also adds its totals to the outer collector on exit.
+    """
+    timings: Dict[str, float] = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+        outer = _timings.get()
+        if outer is not None:
+            for stage, seconds in timings.items():
+                outer[stage] = outer.get(stage, 0.0) + seconds
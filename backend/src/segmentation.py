@@ -0,0 +1,113 @@
+import io
+import logging
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+from rembg.bg import alpha_matting_cutout, naive_cutout
+
+from .config import settings
+from .matting import fast_alpha_matting_cutout
+
+logger = logging.getLogger(__name__)
+
+# Preprocessing per rembg session family: (mean, std, input size, apply sigmoid).
+# Mirrors each session's predict() so a batch can go through one forward pass.
+MODEL_SPECS = {
+    "birefnet": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (1024, 1024), True),
+    "isnet": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024), False),
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320), False),
+}
+
+
+# Solo se decodifica reducido si la imagen tiene al menos este múltiplo de los píxeles de entrada del modelo.
+REDUCED_DECODE_MIN_FACTOR = 4
+DEFAULT_INPUT_SIZE = (1024, 1024)
+
+
+def get_model_spec(model_name: str):
+    for family, spec in MODEL_SPECS.items():
+        if model_name.startswith(family):
+            return spec
+    return None
+
+
+def decode_image(data: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(data))
+    return ImageOps.exif_transpose(img)
+
+
+def model_input_size(session):
+    spec = get_model_spec(session.model_name)
+    return spec[2] if spec else DEFAULT_INPUT_SIZE
+
+
+def decode_for_model(data: bytes, size) -> Optional[Image.Image]:
+    """Decode a large JPEG at a reduced DCT scale close to the model's input size.
+
+    Returns None when the input is not a JPEG or is not large enough for this to pay off;
+    the caller then uses the full-resolution image for the model as well.
+    """
+    img = Image.open(io.BytesIO(data))
+    if img.format != "JPEG" or img.width * img.height < REDUCED_DECODE_MIN_FACTOR * size[0] * size[1]:
+        return None
+    img.draft("RGB", size)
+    return ImageOps.exif_transpose(img).convert("RGB")
+
+
+def upsample_mask(mask: Image.Image, size) -> Image.Image:
+    """Bring a low-resolution mask to the composite's size; matting then refines the edge band."""
+    return mask if mask.size == size else mask.resize(size, Image.Resampling.BILINEAR)
+
+
+def batch_limit(session) -> int:
+    """Largest batch the ONNX export accepts, or 0 when its batch dimension is dynamic."""
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else 0
+
+
+def _postprocess_mask(pred: np.ndarray, use_sigmoid: bool, size) -> Image.Image:
+    if use_sigmoid:
+        pred = 1 / (1 + np.exp(-pred))
+    ma = np.max(pred)
+    mi = np.min(pred)
+    pred = (pred - mi) / (ma - mi)
+    mask = Image.fromarray((np.squeeze(pred) * 255).astype("uint8"), mode="L")
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+
+def predict_masks(session, images: List[Image.Image]) -> List[Image.Image]:
+    """Predict one mask per image, running the batch through the ONNX model in as few passes as it allows."""
+    spec = get_model_spec(session.model_name)
+    if spec is None:
+        return [session.predict(img)[0] for img in images]
+
+    mean, std, size, use_sigmoid = spec
+    input_name = session.inner_session.get_inputs()[0].name
+    inputs = [session.normalize(img, mean, std, size)[input_name] for img in images]
+
+    limit = batch_limit(session) or len(inputs)
+    masks = []
+    for start in range(0, len(inputs), limit):
+        chunk = np.concatenate(inputs[start:start + limit], axis=0)
+        outputs = session.inner_session.run(None, {input_name: chunk})[0]
+        for offset, pred in enumerate(outputs[:, 0, :, :]):
+            masks.append(_postprocess_mask(pred, use_sigmoid, images[start + offset].size))
+    return masks
+
+
+def cutout(img: Image.Image, mask: Image.Image, matting: str = "full") -> Image.Image:
+    if matting == "none":
+        return naive_cutout(img, mask)
+    if matting == "fast":
+        return fast_alpha_matting_cutout(img, mask)
+    try:
+        return alpha_matting_cutout(
+            img,
+            mask,
+            settings.ALPHA_MATTING_FOREGROUND_THRESHOLD,
+            settings.ALPHA_MATTING_BACKGROUND_THRESHOLD,
+            settings.ALPHA_MATTING_ERODE_SIZE,
+        )
+    except ValueError:
+        return naive_cutout(img, mask)
@@ -0,0 +1,21 @@
+"""Build task signatures by name so the API never imports tasks.py (and with it rembg, torch and vtracer).
+
+The worker registers the implementations under these same names in tasks.py.
+"""
+from celery import Signature
+
+from .celery_app import celery_app
+
+PROCESS_IMAGE = "process_image"
+PROCESS_IMAGE_BATCH = "process_image_batch"
+VECTORIZE_IMAGE = "vectorize_image"
+ENHANCE_IMAGE = "enhance_image"
+RUN_PIPELINE = "run_pipeline"
+
+TASK_NAMES = {PROCESS_IMAGE, PROCESS_IMAGE_BATCH, VECTORIZE_IMAGE, ENHANCE_IMAGE, RUN_PIPELINE}
+
+
+def task_signature(name: str, *args, immutable: bool = False, **kwargs) -> Signature:
+    if name not in TASK_NAMES:
+        raise ValueError(f"Unknown task: {name}")
+    return celery_app.signature(name, args=args, kwargs=kwargs, immutable=immutable)
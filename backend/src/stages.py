@@ -0,0 +1,50 @@
+from typing import List, Tuple
+
+PIPELINE_STAGES = ("remove_background", "enhance", "vectorize")
+
+# Etapas que ejecuta cada task_type fijo de /upload.
+TASK_TYPE_STAGES = {
+    "remove_background": ["remove_background"],
+    "vectorize": ["vectorize"],
+    "enhance": ["enhance"],
+    "vectorize_enhance": ["enhance", "vectorize"],
+}
+
+# Etapas que corren un modelo y deben ir a la cola de GPU; el resto es CPU (vtracer).
+GPU_STAGES = {"remove_background", "enhance"}
+
+MATTING_MODES = ("none", "fast", "full")
+
+# Presets de vtracer (ver vectorize_presets.py); "auto" elige según tamaño y colores.
+VECTORIZE_PRESETS = ("auto", "flat", "illustration", "photo", "detailed")
+
+# Formatos de salida para resultados raster; la vectorización siempre produce SVG.
+OUTPUT_FORMATS = ("png", "webp", "avif")
+
+# Píxeles crudos (.npy) que una etapa de GPU deja para la etapa de CPU siguiente.
+INTERMEDIATE_EXTENSION = ".npy"
+
+
+def validate_stages(stages: List[str]) -> None:
+    if not stages:
+        raise ValueError("Pipeline must contain at least one stage")
+    for stage in stages:
+        if stage not in PIPELINE_STAGES:
+            raise ValueError(f"Unknown pipeline stage: {stage}. Use {', '.join(PIPELINE_STAGES)}")
+    if "vectorize" in stages[:-1]:
+        raise ValueError("'vectorize' must be the last stage of a pipeline")
+
+
+def output_extension(stages: List[str], output_format: str = "png") -> str:
+    return ".svg" if stages[-1] == "vectorize" else f".{output_format}"
+
+
+def uses_gpu(stages: List[str]) -> bool:
+    return any(stage in GPU_STAGES for stage in stages)
+
+
+def split_stages(stages: List[str]) -> Tuple[List[str], List[str]]:
+    """Split a pipeline into its GPU prefix and CPU suffix so each half can run on its own queue."""
+    if stages[-1] == "vectorize" and uses_gpu(stages[:-1]):
+        return stages[:-1], stages[-1:]
+    return stages, []
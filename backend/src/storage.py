@@ -0,0 +1,239 @@
+"""Key layout and lifecycle of uploads and results in the blob store.
+
+New blobs go under two levels of shard prefixes taken from their name
+(`results/ab/cd/abcd....png`), so no local directory grows past a few hundred entries.
+Results are named after their cache key, uploads and intermediates after a fresh uuid.
+Uploads are spooled to a local file while they arrive and committed to the store once
+validated.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import redis
+
+from .blobstore import RESULTS, UPLOADS, blob_store
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+JANITOR_LOCK_KEY = "storage:janitor-lock"
+SWEEP_CURSOR_KEY = "storage:sweep-cursor"
+# Bytes por shard en la última pasada; la suma aproxima el uso total del store.
+SWEEP_USAGE_KEY = "storage:usage"
+
+# Cada pasada del janitor barre un solo shard (primer carácter hex del nombre).
+SWEEP_SHARDS = "0123456789abcdef"
+
+# Subidas en curso: siempre en disco local, fuera del espacio de claves del store.
+SPOOL_DIR = ".spool"
+
+# Variantes comprimidas que se guardan junto a los resultados de texto, por Content-Encoding.
+PRECOMPRESSED_VARIANTS = {"br": ".br", "gzip": ".gz"}
+COMPRESSIBLE_EXTENSIONS = {".svg"}
+
+
+def shard_key(namespace: str, filename: str) -> str:
+    filename = os.path.basename(filename)
+    return f"{namespace}/{filename[:2]}/{filename[2:4]}/{filename}"
+
+
+def upload_key(filename: str) -> str:
+    return shard_key(UPLOADS, filename)
+
+
+def result_key(filename: str) -> str:
+    return shard_key(RESULTS, filename)
+
+
+def resolve(namespace: str, filename: str) -> Optional[str]:
+    """Key of an existing blob, or None."""
+    key = shard_key(namespace, filename)
+    return key if blob_store.exists(key) else None
+
+
+def spool_path(filename: str) -> str:
+    """Local file an incoming upload is written to before it is committed to the store."""
+    directory = os.path.join(settings.UPLOAD_DIR, SPOOL_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, os.path.basename(filename) + ".part")
+
+
+def write_precompressed(key: str, data: bytes) -> None:
+    """Store gzip and brotli copies next to a text result so they can be served as-is."""
+    if os.path.splitext(key)[1] not in COMPRESSIBLE_EXTENSIONS:
+        return
+
+    import gzip
+
+    variants = {"gzip": lambda: gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+
+        variants["br"] = lambda: brotli.compress(data, quality=11)
+    except ImportError:
+        logger.warning("brotli no está instalado, solo se genera la variante gzip")
+
+    for encoding, compress in variants.items():
+        blob_store.write(key + PRECOMPRESSED_VARIANTS[encoding], compress())
+
+
+def remove_with_variants(key: str) -> None:
+    for suffix in ("", *PRECOMPRESSED_VARIANTS.values()):
+        blob_store.delete(key + suffix)
+
+
+def record_access(key: str) -> None:
+    """Stamp the read time for the janitor's LRU (a no-op on backends without access times)."""
+    try:
+        blob_store.touch(key)
+    except Exception as e:
+        logger.warning(f"No se pudo registrar el acceso a {key}: {e}")
+
+
+def _sweep_spool(now: float) -> None:
+    # Restos de subidas que se cortaron a mitad de camino.
+    directory = os.path.join(settings.UPLOAD_DIR, SPOOL_DIR)
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if now - entry.stat().st_mtime > settings.UPLOAD_TTL:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+    except FileNotFoundError:
+        pass
+
+
+def _variant_of(key: str) -> Optional[str]:
+    """Main result key of a precompressed variant, or None when key is not one."""
+    for suffix in PRECOMPRESSED_VARIANTS.values():
+        if key.endswith(suffix):
+            return key[: -len(suffix)]
+    return None
+
+
+def sweep(shard: str = "", other_bytes: int = 0) -> Tuple[int, int, int]:
+    """Sweep the blobs whose name starts with shard: expired ones, then least recently used.
+
+    other_bytes is what the rest of the store held when last swept; the shard is trimmed
+    in proportion to how far the total is over STORAGE_MAX_BYTES. Returns (blobs removed,
+    bytes freed, bytes left in the shard).
+    """
+    from .cache import result_cache
+
+    now = time.time()
+    ttls = {UPLOADS: settings.UPLOAD_TTL, RESULTS: settings.RESULT_TTL}
+    survivors: List[Tuple[float, int, str, str, str]] = []
+    removed = 0
+    freed = 0
+
+    def remove(namespace: str, key: str, size: int, probe: str) -> None:
+        nonlocal removed, freed
+        # probe es un blob que se vio al listar; si ya no está, lo borró otro (p. ej. el cache).
+        if not blob_store.exists(probe):
+            return
+        removed += 1
+        freed += size
+        if namespace == RESULTS:
+            # Se borran también sus variantes comprimidas y la entrada de cache.
+            remove_with_variants(key)
+            result_cache.drop(os.path.basename(key))
+        else:
+            blob_store.delete(key)
+
+    for namespace, ttl in ttls.items():
+        # Las variantes .gz/.br se agrupan con su resultado y envejecen con él:
+        # record_access solo toca la clave principal.
+        groups: Dict[str, list] = {}
+        for blob in blob_store.iter_blobs(namespace, shard):
+            # Los resultados cuentan desde su último acceso; las subidas desde que se escribieron.
+            last_used = max(blob.accessed, blob.modified) if namespace == RESULTS else blob.modified
+            main = _variant_of(blob.key) if namespace == RESULTS else None
+            # [último uso del principal, bytes del grupo, último uso de las variantes, blob de prueba]
+            group = groups.setdefault(main or blob.key, [0.0, 0, 0.0, blob.key])
+            group[1] += blob.size
+            if main is None:
+                group[0] = last_used
+                group[3] = blob.key
+            else:
+                group[2] = max(group[2], last_used)
+
+        for key, (last_used, size, variant_used, probe) in groups.items():
+            # Una variante huérfana (sin resultado principal) envejece por su propia fecha.
+            last_used = last_used or variant_used
+            if now - last_used > ttl:
+                remove(namespace, key, size, probe)
+            else:
+                survivors.append((last_used, size, namespace, key, probe))
+
+    kept = sum(size for _, size, _, _, _ in survivors)
+    total = kept + other_bytes
+    if total > settings.STORAGE_MAX_BYTES:
+        # Cada shard se recorta en la misma proporción: un LRU aproximado sin listar todo el store.
+        target = kept * settings.STORAGE_MAX_BYTES / total
+        survivors.sort()
+        for _, size, namespace, key, probe in survivors:
+            if kept <= target:
+                break
+            remove(namespace, key, size, probe)
+            kept -= size
+
+    _sweep_spool(now)
+    blob_store.prune(shard)
+
+    return removed, freed, kept
+
+
+class StorageJanitor:
+    """Periodic sweep from the API process, one shard per interval; a Redis lock keeps replicas from sweeping at once."""
+
+    def __init__(self):
+        self._runner: Optional[asyncio.Task] = None
+        self._client: Optional[redis.Redis] = None
+
+    async def start(self) -> None:
+        if self._runner is None and settings.STORAGE_JANITOR_INTERVAL > 0:
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+
+    def _acquire(self) -> bool:
+        if self._client is None:
+            self._client = redis.Redis.from_url(settings.REDIS_URL)
+        return bool(self._client.set(JANITOR_LOCK_KEY, os.getpid(), nx=True, ex=settings.STORAGE_JANITOR_INTERVAL))
+
+    def _sweep_next_shard(self) -> Tuple[str, int, int]:
+        # El cursor vive en Redis para que las réplicas sigan la rotación donde la dejó otra.
+        shard = SWEEP_SHARDS[(self._client.incr(SWEEP_CURSOR_KEY) - 1) % len(SWEEP_SHARDS)]
+        usage = self._client.hgetall(SWEEP_USAGE_KEY)
+        other_bytes = sum(int(size) for name, size in usage.items() if name.decode() != shard)
+        removed, freed, kept = sweep(shard, other_bytes)
+        self._client.hset(SWEEP_USAGE_KEY, shard, kept)
+        return shard, removed, freed
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await asyncio.to_thread(self._acquire):
+                    start_time = time.time()
+                    shard, removed, freed = await asyncio.to_thread(self._sweep_next_shard)
+                    if removed:
+                        logger.info(
+                            f"Limpieza de almacenamiento (shard {shard}): {removed} archivos eliminados, "
+                            f"{freed / 1024 / 1024:.1f}MB liberados en {time.time() - start_time:.2f}s"
+                        )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Error en la limpieza de almacenamiento: {e}")
+            await asyncio.sleep(settings.STORAGE_JANITOR_INTERVAL)
+
+
+storage_janitor = StorageJanitor()
@@ -0,0 +1,227 @@
+"""Single-pass rewrite of vtracer SVG output into a smaller equivalent.
+
+vtracer writes one `<path d="M.. C.. Z" fill=".." transform="translate(x,y)"/>` per shape,
+with absolute commands and up to path_precision decimals. The rewrite below walks those
+elements in order without building a DOM:
+
+- the translate is baked into the coordinates, which are rounded to `precision` decimals;
+- commands are emitted relative and without redundant separators;
+- shapes smaller than `min_size` pixels on both axes are dropped;
+- consecutive shapes with the same fill whose boxes do not overlap are merged into one
+  element (non-overlapping, so the fill rule cannot open holes between them).
+
+Rounding is done on absolute positions and the relative offsets are taken between
+rounded points, so the error never accumulates along a path.
+"""
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PATH_PATTERN = re.compile(
+    r'<path d="(?P<d>[^"]*)" fill="(?P<fill>[^"]*)"(?: transform="translate\((?P<tx>[-\d.e]+),(?P<ty>[-\d.e]+)\)")?\s*/>'
+)
+TOKEN_PATTERN = re.compile(r"[MLCQZmlcqz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+# Cantidad de coordenadas (pares x,y) por comando absoluto.
+COMMAND_POINTS = {"M": 1, "L": 1, "Q": 2, "C": 3, "Z": 0}
+
+Point = Tuple[float, float]
+Segment = Tuple[str, List[Point]]
+
+
+@dataclass
+class OptimizeStats:
+    bytes_in: int = 0
+    bytes_out: int = 0
+    paths_in: int = 0
+    paths_out: int = 0
+    dropped: int = 0
+
+    @property
+    def reduction(self) -> float:
+        return 1 - self.bytes_out / self.bytes_in if self.bytes_in else 0.0
+
+
+@dataclass
+class _Shape:
+    fill: str
+    segments: List[Segment] = field(default_factory=list)
+    box: Tuple[float, float, float, float] = (0.0, 0.0, 0.0, 0.0)
+
+
+def parse_path(d: str, tx: float, ty: float, precision: int) -> Optional[List[Segment]]:
+    """Absolute, translated and rounded segments; None if the path uses commands we do not rewrite."""
+    tokens = TOKEN_PATTERN.findall(d)
+    segments: List[Segment] = []
+    command = None
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token.isalpha():
+            command = token
+            index += 1
+            if command not in COMMAND_POINTS:
+                return None
+            if command == "Z":
+                segments.append(("Z", []))
+                continue
+        elif command is None or command == "Z":
+            return None
+        elif command == "M":
+            # Coordenadas repetidas tras un M son un L implícito.
+            command = "L"
+
+        count = COMMAND_POINTS[command] * 2
+        values = tokens[index:index + count]
+        if len(values) < count:
+            return None
+        try:
+            numbers = [float(value) for value in values]
+        except ValueError:
+            return None
+        points = [
+            (round(numbers[i] + tx, precision), round(numbers[i + 1] + ty, precision))
+            for i in range(0, count, 2)
+        ]
+        segments.append((command, points))
+        index += count
+    return segments
+
+
+def bounding_box(segments: List[Segment]) -> Tuple[float, float, float, float]:
+    xs = [x for _, points in segments for x, _ in points]
+    ys = [y for _, points in segments for _, y in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def boxes_overlap(a, b) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def format_number(value: float, precision: int) -> str:
+    text = f"{value:.{precision}f}"
+    if precision:
+        text = text.rstrip("0").rstrip(".")
+    if text in ("-0", ""):
+        return "0"
+    if text.startswith("0."):
+        return text[1:]
+    if text.startswith("-0."):
+        return "-" + text[2:]
+    return text
+
+
+def serialize(segments: List[Segment], precision: int) -> str:
+    """Relative path data; the first `m` of a path is absolute by definition, so start from (0, 0)."""
+    parts = []
+    current = (0.0, 0.0)
+    start = current
+    for command, points in segments:
+        if command == "Z":
+            parts.append("z")
+            current = start
+            continue
+
+        numbers = []
+        for x, y in points:
+            numbers.append(format_number(x - current[0], precision))
+            numbers.append(format_number(y - current[1], precision))
+        parts.append(command.lower())
+        for number in numbers:
+            if number.startswith("-") or parts[-1].isalpha():
+                parts.append(number)
+            else:
+                parts.append(" " + number)
+
+        current = points[-1]
+        if command == "M":
+            start = current
+    return "".join(parts)
+
+
+def optimize_svg_stream(
+    svg: str,
+    precision: int = 1,
+    min_size: float = 1.0,
+    stats: Optional[OptimizeStats] = None,
+) -> Iterator[str]:
+    """Yield the optimized document chunk by chunk, holding at most one group of merged shapes."""
+    stats = stats if stats is not None else OptimizeStats()
+    stats.bytes_in += len(svg.encode("utf-8"))
+    pending: Optional[_Shape] = None
+
+    def emit(text: str) -> str:
+        stats.bytes_out += len(text.encode("utf-8"))
+        return text
+
+    def flush() -> Optional[str]:
+        nonlocal pending
+        if pending is None:
+            return None
+        stats.paths_out += 1
+        text = f'<path d="{serialize(pending.segments, precision)}" fill="{pending.fill}"/>\n'
+        pending = None
+        return emit(text)
+
+    position = 0
+    for match in PATH_PATTERN.finditer(svg):
+        between = svg[position:match.start()]
+        position = match.end()
+        stats.paths_in += 1
+
+        tx = float(match.group("tx") or 0)
+        ty = float(match.group("ty") or 0)
+        segments = parse_path(match.group("d"), tx, ty, precision)
+
+        if segments is None:
+            # Comando desconocido: se deja el elemento tal cual.
+            flushed = flush()
+            if flushed:
+                yield flushed
+            stats.paths_out += 1
+            yield emit(between.strip("\n") + match.group(0))
+            continue
+
+        if between.strip():
+            flushed = flush()
+            if flushed:
+                yield flushed
+            yield emit(between.strip("\n") + "\n")
+
+        if not any(points for _, points in segments):
+            stats.dropped += 1
+            continue
+        box = bounding_box(segments)
+        if box[2] - box[0] < min_size and box[3] - box[1] < min_size:
+            stats.dropped += 1
+            continue
+
+        fill = match.group("fill")
+        if pending is not None and pending.fill == fill and not boxes_overlap(pending.box, box):
+            pending.segments.extend(segments)
+            pending.box = (
+                min(pending.box[0], box[0]),
+                min(pending.box[1], box[1]),
+                max(pending.box[2], box[2]),
+                max(pending.box[3], box[3]),
+            )
+            continue
+
+        flushed = flush()
+        if flushed:
+            yield flushed
+        pending = _Shape(fill=fill, segments=segments, box=box)
+
+    flushed = flush()
+    if flushed:
+        yield flushed
+    yield emit(svg[position:].lstrip("\n"))
+
+
+def optimize_svg(svg: str, precision: int = 1, min_size: float = 1.0) -> Tuple[str, OptimizeStats]:
+    stats = OptimizeStats()
+    optimized = "".join(optimize_svg_stream(svg, precision, min_size, stats))
+    return optimized, stats
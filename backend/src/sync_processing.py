@@ -0,0 +1,118 @@
+"""In-process execution of small images for POST /process, bypassing Celery.
+
+The pool's processes import the ML stack and load their own models, so the API only
+offers the fast path when its image was built with the worker requirements. The parent
+never imports rembg, torch or vtracer.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _init_process() -> None:
+    import torch
+
+    from .warmup import WARMUPS
+
+    torch.set_num_threads(settings.SYNC_PROCESS_THREADS)
+    for model in [name for name in settings.SYNC_PROCESS_MODELS.split(",") if name]:
+        WARMUPS[model]()
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _process_file(input_key: str, output_key: str, stages: List[str], options: dict) -> bytes:
+    from .blobstore import blob_store
+    from .pipeline import decode, encode, run_stages
+    from .storage import write_precompressed
+
+    pixels = decode(blob_store.read(input_key))
+    output_data = encode(run_stages(pixels, stages, options), options.get("output"))
+
+    blob_store.write(output_key, output_data)
+    write_precompressed(output_key, output_data)
+    return output_data
+
+
+class SyncProcessor:
+    """Bounded process pool with warm models; callers fall back to the queue when it is busy or missing."""
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._warmup: Optional[asyncio.Task] = None
+        self._active = 0
+        self.available = False
+
+    async def start(self) -> None:
+        # La carga de modelos tarda; la API arranca igual y /process usa la cola mientras tanto.
+        if settings.SYNC_PROCESS_ENABLED and settings.STORAGE_BACKEND == "memory":
+            # Los procesos del pool no ven el store en memoria de este proceso.
+            logger.warning("STORAGE_BACKEND=memory no se comparte con el pool síncrono; /process usará la cola")
+            return
+        if settings.SYNC_PROCESS_ENABLED and self._warmup is None:
+            self._warmup = asyncio.create_task(self._warm_up())
+
+    async def _warm_up(self) -> None:
+        workers = max(settings.SYNC_PROCESS_WORKERS, 1)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process,
+        )
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(loop.run_in_executor(self._executor, _ping) for _ in range(workers)))
+        except (BrokenProcessPool, ImportError) as e:
+            logger.warning(f"Procesamiento síncrono no disponible, /process usará la cola: {e}")
+            self._shutdown()
+            return
+
+        self.available = True
+        logger.info(f"Procesamiento síncrono listo con {workers} procesos")
+
+    async def stop(self) -> None:
+        if self._warmup is not None:
+            self._warmup.cancel()
+            self._warmup = None
+        self._shutdown()
+
+    def reserve(self) -> bool:
+        """Take a slot if the pool has one; call before any await so concurrent requests can't overbook it."""
+        if not self.available or self._active >= settings.SYNC_PROCESS_WORKERS + settings.SYNC_PROCESS_BACKLOG:
+            return False
+        self._active += 1
+        return True
+
+    def release(self) -> None:
+        self._active -= 1
+
+    async def process(self, input_key: str, output_key: str, stages: List[str], options: dict) -> bytes:
+        """Run the stages in a reserved slot; raises BrokenProcessPool (and disables the pool) if a process died."""
+        if self._executor is None:
+            raise BrokenProcessPool("Sync process pool is not running")
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, _process_file, input_key, output_key, stages, options)
+        except BrokenProcessPool:
+            logger.error("Un proceso del pool síncrono murió; /process vuelve a usar la cola")
+            self._shutdown()
+            raise
+
+    def _shutdown(self) -> None:
+        self.available = False
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+sync_processor = SyncProcessor()
@@ -1,319 +1,336 @@
 import os
 import logging
 import time
+from typing import List, Optional
+import numpy as np
 from celery import Task
-from rembg import remove, new_session
-import vtracer
+from celery_batches import Batches
 from .celery_app import celery_app
 from .config import settings
+from .blobstore import blob_store
+from .cache import result_cache
+from .events import ProgressTask, publish_task_event
+from .inflight import TaskCancelled, inflight_jobs
+from .models import get_session
+from .pipeline import (
+    collect_svg_stats, decode, encode, load_intermediate, predict_reduced_mask, run_stages, save_intermediate,
+)
+from .profiling import collect_timings, stage_timer
+from .metrics import ENQUEUED_AT_HEADER, observe_queue_wait, observe_stages, record_failure
+from .stages import INTERMEDIATE_EXTENSION
+from .storage import write_precompressed
+from .signatures import ENHANCE_IMAGE, PROCESS_IMAGE, PROCESS_IMAGE_BATCH, RUN_PIPELINE, VECTORIZE_IMAGE
+from .segmentation import cutout, decode_for_model, decode_image, model_input_size, predict_masks, upsample_mask
 
 logger = logging.getLogger(__name__)
 
-session = None
-upsampler = None
-
-
-def check_gpu_availability():
-    try:
-        import torch
-        if torch.cuda.is_available():
-            logger.info("="*60)
-            logger.info("GPU DETECTADA - PYTORCH")
-            logger.info("="*60)
-            logger.info(f"  ✓ Dispositivo: {torch.cuda.get_device_name(0)}")
-            logger.info(f"  ✓ Versión CUDA: {torch.version.cuda}")
-            logger.info(f"  ✓ Memoria: {torch.cuda.get_device_properties(0).total_memory / 1024**3:.2f} GB")
-            logger.info(f"  ✓ Número de GPUs: {torch.cuda.device_count()}")
-        else:
-            logger.warning("⚠ CUDA NO DISPONIBLE en PyTorch - Procesamiento será en CPU")
-    except ImportError:
-        logger.error("⚠ PyTorch no está instalado")
-    except Exception as e:
-        logger.error(f"⚠ Error verificando PyTorch CUDA: {e}")
 
+def store_in_cache(cache_key: Optional[str], output_key: str) -> None:
+    if not cache_key:
+        return
     try:
-        import onnxruntime as ort
-        available_providers = ort.get_available_providers()
-        logger.info("="*60)
-        logger.info("ONNX RUNTIME PROVIDERS")
-        logger.info("="*60)
-        for i, provider in enumerate(available_providers, 1):
-            status = "✓" if provider in available_providers else "✗"
-            logger.info(f"  {status} {provider}")
-        
-        if "CUDAExecutionProvider" in available_providers:
-            logger.info("  ✓ ONNX Runtime usará GPU (CUDA)")
-        else:
-            logger.warning("  ⚠ ONNX Runtime usará CPU (CUDA no disponible)")
-    except ImportError:
-        logger.error("⚠ ONNX Runtime no está instalado")
+        result_cache.put(cache_key, output_key)
     except Exception as e:
-        logger.error(f"⚠ Error verificando ONNX Runtime: {e}")
-    
-    logger.info("="*60)
-
-
-def get_session():
-    global session
-    if session is None:
-        check_gpu_availability()
-        model_name = settings.REMBG_MODEL
-        logger.info(f"Cargando modelo {model_name}...")
+        logger.warning(f"No se pudo guardar el resultado en cache: {e}")
 
-        try:
-            import onnxruntime as ort
 
-            providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
-            session = new_session(model_name, providers=providers)
-            logger.info("Modelo cargado exitosamente con GPU")
-            logger.info(f"  Session providers: {session.providers}")
-        except Exception as e:
-            logger.error(f"Error cargando modelo con GPU: {e}")
-            logger.error("Intentando fallback a CPU...")
-            session = new_session(model_name)
-            logger.info("Modelo cargado en CPU (fallback)")
+def run_file_pipeline(
+    task: Task,
+    input_key: str,
+    output_key: str,
+    stages: List[str],
+    options: dict,
+    cache_key: Optional[str],
+    report_as: Optional[str] = None,
+    progress_range: Optional[List[int]] = None,
+) -> dict:
+    low, high = progress_range or [0, 100]
+    cancel_id = report_as or task.request.id
 
-    return session
+    def check_cancelled() -> None:
+        if inflight_jobs.is_cancelled(cancel_id):
+            raise TaskCancelled(f"Task {cancel_id} was cancelled")
 
+    def report(progress: int) -> None:
+        check_cancelled()
+        task.update_state(task_id=report_as, state="PROCESSING", meta={"progress": low + (high - low) * progress // 100})
 
-def get_realesrgan_upsampler():
-    global upsampler
-    if upsampler is None:
-        model_name = settings.REALESRGAN_MODEL
-        logger.info(f"Cargando modelo Real-ESRGAN {model_name}...")
+    report(0)
 
-        try:
-            from basicsr.archs.rrdbnet_arch import RRDBNet
-            from realesrgan import RealESRGANer
-
-            if "x2" in model_name:
-                scale = 2
-            elif "x4" in model_name:
-                scale = 4
-            elif "x8" in model_name:
-                scale = 8
-            else:
-                scale = 4
-
-            model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=scale)
-
-            upsampler = RealESRGANer(
-                scale=scale,
-                model_path=None,
-                model=model,
-                tile=0,
-                tile_pad=10,
-                pre_pad=0,
-                half=True
-            )
-            logger.info(f"Modelo Real-ESRGAN {model_name} cargado exitosamente")
-        except Exception as e:
-            logger.error(f"Error cargando modelo Real-ESRGAN: {e}")
-            raise
+    with collect_timings() as timings, collect_svg_stats() as svg_stats:
+        logger.info("Leyendo imagen...")
+        if input_key.endswith(INTERMEDIATE_EXTENSION):
+            with stage_timer("io"):
+                pixels = load_intermediate(blob_store.read(input_key))
+        else:
+            with stage_timer("io"):
+                data = blob_store.read(input_key)
+            if stages[0] == "remove_background" and settings.REMBG_REDUCED_DECODE:
+                reduced_mask = predict_reduced_mask(data)
+                if reduced_mask is not None:
+                    logger.info(f"Máscara predicha desde decodificación reducida ({reduced_mask.size[0]}x{reduced_mask.size[1]})")
+                    options = {**options, "reduced_mask": reduced_mask}
+            pixels = decode(data)
+            del data
 
-    return upsampler
+        start_time = time.time()
+        result = run_stages(pixels, stages, options, on_progress=report)
+        logger.info(f"Tiempo de procesamiento: {time.time() - start_time:.2f}s")
 
+        check_cancelled()
 
-@celery_app.task(bind=True, name="process_image")
-def process_image(self: Task, input_path: str, output_path: str) -> dict:
+        logger.info("Guardando resultado...")
+        if output_key.endswith(INTERMEDIATE_EXTENSION):
+            with stage_timer("io"):
+                blob_store.write(output_key, save_intermediate(result))
+        else:
+            output_data = encode(result, options.get("output"))
+            # A partir de acá un DELETE /task ya no la cancela (responde 409).
+            inflight_jobs.commit(cancel_id)
+            with stage_timer("io"):
+                blob_store.write(output_key, output_data)
+            with stage_timer("compress"):
+                write_precompressed(output_key, output_data)
+
+    observe_stages(timings, stages, options.get("scale"))
+
+    if input_key.endswith(INTERMEDIATE_EXTENSION):
+        blob_store.delete(input_key)
+
+    report(100)
+    store_in_cache(cache_key, output_key)
+
+    task_result = {
+        "status": "SUCCESS",
+        "output_key": output_key,
+        "filename": os.path.basename(output_key),
+    }
+    if svg_stats:
+        task_result["svg_optimization"] = svg_stats
+    return task_result
+
+
+@celery_app.task(bind=True, base=ProgressTask, name=PROCESS_IMAGE)
+def process_image(
+    self: Task,
+    input_key: str,
+    output_key: str,
+    cache_key: Optional[str] = None,
+    matting: Optional[str] = None,
+    output: Optional[dict] = None,
+) -> dict:
     try:
         logger.info("="*60)
         logger.info("INICIANDO PROCESAMIENTO DE IMAGEN")
         logger.info("="*60)
-        logger.info(f"Input: {input_path}")
-        logger.info(f"Output: {output_path}")
-        
-        self.update_state(state="PROCESSING", meta={"progress": 0})
-        
-        if not os.path.exists(input_path):
-            raise FileNotFoundError(f"Input file not found: {input_path}")
+        logger.info(f"Input: {input_key}")
+        logger.info(f"Output: {output_key}")
 
-        logger.info("Leyendo imagen...")
-        with open(input_path, "rb") as input_file:
-            input_data = input_file.read()
-
-        self.update_state(state="PROCESSING", meta={"progress": 50})
-
-        logger.info("Procesando con rembg (alpha matting para bordes finos)...")
-        session = get_session()
-
-        start_time = time.time()
-        output_data = remove(
-            input_data,
-            session=session,
-            alpha_matting=True,
-            alpha_matting_foreground_threshold=240,
-            alpha_matting_background_threshold=10,
-            alpha_matting_erode_size=10
-        )
-        process_time = time.time() - start_time
-        logger.info(f"Tiempo de procesamiento: {process_time:.2f}s")
-
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        options = {"matting": matting or settings.ALPHA_MATTING_MODE, "output": output}
+        result = run_file_pipeline(self, input_key, output_key, ["remove_background"], options, cache_key)
 
-        logger.info("Guardando resultado...")
-        with open(output_path, "wb") as output_file:
-            output_file.write(output_data)
-        
-        self.update_state(state="PROCESSING", meta={"progress": 100})
-        
         logger.info("✓ Imagen procesada exitosamente")
         logger.info("="*60)
-        
-        return {
-            "status": "SUCCESS",
-            "output_path": output_path,
-            "filename": os.path.basename(output_path),
-        }
+
+        return result
     except Exception as e:
         logger.error(f"✗ Error procesando imagen: {str(e)}", exc_info=True)
         raise
 
 
-@celery_app.task(bind=True, name="vectorize_image")
-def vectorize_image(self: Task, input_path: str, output_path: str, enhance_before: bool = False, enhance_scale: int = 4) -> dict:
-    try:
-        self.update_state(state="PROCESSING", meta={"progress": 0})
-
-        if not os.path.exists(input_path):
-            raise FileNotFoundError(f"Input file not found: {input_path}")
-
-        processed_input_path = input_path
-        temp_path = None
-
-        if enhance_before:
-            logger.info(f"Enhancing imagen antes de vectorizar (scale: {enhance_scale}x)...")
-
-            import cv2
-            import numpy as np
-
-            upsampler = get_realesrgan_upsampler()
+class BatchProgressTask(ProgressTask, Batches):
+    pass
 
-            img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
-            if img is None:
-                raise ValueError(f"Error leyendo imagen: {input_path}")
 
-            if len(img.shape) == 2:
-                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-            elif img.shape[2] == 4:
-                img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+def fail_batch_request(task: Task, request, exc: Exception) -> None:
+    record_failure("remove_background", exc)
+    task.backend.mark_as_failure(request.id, exc, request=request)
+    publish_task_event(request.id, "FAILURE", str(exc))
 
-            self.update_state(state="PROCESSING", meta={"progress": 15})
 
-            _, _, output_img = upsampler.enhance(img, outscale=enhance_scale // 4 if enhance_scale > 4 else 1)
+@celery_app.task(
+    bind=True,
+    base=BatchProgressTask,
+    name=PROCESS_IMAGE_BATCH,
+    # Los pedidos se acumulan reservados hasta el flush; no pueden esperar sin confirmar.
+    acks_late=False,
+    flush_every=settings.REMBG_BATCH_SIZE,
+    flush_interval=settings.REMBG_BATCH_INTERVAL_MS / 1000,
+)
+def process_image_batch(self: Task, requests: list) -> None:
+    with collect_timings() as timings:
+        _process_image_batch(self, requests)
+    observe_stages(timings, ["remove_background"])
 
-            temp_path = input_path.replace(os.path.splitext(input_path)[1], f"_enhanced{os.path.splitext(input_path)[1]}")
-            cv2.imwrite(temp_path, output_img)
 
-            processed_input_path = temp_path
-            self.update_state(state="PROCESSING", meta={"progress": 50})
+def _process_image_batch(task: Task, requests: list) -> None:
+    logger.info(f"Procesando lote de {len(requests)} imágenes con rembg...")
 
-        logger.info(f"Vectorizando imagen: {processed_input_path} -> {output_path}")
+    try:
+        session = get_session()
+    except Exception as e:
+        logger.error(f"✗ Error cargando el modelo para el lote: {str(e)}", exc_info=True)
+        for request in requests:
+            fail_batch_request(task, request, e)
+        return
+    input_size = model_input_size(session)
+
+    # Por imagen: (request, entrada del modelo, bytes originales si la resolución completa se decodifica después).
+    decoded = []
+    for request in requests:
+        input_key = request.args[0]
+        observe_queue_wait((getattr(request, "request_dict", None) or {}).get(ENQUEUED_AT_HEADER), "remove_background")
+        try:
+            if inflight_jobs.is_cancelled(request.id):
+                raise TaskCancelled(f"Task {request.id} was cancelled")
+            task.update_state(task_id=request.id, state="PROCESSING", meta={"progress": 0})
+            with stage_timer("io"):
+                data = blob_store.read(input_key)
+            with stage_timer("decode"):
+                small = decode_for_model(data, input_size) if settings.REMBG_REDUCED_DECODE else None
+                if small is not None:
+                    decoded.append((request, small, data))
+                else:
+                    decoded.append((request, decode_image(data), None))
+        except Exception as e:
+            logger.error(f"✗ Error leyendo imagen del lote: {str(e)}", exc_info=True)
+            fail_batch_request(task, request, e)
 
-        self.update_state(state="PROCESSING", meta={"progress": 60})
+    if not decoded:
+        return
 
-        vtracer.convert_image_to_svg_py(
-            processed_input_path,
-            output_path,
-            colormode="color",
-            hierarchical="stacked",
-            mode="spline",
-            filter_speckle=1,
-            color_precision=10,
-            layer_difference=4,
-            corner_threshold=30,
-            length_threshold=3,
-            max_iterations=20,
-            splice_threshold=25,
-            path_precision=12
-        )
+    for request, _, _ in decoded:
+        task.update_state(task_id=request.id, state="PROCESSING", meta={"progress": 50})
 
-        self.update_state(state="PROCESSING", meta={"progress": 100})
+    try:
+        start_time = time.time()
+        with stage_timer("inference"):
+            masks = predict_masks(session, [img for _, img, _ in decoded])
+        logger.info(f"Tiempo de inferencia del lote: {time.time() - start_time:.2f}s")
+    except Exception as e:
+        logger.error(f"✗ Error en inferencia del lote: {str(e)}", exc_info=True)
+        for request, _, _ in decoded:
+            fail_batch_request(task, request, e)
+        return
+
+    # Las imágenes a resolución completa se decodifican de a una, solo para el recorte final.
+    for index, ((request, img, data), mask) in enumerate(zip(decoded, masks)):
+        decoded[index] = None
+        output_key = request.args[1]
+        try:
+            if data is not None:
+                with stage_timer("decode"):
+                    img = decode_image(data)
+                with stage_timer("inference"):
+                    mask = upsample_mask(mask, img.size)
+            matting = request.kwargs.get("matting") or settings.ALPHA_MATTING_MODE
+            with stage_timer("matting"):
+                cut = cutout(img, mask, matting)
+            output_data = encode(np.asarray(cut), request.kwargs.get("output"))
+            inflight_jobs.commit(request.id)
+            with stage_timer("io"):
+                blob_store.write(output_key, output_data)
+
+            store_in_cache(request.kwargs.get("cache_key"), output_key)
+            task.backend.mark_as_done(
+                request.id,
+                {
+                    "status": "SUCCESS",
+                    "output_key": output_key,
+                    "filename": os.path.basename(output_key),
+                },
+                request=request,
+            )
+            publish_task_event(request.id, "SUCCESS", os.path.basename(output_key))
+        except Exception as e:
+            logger.error(f"✗ Error guardando imagen del lote: {str(e)}", exc_info=True)
+            fail_batch_request(task, request, e)
+
+
+@celery_app.task(bind=True, base=ProgressTask, name=VECTORIZE_IMAGE)
+def vectorize_image(
+    self: Task,
+    input_key: str,
+    output_key: str,
+    enhance_before: bool = False,
+    enhance_scale: int = 4,
+    cache_key: Optional[str] = None,
+    output: Optional[dict] = None,
+) -> dict:
+    try:
+        logger.info(f"Vectorizando imagen: {input_key} -> {output_key}")
+        if enhance_before:
+            logger.info(f"Enhancing imagen antes de vectorizar (scale: {enhance_scale}x)...")
 
-        logger.info(f"Image vectorized successfully: {output_path}")
+        stages = ["enhance", "vectorize"] if enhance_before else ["vectorize"]
+        result = run_file_pipeline(self, input_key, output_key, stages, {"scale": enhance_scale, "output": output}, cache_key)
 
-        if temp_path and os.path.exists(temp_path):
-            os.remove(temp_path)
+        logger.info(f"Image vectorized successfully: {output_key}")
 
-        return {
-            "status": "SUCCESS",
-            "output_path": output_path,
-            "filename": os.path.basename(output_path),
-        }
+        return result
     except Exception as e:
         logger.error(f"Error vectorizando imagen: {str(e)}", exc_info=True)
         raise
 
 
-@celery_app.task(bind=True, name="enhance_image")
-def enhance_image(self: Task, input_path: str, output_path: str, scale: int = 4) -> dict:
+@celery_app.task(bind=True, base=ProgressTask, name=ENHANCE_IMAGE)
+def enhance_image(
+    self: Task,
+    input_key: str,
+    output_key: str,
+    scale: int = 4,
+    cache_key: Optional[str] = None,
+    output: Optional[dict] = None,
+) -> dict:
     try:
         logger.info("="*60)
         logger.info("INICIANDO ENHANCEMENT DE IMAGEN")
         logger.info("="*60)
-        logger.info(f"Input: {input_path}")
-        logger.info(f"Output: {output_path}")
+        logger.info(f"Input: {input_key}")
+        logger.info(f"Output: {output_key}")
         logger.info(f"Scale: {scale}x")
 
-        self.update_state(state="PROCESSING", meta={"progress": 0})
-
-        if not os.path.exists(input_path):
-            raise FileNotFoundError(f"Input file not found: {input_path}")
-
-        if scale not in [2, 4, 8]:
-            raise ValueError(f"Invalid scale: {scale}. Must be 2, 4, or 8")
-
-        import cv2
-        import numpy as np
-
-        logger.info("Leyendo imagen...")
-        img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
-
-        if img is None:
-            raise ValueError(f"Error leyendo imagen: {input_path}")
-
-        self.update_state(state="PROCESSING", meta={"progress": 10})
+        result = run_file_pipeline(self, input_key, output_key, ["enhance"], {"scale": scale, "output": output}, cache_key)
 
-        if len(img.shape) == 2:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-            logger.info("Imagen escala de grises convertida a BGR")
-        elif img.shape[2] == 4:
-            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-            logger.info("Imagen BGRA convertida a BGR")
-
-        self.update_state(state="PROCESSING", meta={"progress": 20})
-
-        logger.info("Cargando modelo Real-ESRGAN...")
-        upsampler = get_realesrgan_upsampler()
-
-        logger.info(f"Aplicando super resolución ({scale}x)...")
-        start_time = time.time()
-
-        if upsampler.scale != scale:
-            logger.warning(f"Modelo escala {upsampler.scale}x, solicitado {scale}x. Usando modelo disponible.")
-
-        _, _, output_img = upsampler.enhance(img, outscale=scale // 4 if scale > 4 else 1)
-
-        process_time = time.time() - start_time
-        logger.info(f"Tiempo de enhancement: {process_time:.2f}s")
+        logger.info("✓ Imagen enhanced exitosamente")
+        logger.info("="*60)
 
-        self.update_state(state="PROCESSING", meta={"progress": 90})
+        return result
+    except Exception as e:
+        logger.error(f"✗ Error en enhancement: {str(e)}", exc_info=True)
+        raise
 
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-        logger.info("Guardando resultado...")
-        cv2.imwrite(output_path, output_img)
+@celery_app.task(bind=True, base=ProgressTask, name=RUN_PIPELINE)
+def run_pipeline_task(
+    self: Task,
+    input_key: str,
+    output_key: str,
+    stages: List[str],
+    scale: int = 4,
+    cache_key: Optional[str] = None,
+    report_as: Optional[str] = None,
+    progress_range: Optional[List[int]] = None,
+    matting: Optional[str] = None,
+    output: Optional[dict] = None,
+) -> dict:
+    try:
+        logger.info("="*60)
+        logger.info(f"INICIANDO PIPELINE: {' -> '.join(stages)}")
+        logger.info("="*60)
+        logger.info(f"Input: {input_key}")
+        logger.info(f"Output: {output_key}")
 
-        self.update_state(state="PROCESSING", meta={"progress": 100})
+        result = run_file_pipeline(
+            self, input_key, output_key, stages,
+            {"scale": scale, "matting": matting or settings.ALPHA_MATTING_MODE, "output": output}, cache_key,
+            report_as=report_as, progress_range=progress_range,
+        )
 
-        logger.info("✓ Imagen enhanced exitosamente")
+        logger.info("✓ Pipeline completado exitosamente")
         logger.info("="*60)
 
-        return {
-            "status": "SUCCESS",
-            "output_path": output_path,
-            "filename": os.path.basename(output_path),
-        }
+        return result
     except Exception as e:
-        logger.error(f"✗ Error en enhancement: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        logger.error(f"✗ Error en pipeline: {str(e)}", exc_info=True)
+        raise
@@ -0,0 +1,120 @@
+import logging
+import math
+
+import cv2
+import numpy as np
+import torch
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+TILE_ALIGN = 32
+MIN_TILE_SIZE = 64
+
+
+def activation_elements_per_pixel(scale: int, compact: bool = False) -> int:
+    """Rough peak activation count per input pixel.
+
+    RRDBNet keeps trunk features plus upsampling stages; SRVGGNetCompact runs every conv at
+    input resolution and only upsamples its last layer with pixel shuffle.
+    """
+    if compact:
+        return 128 + 3 * scale * scale
+    return 256 + 128 * scale * scale
+
+
+def choose_tile_size(
+    height: int, width: int, scale: int, element_size: int, budget_bytes: int, tile_pad: int, compact: bool = False,
+) -> int:
+    """Largest square tile whose activations fit in the budget; 0 means the whole image fits."""
+    max_pixels = budget_bytes // (activation_elements_per_pixel(scale, compact) * element_size)
+
+    if height * width <= max_pixels:
+        return 0
+
+    side = int(math.sqrt(max_pixels)) - 2 * tile_pad
+    return max(MIN_TILE_SIZE, side // TILE_ALIGN * TILE_ALIGN)
+
+
+def _run_model(upsampler, tile: np.ndarray) -> np.ndarray:
+    height, width = tile.shape[:2]
+    scale = upsampler.scale
+
+    tensor = torch.from_numpy(np.ascontiguousarray(tile.transpose(2, 0, 1))).float().div_(255.0)
+    tensor = tensor.unsqueeze(0).to(upsampler.device)
+    if upsampler.half:
+        tensor = tensor.half()
+
+    # Los modelos x2/x1 usan pixel-unshuffle y necesitan dimensiones múltiplo de 2/4.
+    mod = {2: 2, 1: 4}.get(scale)
+    if mod:
+        pad_h = (mod - height % mod) % mod
+        pad_w = (mod - width % mod) % mod
+        if pad_h or pad_w:
+            tensor = torch.nn.functional.pad(tensor, (0, pad_w, 0, pad_h), "reflect")
+
+    with torch.no_grad():
+        output = upsampler.model(tensor)
+
+    output = output[:, :, :height * scale, :width * scale]
+    output = output.squeeze(0).float().clamp_(0, 1).cpu().numpy().transpose(1, 2, 0)
+    return (output * 255.0).round().astype(np.uint8)
+
+
+def _resample_tile(sr: np.ndarray, ratio: float, tx0: int, ty0: int, tx1: int, ty1: int, sx0: int, sy0: int) -> np.ndarray:
+    """Output pixels [ty0:ty1, tx0:tx1] of the whole image resized to outscale, taken from one padded tile.
+
+    Samples the same positions a single cv2.resize of the stitched image would, and the
+    Lanczos kernel reads the tile's padding instead of stopping at its edge, so no seams.
+    (sx0, sy0) is where the padded tile starts in model-scale coordinates.
+    """
+    matrix = np.array([
+        [ratio, 0.0, (tx0 + 0.5) * ratio - 0.5 - sx0],
+        [0.0, ratio, (ty0 + 0.5) * ratio - 0.5 - sy0],
+    ])
+    return cv2.warpAffine(
+        sr, matrix, (tx1 - tx0, ty1 - ty0),
+        flags=cv2.INTER_LANCZOS4 | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def enhance_tiled(upsampler, img: np.ndarray, outscale: float) -> np.ndarray:
+    """Super-resolve an RGB image tile by tile into a preallocated output of size outscale × input.
+
+    Each tile is processed with tile_pad pixels of context that are cropped away, so peak
+    model memory depends on the tile size chosen from REALESRGAN_MEMORY_BUDGET_MB, not
+    on the image size.
+    """
+    height, width = img.shape[:2]
+    scale = upsampler.scale
+    tile_pad = settings.REALESRGAN_TILE_PAD
+    element_size = 2 if upsampler.half else 4
+    budget_bytes = settings.REALESRGAN_MEMORY_BUDGET_MB * 1024 * 1024
+
+    compact = type(upsampler.model).__name__ == "SRVGGNetCompact"
+
+    tile = choose_tile_size(height, width, scale, element_size, budget_bytes, tile_pad, compact) or max(height, width)
+    logger.info(f"Real-ESRGAN: imagen {width}x{height}, tile {tile}px, outscale {outscale}")
+
+    output = np.empty((int(round(height * outscale)), int(round(width * outscale)), 3), dtype=np.uint8)
+
+    for y0 in range(0, height, tile):
+        for x0 in range(0, width, tile):
+            y1 = min(y0 + tile, height)
+            x1 = min(x0 + tile, width)
+            py0 = max(y0 - tile_pad, 0)
+            px0 = max(x0 - tile_pad, 0)
+            py1 = min(y1 + tile_pad, height)
+            px1 = min(x1 + tile_pad, width)
+
+            sr = _run_model(upsampler, img[py0:py1, px0:px1])
+
+            ty0, ty1 = int(round(y0 * outscale)), int(round(y1 * outscale))
+            tx0, tx1 = int(round(x0 * outscale)), int(round(x1 * outscale))
+            if outscale == scale:
+                output[ty0:ty1, tx0:tx1] = sr[(y0 - py0) * scale:(y1 - py0) * scale, (x0 - px0) * scale:(x1 - px0) * scale]
+            else:
+                output[ty0:ty1, tx0:tx1] = _resample_tile(sr, scale / outscale, tx0, ty0, tx1, ty1, px0 * scale, py0 * scale)
+
+    return output
@@ -0,0 +1,360 @@
+import hashlib
+import os
+import uuid
+import zipfile
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+from .blobstore import blob_store
+from .storage import spool_path, upload_key
+
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+ARCHIVE_EXTENSIONS = {".zip"}
+
+MAX_FIELD_SIZE = 1024
+# Holgura para boundaries, headers de cada parte y campos del formulario.
+FORM_OVERHEAD = 64 * 1024
+SNIFF_SIZE = 16
+CHUNK_SIZE = 64 * 1024
+
+IMAGE_SIGNATURES = {
+    "jpeg": lambda head: head.startswith(b"\xff\xd8\xff"),
+    "png": lambda head: head.startswith(b"\x89PNG\r\n\x1a\n"),
+    "webp": lambda head: head[:4] == b"RIFF" and head[8:12] == b"WEBP",
+}
+
+
+def too_large_error(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"File too large. Maximum size: {max_size / (1024 * 1024)}MB"
+    )
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    for image_format, matches in IMAGE_SIGNATURES.items():
+        if matches(head):
+            return image_format
+    return None
+
+
+# Marcadores SOF de JPEG (baseline, progresivo, aritmético...); no incluye DHT (C4), JPG (C8) ni DAC (CC).
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_dimensions(f) -> Optional[Tuple[int, int]]:
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0xD9 or marker == 0xDA:
+            return None
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            continue
+        length = int.from_bytes(f.read(2), "big")
+        if marker in JPEG_SOF_MARKERS:
+            segment = f.read(5)
+            if len(segment) < 5:
+                return None
+            return int.from_bytes(segment[3:5], "big"), int.from_bytes(segment[1:3], "big")
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def image_dimensions(path: str, image_format: Optional[str]) -> Optional[Tuple[int, int]]:
+    """(width, height) read from the file header; the API image has no decoder to ask."""
+    try:
+        with open(path, "rb") as f:
+            if image_format == "jpeg":
+                return _jpeg_dimensions(f)
+            head = f.read(32)
+    except OSError:
+        return None
+
+    if image_format == "png" and len(head) >= 24:
+        return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+    if image_format == "webp" and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b"VP8 ":
+            return int.from_bytes(head[26:28], "little") & 0x3FFF, int.from_bytes(head[28:30], "little") & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(head[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+
+@dataclass
+class StoredUpload:
+    field_name: str
+    original_filename: str
+    filename: str
+    key: str
+    spool_path: str
+    size: int = 0
+    content_hash: str = ""
+    image_format: Optional[str] = None
+    dimensions: Optional[Tuple[int, int]] = None
+
+    @property
+    def is_archive(self) -> bool:
+        return self.image_format == "zip"
+
+    def commit(self) -> None:
+        """Move the spooled file into the blob store; blocking (a multipart upload on S3)."""
+        blob_store.put_file(self.key, self.spool_path)
+
+    def discard(self) -> None:
+        # Los ZIP nunca salen del spool; las imágenes ya confirmadas viven en el store.
+        if os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+        else:
+            blob_store.delete(self.key)
+
+
+class UploadWriter:
+    """Spools one incoming file to local disk chunk by chunk.
+
+    The size limit, the sha256 content hash and the file signature check all happen
+    as the bytes arrive, so no upload is ever held in memory. The caller commits the
+    spooled file to the blob store (StoredUpload.commit) outside the parser callbacks.
+    """
+
+    def __init__(self, field_name: str, original_filename: str, allow_archive: bool = False):
+        original_filename = os.path.basename(original_filename)
+        if not original_filename:
+            raise HTTPException(status_code=400, detail="No file provided")
+
+        ext = os.path.splitext(original_filename)[1].lower()
+        allowed = ALLOWED_EXTENSIONS | ARCHIVE_EXTENSIONS if allow_archive else ALLOWED_EXTENSIONS
+        if ext not in allowed:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File type not allowed. Allowed: {', '.join(allowed)}"
+            )
+
+        self.is_archive = ext in ARCHIVE_EXTENSIONS
+        self.max_size = settings.BATCH_MAX_ARCHIVE_SIZE if self.is_archive else settings.MAX_FILE_SIZE
+
+        filename = f"{uuid.uuid4()}{ext}"
+        self.upload = StoredUpload(
+            field_name=field_name,
+            original_filename=original_filename,
+            filename=filename,
+            key=upload_key(filename),
+            spool_path=spool_path(filename),
+        )
+        self._head = b""
+        self._hasher = hashlib.sha256()
+
+        self._handle = open(self.upload.spool_path, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.upload.size += len(chunk)
+        if self.upload.size > self.max_size:
+            raise too_large_error(self.max_size)
+
+        if len(self._head) < SNIFF_SIZE:
+            self._head += chunk[:SNIFF_SIZE - len(self._head)]
+
+        self._hasher.update(chunk)
+        self._handle.write(chunk)
+
+    def close(self) -> StoredUpload:
+        self._handle.close()
+
+        if self.is_archive:
+            if not self._head.startswith(b"PK\x03\x04"):
+                raise HTTPException(status_code=400, detail="File content is not a ZIP archive")
+            self.upload.image_format = "zip"
+        else:
+            self.upload.image_format = sniff_image_format(self._head)
+            if self.upload.image_format is None:
+                raise HTTPException(status_code=400, detail="File content is not a supported image")
+
+        self.upload.content_hash = self._hasher.hexdigest()
+        if not self.is_archive:
+            self.upload.dimensions = image_dimensions(self.upload.spool_path, self.upload.image_format)
+        return self.upload
+
+    def abort(self) -> None:
+        self._handle.close()
+        if os.path.exists(self.upload.spool_path):
+            os.remove(self.upload.spool_path)
+
+
+@dataclass
+class _Part:
+    headers: Dict[bytes, bytes] = field(default_factory=dict)
+    header_field: bytes = b""
+    header_value: bytes = b""
+    name: str = ""
+    value: bytes = b""
+    writer: Optional[UploadWriter] = None
+
+
+class MultipartIngest:
+    """Parses a multipart body as it arrives, streaming file parts through UploadWriter."""
+
+    def __init__(self, boundary: bytes, max_files: int, allow_archive: bool = False):
+        self.max_files = max_files
+        self.allow_archive = allow_archive
+        self.fields: Dict[str, str] = {}
+        self.uploads: List[StoredUpload] = []
+        self._part = _Part()
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def write(self, chunk: bytes) -> None:
+        self._parser.write(chunk)
+
+    def finalize(self) -> None:
+        self._parser.finalize()
+
+    def abort(self) -> None:
+        if self._part.writer is not None:
+            self._part.writer.abort()
+            self._part.writer = None
+        for upload in self.uploads:
+            upload.discard()
+
+    def _on_part_begin(self) -> None:
+        self._part = _Part()
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._part.header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._part.header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._part.headers[self._part.header_field.lower()] = self._part.header_value
+        self._part.header_field = b""
+        self._part.header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._part.headers.get(b"content-disposition", b""))
+        self._part.name = options.get(b"name", b"").decode("latin-1")
+        original_filename = options.get(b"filename")
+        if original_filename is None:
+            return
+
+        if len(self.uploads) >= self.max_files:
+            raise HTTPException(status_code=400, detail=f"Too many files. Maximum: {self.max_files}")
+
+        self._part.writer = UploadWriter(
+            self._part.name,
+            original_filename.decode("utf-8", "replace"),
+            allow_archive=self.allow_archive,
+        )
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        chunk = data[start:end]
+        part = self._part
+
+        if part.writer is None:
+            part.value += chunk
+            if len(part.value) > MAX_FIELD_SIZE:
+                raise HTTPException(status_code=400, detail=f"Form field too large: {part.name}")
+            return
+
+        part.writer.write(chunk)
+
+    def _on_part_end(self) -> None:
+        part = self._part
+
+        if part.writer is None:
+            self.fields[part.name] = part.value.decode("utf-8", "replace")
+            return
+
+        self.uploads.append(part.writer.close())
+        part.writer = None
+
+
+async def receive_multipart(
+    request: Request,
+    max_files: int = 1,
+    allow_archive: bool = False,
+) -> Tuple[Dict[str, str], List[StoredUpload]]:
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+
+    max_size = max(settings.MAX_FILE_SIZE, settings.BATCH_MAX_ARCHIVE_SIZE if allow_archive else 0)
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        if int(content_length) > max_files * (max_size + FORM_OVERHEAD):
+            raise too_large_error(max_size)
+
+    ingest = MultipartIngest(options[b"boundary"], max_files, allow_archive=allow_archive)
+    try:
+        async for chunk in request.stream():
+            ingest.write(chunk)
+        ingest.finalize()
+        # El parser corre en el event loop; subir al store (S3) no.
+        for upload in ingest.uploads:
+            if not upload.is_archive:
+                await run_in_threadpool(upload.commit)
+    except MultipartParseError:
+        ingest.abort()
+        raise HTTPException(status_code=400, detail="Malformed multipart body")
+    except BaseException:
+        ingest.abort()
+        raise
+
+    return ingest.fields, ingest.uploads
+
+
+def extract_archive(archive: StoredUpload, max_files: int) -> List[StoredUpload]:
+    """Unpack the images of a spooled ZIP upload, streaming each entry through UploadWriter."""
+    uploads: List[StoredUpload] = []
+    try:
+        with zipfile.ZipFile(archive.spool_path) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or os.path.basename(info.filename).startswith("."):
+                    continue
+                if os.path.splitext(info.filename)[1].lower() not in ALLOWED_EXTENSIONS:
+                    continue
+                if len(uploads) >= max_files:
+                    raise HTTPException(status_code=400, detail=f"Too many files. Maximum: {max_files}")
+
+                writer = UploadWriter(archive.field_name, info.filename)
+                try:
+                    with zf.open(info) as entry:
+                        while chunk := entry.read(CHUNK_SIZE):
+                            writer.write(chunk)
+                    upload = writer.close()
+                    upload.commit()
+                    uploads.append(upload)
+                except BaseException:
+                    writer.abort()
+                    raise
+    except zipfile.BadZipFile:
+        for upload in uploads:
+            upload.discard()
+        raise HTTPException(status_code=400, detail="Invalid ZIP archive")
+    except BaseException:
+        for upload in uploads:
+            upload.discard()
+        raise
+    finally:
+        archive.discard()
+
+    return uploads
@@ -0,0 +1,166 @@
+"""Pick vtracer parameters, and how much to shrink the input, from the image itself.
+
+A flat 200px logo and a 6000px upscaled photo need very different settings: the first
+traces in milliseconds with coarse layering, the second can run for minutes with the
+fine-grained settings that used to be hard-coded. The plan keeps the expected trace
+time inside VECTORIZE_TIME_BUDGET by downscaling (the SVG keeps the original size
+through its viewBox) and, for photos, palette-quantizing before tracing.
+"""
+import logging
+import math
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+PRESETS = {
+    "flat": {
+        "colormode": "color",
+        "hierarchical": "stacked",
+        "mode": "spline",
+        "filter_speckle": 4,
+        "color_precision": 6,
+        "layer_difference": 16,
+        "corner_threshold": 60,
+        "length_threshold": 4.0,
+        "max_iterations": 10,
+        "splice_threshold": 45,
+        "path_precision": 3,
+    },
+    "illustration": {
+        "colormode": "color",
+        "hierarchical": "stacked",
+        "mode": "spline",
+        "filter_speckle": 2,
+        "color_precision": 8,
+        "layer_difference": 8,
+        "corner_threshold": 45,
+        "length_threshold": 3.5,
+        "max_iterations": 10,
+        "splice_threshold": 45,
+        "path_precision": 3,
+    },
+    "photo": {
+        "colormode": "color",
+        "hierarchical": "stacked",
+        "mode": "spline",
+        "filter_speckle": 4,
+        "color_precision": 6,
+        "layer_difference": 12,
+        "corner_threshold": 60,
+        "length_threshold": 4.0,
+        "max_iterations": 10,
+        "splice_threshold": 45,
+        "path_precision": 3,
+    },
+    # Los parámetros fijos de antes, para quien necesite el máximo detalle.
+    "detailed": {
+        "colormode": "color",
+        "hierarchical": "stacked",
+        "mode": "spline",
+        "filter_speckle": 1,
+        "color_precision": 10,
+        "layer_difference": 4,
+        "corner_threshold": 30,
+        "length_threshold": 3,
+        "max_iterations": 20,
+        "splice_threshold": 25,
+        "path_precision": 12,
+    },
+}
+
+# Megapíxeles por segundo que vtracer traza con cada preset (medido en CPU, orden de magnitud).
+PRESET_THROUGHPUT_MPX = {"flat": 8.0, "illustration": 3.0, "photo": 1.0, "detailed": 0.25}
+
+FLAT_MAX_COLORS = 32
+ILLUSTRATION_MAX_COLORS = 512
+
+# Lado de la muestra usada para contar colores; el conteo no necesita la imagen completa.
+COLOR_SAMPLE_SIDE = 256
+
+
+@dataclass
+class VectorizePlan:
+    preset: str
+    colors: int
+    scale: float
+    quantize_colors: int
+
+    @property
+    def options(self) -> dict:
+        return PRESETS[self.preset]
+
+
+def count_colors(pixels: np.ndarray) -> int:
+    """Distinct colors at 5 bits per channel on a strided sample, ignoring transparent pixels."""
+    height, width = pixels.shape[:2]
+    step = max(1, int(math.ceil(max(height, width) / COLOR_SAMPLE_SIDE)))
+    sample = pixels[::step, ::step]
+    if sample.shape[2] == 4:
+        sample = sample[sample[:, :, 3] > 0][:, :3]
+    else:
+        sample = sample.reshape(-1, 3)
+    if sample.size == 0:
+        return 0
+
+    reduced = (sample >> 3).astype(np.uint32)
+    keys = (reduced[:, 0] << 10) | (reduced[:, 1] << 5) | reduced[:, 2]
+    return int(np.unique(keys).size)
+
+
+def plan_vectorize(pixels: np.ndarray, preset: str = "auto") -> VectorizePlan:
+    colors = count_colors(pixels)
+    if preset == "auto":
+        if colors <= FLAT_MAX_COLORS:
+            preset = "flat"
+        elif colors <= ILLUSTRATION_MAX_COLORS:
+            preset = "illustration"
+        else:
+            preset = "photo"
+
+    height, width = pixels.shape[:2]
+    budget_pixels = settings.VECTORIZE_TIME_BUDGET * PRESET_THROUGHPUT_MPX[preset] * 1_000_000
+    max_pixels = min(settings.VECTORIZE_MAX_PIXELS, budget_pixels)
+    scale = min(1.0, math.sqrt(max_pixels / (height * width)))
+
+    quantize_colors = 0
+    if preset == "photo" and 0 < settings.VECTORIZE_QUANTIZE_COLORS < colors:
+        quantize_colors = settings.VECTORIZE_QUANTIZE_COLORS
+
+    return VectorizePlan(preset=preset, colors=colors, scale=scale, quantize_colors=quantize_colors)
+
+
+def prepare_pixels(pixels: np.ndarray, plan: VectorizePlan) -> np.ndarray:
+    """Apply the plan's downscale and palette reduction; returns RGBA pixels ready for vtracer."""
+    if plan.scale < 1.0:
+        height, width = pixels.shape[:2]
+        size = (max(1, round(width * plan.scale)), max(1, round(height * plan.scale)))
+        pixels = cv2.resize(pixels, size, interpolation=cv2.INTER_AREA)
+
+    if plan.quantize_colors:
+        img = Image.fromarray(pixels)
+        method = Image.Quantize.FASTOCTREE if img.mode == "RGBA" else Image.Quantize.MEDIANCUT
+        pixels = np.asarray(img.quantize(colors=plan.quantize_colors, method=method).convert(img.mode))
+
+    if pixels.shape[2] == 3:
+        height, width = pixels.shape[:2]
+        pixels = np.dstack([pixels, np.full((height, width), 255, dtype=np.uint8)])
+    return pixels
+
+
+def restore_size(svg: str, traced_size, original_size) -> str:
+    """Make a downscaled trace render at the original size through a viewBox."""
+    traced_width, traced_height = traced_size
+    width, height = original_size
+    if (traced_width, traced_height) == (width, height):
+        return svg
+    return svg.replace(
+        f'width="{traced_width}" height="{traced_height}"',
+        f'width="{width}" height="{height}" viewBox="0 0 {traced_width} {traced_height}"',
+        1,
+    )
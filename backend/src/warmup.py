@@ -0,0 +1,104 @@
+"""Load and warm up the models each worker process needs before it accepts tasks.
+
+Celery only hands tasks to a prefork child once worker_process_init returns, so the
+first request after a deploy runs against loaded, already-exercised models.
+"""
+import logging
+import os
+import time
+from typing import List, Set
+
+import numpy as np
+from celery.signals import worker_process_init, worker_process_shutdown
+from PIL import Image
+
+from .celery_app import celery_app
+from .config import settings
+from .cpu_profile import configure_inference_process, inference_queue
+from .models import get_realesrgan_upsampler, get_session
+from .segmentation import batch_limit, predict_masks
+from .tiling import enhance_tiled
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up_rembg() -> None:
+    session = get_session()
+    predict_masks(session, [Image.new("RGB", (64, 64), (128, 128, 128))])
+    if settings.REMBG_BATCH_SIZE > 1 and batch_limit(session) == 1:
+        # Con el batch fijo cada imagen va en su propia pasada: agrupar solo suma la espera del flush.
+        logger.warning(
+            f"El modelo {session.model_name} tiene el batch fijo en 1: REMBG_BATCH_SIZE={settings.REMBG_BATCH_SIZE} "
+            f"no agrupa nada y agrega hasta {settings.REMBG_BATCH_INTERVAL_MS}ms por tarea. "
+            f"Usá REMBG_BATCH_SIZE=1 o un export ONNX con batch dinámico."
+        )
+
+
+def warm_up_realesrgan() -> None:
+    upsampler = get_realesrgan_upsampler()
+    enhance_tiled(upsampler, np.full((32, 32, 3), 128, dtype=np.uint8), outscale=upsampler.scale)
+
+
+WARMUPS = {
+    "rembg": warm_up_rembg,
+    "realesrgan": warm_up_realesrgan,
+}
+
+
+def worker_queues() -> Set[str]:
+    # -Q deja la selección en consume_from antes del fork; sin -Q se consumen todas.
+    queues = celery_app.amqp.queues
+    return set(queues.consume_from or queues)
+
+
+def models_for_queues(queues: Set[str]) -> List[str]:
+    """Only the inference (GPU) queue runs models; the CPU queue (vtracer) needs none."""
+    return list(WARMUPS) if inference_queue() in queues else []
+
+
+def pool_names(queues: Set[str]) -> List[str]:
+    names = {inference_queue(): "gpu", settings.CPU_QUEUE: "cpu"}
+    return [names[queue] for queue in queues if queue in names]
+
+
+def ready_path(pool: str) -> str:
+    return os.path.join(settings.WORKER_READY_DIR, pool)
+
+
+@worker_process_init.connect
+def warm_up_worker_process(**kwargs):
+    queues = worker_queues()
+    if inference_queue() in queues:
+        configure_inference_process()
+
+    if not settings.WORKER_WARMUP:
+        return
+
+    ready = True
+    for model in models_for_queues(queues):
+        start_time = time.time()
+        try:
+            WARMUPS[model]()
+            logger.info(f"Modelo {model} cargado y precalentado en {time.time() - start_time:.2f}s")
+        except Exception as e:
+            # El proceso sigue vivo y carga el modelo en la primera tarea, pero no se marca listo.
+            logger.error(f"Error precalentando {model}: {e}", exc_info=True)
+            ready = False
+
+    if ready:
+        os.makedirs(settings.WORKER_READY_DIR, exist_ok=True)
+        for pool in pool_names(queues):
+            with open(ready_path(pool), "w") as f:
+                f.write(str(os.getpid()))
+
+
+@worker_process_shutdown.connect
+def clear_ready_marker(pid=None, **kwargs):
+    pid = str(pid or os.getpid())
+    for pool in pool_names(worker_queues()):
+        try:
+            with open(ready_path(pool)) as f:
+                if f.read().strip() == pid:
+                    os.remove(ready_path(pool))
+        except OSError:
+            pass
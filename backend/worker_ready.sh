@@ -0,0 +1,9 @@
+#!/bin/bash
+# Healthcheck: el contenedor está listo cuando cada pool de WORKER_QUEUES precalentó sus modelos.
+WORKER_READY_DIR="${WORKER_READY_DIR:-/tmp/worker-ready}"
+WORKER_QUEUES="${WORKER_QUEUES:-gpu,cpu}"
+
+for pool in ${WORKER_QUEUES//,/ }; do
+    [ -f "$WORKER_READY_DIR/$pool" ] || exit 1
+done
+exit 0
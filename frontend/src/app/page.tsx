@@ -1,6 +1,6 @@
 'use client'
 
-import { useState, useEffect, useCallback } from 'react'
+import { useState, useEffect, useCallback, useRef } from 'react'
 import { useDropzone } from 'react-dropzone'
 import { Upload, Download, X, Image as ImageIcon, FileText, Check, AlertCircle, Sparkles, Maximize2 } from 'lucide-react'
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs'
@@ -14,6 +14,8 @@ import { VectorDisplay } from '@/components/ui-comparison/vector-display'
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
 const MAX_IMAGES = 10
+// Si el stream SSE falla (proxy que lo corta, API reiniciando) se vuelve a consultar /status.
+const STATUS_POLL_INTERVAL_MS = 2000
 
 type TaskType = 'remove_background' | 'vectorize'
 type ScaleType = 2 | 4 | 8
@@ -47,6 +49,8 @@ export default function Home() {
   const [vectorizeImages, setVectorizeImages] = useState<ImageProcess[]>([])
   const [scale, setScale] = useState<ScaleType>(4)
   const [enhanceBeforeVectorize, setEnhanceBeforeVectorize] = useState(false)
+  const eventSources = useRef<Map<string, EventSource>>(new Map())
+  const statusPollers = useRef<Map<string, ReturnType<typeof setInterval>>>(new Map())
 
   const getImages = (taskType: TaskType) =>
     taskType === 'remove_background' ? removeBgImages : vectorizeImages
@@ -157,59 +161,108 @@ export default function Home() {
   })
 
   useEffect(() => {
-    const checkStatus = async (taskId: string, taskType: TaskType) => {
-      try {
-        const response = await fetch(`${API_URL}/status/${taskId}`)
-        if (!response.ok) return
+    const applyStatus = (taskId: string, taskType: TaskType, data: StatusResponse) => {
+      setImages(taskType, (prev: ImageProcess[]) => prev.map(img => {
+        if (img.taskId === taskId) {
+          const updates: Partial<ImageProcess> = { status: data.status }
+
+          if (data.status === 'PROCESSING' && typeof data.result === 'number') {
+            updates.progress = data.result
+          }
+
+          if (data.status === 'SUCCESS' && typeof data.result === 'string') {
+            updates.processedUrl = `${API_URL}/result/${data.result}`
+            updates.progress = 100
+          }
 
-        const data: StatusResponse = await response.json()
+          if (data.status === 'FAILURE') {
+            updates.error = 'Error processing image'
+            updates.status = null
+          }
 
-        setImages(taskType, (prev: ImageProcess[]) => prev.map(img => {
-          if (img.taskId === taskId) {
-            const updates: Partial<ImageProcess> = { status: data.status }
+          return { ...img, ...updates }
+        }
+        return img
+      }))
+    }
 
-            if (data.status === 'PROCESSING' && typeof data.result === 'number') {
-              updates.progress = data.result
-            }
+    const stopPolling = (taskId: string) => {
+      const poller = statusPollers.current.get(taskId)
+      if (poller) clearInterval(poller)
+      statusPollers.current.delete(taskId)
+    }
 
-            if (data.status === 'SUCCESS' && typeof data.result === 'string') {
-              updates.processedUrl = `${API_URL}/result/${data.result}`
-              updates.progress = 100
-            }
+    const startPolling = (taskId: string, taskType: TaskType) => {
+      if (statusPollers.current.has(taskId)) return
 
-            if (data.status === 'FAILURE') {
-              updates.error = 'Error processing image'
-              updates.status = null
-            }
+      const checkStatus = async () => {
+        try {
+          const response = await fetch(`${API_URL}/status/${taskId}`)
+          if (!response.ok) return
 
-            return { ...img, ...updates }
+          const data: StatusResponse = await response.json()
+          applyStatus(taskId, taskType, data)
+          if (data.status === 'SUCCESS' || data.status === 'FAILURE') {
+            stopPolling(taskId)
           }
-          return img
-        }))
-      } catch (err) {
-        console.error('Error checking status:', err)
+        } catch (err) {
+          console.error('Error checking status:', err)
+        }
       }
+
+      statusPollers.current.set(taskId, setInterval(checkStatus, STATUS_POLL_INTERVAL_MS))
+      checkStatus()
     }
 
-    const checkAllStatuses = (taskType: TaskType) => {
+    const subscribeAll = (taskType: TaskType) => {
       const images = getImages(taskType)
       images.forEach(img => {
-        if (img.taskId && (img.status === 'PENDING' || img.status === 'PROCESSING')) {
-          checkStatus(img.taskId, taskType)
+        if (!img.taskId || eventSources.current.has(img.taskId) || statusPollers.current.has(img.taskId)) return
+        if (img.status !== 'PENDING' && img.status !== 'PROCESSING') return
+
+        const taskId = img.taskId
+        const source = new EventSource(`${API_URL}/events/${taskId}`)
+        source.onmessage = (event) => {
+          const data: StatusResponse = JSON.parse(event.data)
+          applyStatus(taskId, taskType, data)
+
+          if (data.status === 'SUCCESS' || data.status === 'FAILURE') {
+            source.close()
+            eventSources.current.delete(taskId)
+          }
+        }
+        source.onerror = () => {
+          source.close()
+          eventSources.current.delete(taskId)
+          startPolling(taskId, taskType)
         }
+        eventSources.current.set(taskId, source)
       })
     }
 
-    const intervalRemoveBg = setInterval(() => checkAllStatuses('remove_background'), 2000)
-    const intervalVectorize = setInterval(() => checkAllStatuses('vectorize'), 2000)
+    subscribeAll('remove_background')
+    subscribeAll('vectorize')
+  }, [removeBgImages, vectorizeImages])
 
+  useEffect(() => {
+    const sources = eventSources.current
+    const pollers = statusPollers.current
     return () => {
-      clearInterval(intervalRemoveBg)
-      clearInterval(intervalVectorize)
+      sources.forEach(source => source.close())
+      sources.clear()
+      pollers.forEach(poller => clearInterval(poller))
+      pollers.clear()
     }
-  }, [removeBgImages, vectorizeImages])
+  }, [])
 
-  const handleRemoveImage = useCallback((index: number, taskType: TaskType) => {
+  const handleRemoveImage = useCallback((index: number, taskType: TaskType, taskId: string | null) => {
+    if (taskId) {
+      eventSources.current.get(taskId)?.close()
+      eventSources.current.delete(taskId)
+      const poller = statusPollers.current.get(taskId)
+      if (poller) clearInterval(poller)
+      statusPollers.current.delete(taskId)
+    }
     setImages(taskType, prev => prev.filter((_, i) => i !== index))
   }, [])
 
@@ -269,7 +322,7 @@ export default function Home() {
             <Button
               variant="ghost"
               size="icon"
-              onClick={() => handleRemoveImage(index, taskType)}
+              onClick={() => handleRemoveImage(index, taskType, img.taskId)}
               className="shrink-0"
             >
               <X className="h-4 w-4" />